@@ -1,7 +1,6 @@
 """Startup file. Initializes application"""
 import os
 import logging
-import shutil
 from logging.handlers import RotatingFileHandler
 
 from flask import Flask
@@ -49,19 +48,9 @@ images = UploadSet('images', IMAGES,
 if not os.path.exists(app.config['VAR_FOLDER']):
     os.mkdir(app.config['VAR_FOLDER'])
 
-# Set up image storage locations and placeholders
+# The files are kept in the blob storage of app.storage, which creates its folders when needed. The upload sets only
+# validate uploads. The placeholder is served from the static folder
 upload_sets = ('thumbnails', 'images')
-for u_set in upload_sets:
-    path = os.path.join(app.config['VAR_FOLDER'], u_set)
-    if not os.path.isdir(path):
-        logging.debug('Config var folder location {}'.format(app.config['VAR_FOLDER']))
-        app.logger.info('Creating folder and placeholder for upload_set {} at {}'.format(u_set, path))
-        os.mkdir(path)
-    try:
-        shutil.copy2(os.path.join(app.config['STATIC_FOLDER'], 'images', 'placeholder.png'), path)
-    except FileNotFoundError:
-        with open(os.path.join(path, 'placeholder.png'), 'a') as f:
-            app.logger.warning('Could not find static placeholder image, using empty file')
 
 configure_uploads(app, (thumbnails, images))
 patch_request_class(app)  # set maximum file size, default is 16MB
@@ -74,4 +63,5 @@ login = LoginManager(app)
 login.login_view = 'login'
 
 # Import at the bottom to work around circular imports. route module needs to import app as well
-from app import routes, models, errors
+# metrics comes first, so its request hooks time the hooks of the other modules
+from app import metrics, routes, models, identity, errors, garbage, fragments, counters
@@ -0,0 +1,295 @@
+"""Bulk import and export of recipes as JSON Lines or CSV, for the flask recipes CLI commands and the export view.
+
+Records are read as a stream and written in batches with executemany, instead of one ORM object and commit per recipe.
+Exports are streamed, so memory use doesn't depend on the number of recipes.
+A record has the keys of the Recipe constructor plus:
+    author: username of the author, tags: list of tag names, images: list of image file names,
+    timestamp: ISO 8601 creation time, uuid: keeps URLs of recipes coming from another recipe list.
+In CSV files tags and images are separated by '|'"""
+import csv
+import gzip
+import io
+import json
+import time
+import uuid as uuid_lib
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, TextIO
+from sqlalchemy import bindparam
+from app import db
+from app.models import User, Recipe, RecipeImage, Tag, recipe_tag, skill_levels
+from app.search import reindex
+from app.storage import change_references
+from app.counters import add_to_counts
+
+CSV_LIST_SEPARATOR = '|'
+EXPORT_FIELDS = ('name', 'author', 'description', 'body', 'minutes', 'skill_level', 'calories', 'thumbnail',
+                 'timestamp', 'uuid', 'tags', 'images')
+# Expanding parameters render the values of a batch into IN at execution, much faster than a bind parameter each
+_names = bindparam('names', expanding=True)
+_uuids = bindparam('uuids', expanding=True)
+
+
+class ImportStats(object):
+    """Counts of an import run"""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.tags_created = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Imported recipes per second"""
+        return self.imported / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return '{} recipes imported, {} skipped, {} tags created in {:.1f} s ({:.0f} recipes/s)'.format(
+            self.imported, self.skipped, self.tags_created, self.elapsed, self.rate)
+
+
+def open_text(path: str, mode: str = 'rt') -> TextIO:
+    """Open a text file, gzip compressed if the name ends with .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8', newline='')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def file_format(path: str) -> str:
+    """Guess 'jsonl' or 'csv' from a file name"""
+    return 'csv' if path[:-3 if path.endswith('.gz') else None].endswith('.csv') else 'jsonl'
+
+
+def read_records(stream: TextIO, format_: str) -> Iterator[dict]:
+    """Read recipe records one at a time from a JSON Lines or CSV stream"""
+    if format_ == 'csv':
+        for row in csv.DictReader(stream):
+            for key in ('tags', 'images'):
+                row[key] = [v for v in (row.get(key) or '').split(CSV_LIST_SEPARATOR) if v]
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _truncate(value, column) -> Optional[str]:
+    """Cut text to the length of its column, so one long value can't fail a whole batch"""
+    if value is None:
+        return None
+    return str(value)[:column.type.length]
+
+
+def _integer(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _recipe_row(record: dict, user_id: int) -> dict:
+    """Column values for a record, with the same defaults as the Recipe constructor. Raises ValueError or TypeError
+    for a malformed timestamp"""
+    columns = Recipe.__table__.c
+    timestamp = record.get('timestamp')
+    return {
+        'name': _truncate(record['name'], columns.name),
+        'user_id': user_id,
+        'description': _truncate(record.get('description') or '', columns.description),
+        'body': _truncate(record.get('body') or '', columns.body),
+        'minutes': _integer(record.get('minutes'), 10),
+        'skill_level': record.get('skill_level') if record.get('skill_level') in skill_levels else skill_levels[0],
+        'calories': _integer(record.get('calories')),
+        'thumbnail': _truncate(record.get('thumbnail') or 'static/images/placeholder.png', columns.thumbnail),
+        'timestamp': datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow(),
+        'uuid': record.get('uuid') or str(uuid_lib.uuid4()),
+    }
+
+
+class _Importer(object):
+    """Writes batches of records. Keeps the ids of authors and tags it has seen, so each is only looked up once"""
+
+    def __init__(self, default_author: Optional[str], stats: ImportStats):
+        self.default_author = default_author
+        self.stats = stats
+        self.user_ids = {}
+        self.tag_ids = {}
+
+    def _resolve_users(self, usernames: set):
+        missing = usernames - self.user_ids.keys()
+        if missing:
+            self.user_ids.update(db.session.query(User.username, User.id).filter(User.username.in_(_names))
+                                 .params(names=list(missing)))
+
+    def _resolve_tags(self, names: set) -> int:
+        """Look up all tags of a batch in one query and create the missing ones with one executemany
+
+        :return: Number of created tags"""
+        missing = names - self.tag_ids.keys()
+        if not missing:
+            return 0
+        tag_ids = db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(_names))
+        self.tag_ids.update(tag_ids.params(names=list(missing)))
+        new = missing - self.tag_ids.keys()
+        if new:
+            db.session.execute(Tag.__table__.insert(), [{'name': name} for name in new])
+            self.tag_ids.update(tag_ids.params(names=list(new)))
+            self.stats.tags_created += len(new)
+        return len(new)
+
+    def write(self, records: list):
+        """Insert one batch of records and commit it"""
+        self._resolve_users({r.get('author') or self.default_author for r in records} - {None})
+        rows, extras = [], []
+        for record in records:
+            user_id = self.user_ids.get(record.get('author') or self.default_author)
+            if user_id is None or not record.get('name'):
+                self.stats.skipped += 1
+                continue
+            try:
+                rows.append(_recipe_row(record, user_id))
+            except (ValueError, TypeError):
+                self.stats.skipped += 1
+                continue
+            extras.append((record.get('tags') or [], record.get('images') or []))
+
+        # Recipes that already exist, or appear twice in the file, would violate the unique constraints
+        uuids = [r['uuid'] for r in rows]
+        existing = set(db.session.query(Recipe.name, Recipe.user_id).filter(Recipe.name.in_(_names))
+                       .params(names=list({r['name'] for r in rows})))
+        existing.update(db.session.query(Recipe.uuid).filter(Recipe.uuid.in_(_uuids)).params(uuids=uuids))
+        new_rows, new_extras = [], []
+        for row, extra in zip(rows, extras):
+            keys = {(row['name'], row['user_id']), (row['uuid'],)}
+            if keys & existing:
+                self.stats.skipped += 1
+                continue
+            existing.update(keys)
+            new_rows.append(row)
+            new_extras.append(extra)
+        if not new_rows:
+            db.session.commit()
+            return
+
+        tags_created = self._resolve_tags({name for tags, _ in new_extras for name in tags})
+        db.session.execute(Recipe.__table__.insert(), new_rows)
+        recipe_ids = dict(db.session.query(Recipe.uuid, Recipe.id).filter(Recipe.uuid.in_(_uuids))
+                          .params(uuids=[r['uuid'] for r in new_rows]))
+
+        tag_rows, image_rows = [], []
+        for row, (tags, images) in zip(new_rows, new_extras):
+            recipe_id = recipe_ids[row['uuid']]
+            tag_rows.extend({'recipe_id': recipe_id, 'tag_id': self.tag_ids[name]} for name in set(tags))
+            image_rows.extend({'recipe_id': recipe_id, 'file_name': name if len(name) <= 150 else 'placeholder.png'}
+                              for name in images)
+        if tag_rows:
+            db.session.execute(recipe_tag.insert(), tag_rows)
+        if image_rows:
+            db.session.execute(RecipeImage.__table__.insert(), image_rows)
+        # Core inserts don't trigger the search index, blob reference and counter updates
+        reindex(recipe_ids.values())
+        change_references(db.session.connection(), Counter([r['thumbnail'] for r in new_rows] +
+                                                           [r['file_name'] for r in image_rows]))
+        add_to_counts(db.session.connection(), tags=Counter(r['tag_id'] for r in tag_rows),
+                      users=Counter(r['user_id'] for r in new_rows),
+                      totals=Counter(recipes=len(new_rows), tags=tags_created))
+        db.session.commit()
+        self.stats.imported += len(new_rows)
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_recipes(records: Iterable[dict], batch_size: int = 1000, default_author: Optional[str] = None,
+                   progress=None) -> ImportStats:
+    """Import recipe records in batches. Every batch is a separate transaction.
+    Records without a known author or name and recipes that already exist are skipped
+
+    :param records: Recipe records, e.g. from read_records
+    :param batch_size: Number of records per transaction
+    :param default_author: Username for records without an author
+    :param progress: Called with the stats after every batch"""
+    stats = ImportStats()
+    importer = _Importer(default_author, stats)
+    for batch in _chunks(records, batch_size):
+        try:
+            importer.write(batch)
+        except Exception:
+            db.session.rollback()
+            raise
+        if progress is not None:
+            progress(stats)
+    return stats
+
+
+def export_records(batch_size: int = 1000) -> Iterator[dict]:
+    """Stream all recipes as records in the format import_recipes reads, oldest first.
+    Rows are fetched batch_size at a time with yield_per (a server-side cursor on PostgreSQL) and the tags and images
+    of each batch with one query each. Plain columns are selected, so no ORM objects pile up in the session"""
+    columns = Recipe.__table__.c
+    rows = db.session.query(columns.id, columns.name, User.username, columns.description, columns.body,
+                            columns.minutes, columns.skill_level, columns.calories, columns.thumbnail,
+                            columns.timestamp, columns.uuid) \
+        .outerjoin(User, User.id == columns.user_id).order_by(columns.id).yield_per(batch_size)
+    recipe_ids = bindparam('recipe_ids', expanding=True)
+    tag_query = db.session.query(recipe_tag.c.recipe_id, Tag.name).join(Tag, Tag.id == recipe_tag.c.tag_id) \
+        .filter(recipe_tag.c.recipe_id.in_(recipe_ids)).order_by(Tag.name)
+    image_query = db.session.query(RecipeImage.recipe_id, RecipeImage.file_name) \
+        .filter(RecipeImage.recipe_id.in_(recipe_ids)).order_by(RecipeImage.id)
+    for chunk in _chunks(rows, batch_size):
+        ids = [row.id for row in chunk]
+        tags, images = {}, {}
+        for recipe_id, name in tag_query.params(recipe_ids=ids):
+            tags.setdefault(recipe_id, []).append(name)
+        for recipe_id, file_name in image_query.params(recipe_ids=ids):
+            images.setdefault(recipe_id, []).append(file_name)
+        for row in chunk:
+            record = dict(zip(EXPORT_FIELDS, row[1:]))
+            record['timestamp'] = row.timestamp.isoformat() if row.timestamp else None
+            record['tags'] = tags.get(row.id, [])
+            record['images'] = images.get(row.id, [])
+            yield record
+
+
+def format_records(records: Iterable[dict], format_: str) -> Iterator[str]:
+    """Serialize records as lines of JSON Lines or CSV, with a header line for CSV"""
+    if format_ != 'csv':
+        for record in records:
+            yield json.dumps(record) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        record = dict(record, tags=CSV_LIST_SEPARATOR.join(record['tags']),
+                      images=CSV_LIST_SEPARATOR.join(record['images']))
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_lines(lines: Iterable[str], compress: bool = False, lines_per_chunk: int = 256) -> Iterator[bytes]:
+    """Encode lines as UTF-8 in chunks of lines_per_chunk lines, optionally as one gzip stream"""
+    compressor = zlib.compressobj(wbits=31) if compress else None   # wbits 31: gzip header and trailer
+    for chunk in _chunks(lines, lines_per_chunk):
+        data = ''.join(chunk).encode()
+        data = compressor.compress(data) if compressor else data
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
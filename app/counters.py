@@ -0,0 +1,120 @@
+"""Denormalized recipe counts: Tag.recipe_count, User.recipe_count and the Total rows for recipes, tags and users.
+
+Counts change in the same transaction as the rows they count, with relative UPDATEs, so concurrent transactions don't
+overwrite each other's changes. Session events keep them up to date for the ORM, bulk writes call add_to_counts.
+flask recipes recount repairs drift, e.g. after writes that bypassed both"""
+from collections import Counter, namedtuple
+from typing import Optional
+from sqlalchemy import event, bindparam, inspect, select, func
+from app import db
+from app.models import User, Recipe, Tag, Total, recipe_tag, total_names
+
+# Rows that were corrected, or would be corrected in a dry run
+Drift = namedtuple('Drift', ['tags', 'users', 'totals'])
+
+_ids = bindparam('ids', expanding=True)
+
+
+def add_to_counts(connection, tags: Optional[Counter] = None, users: Optional[Counter] = None,
+                  totals: Optional[Counter] = None):
+    """Add to recipe counts and totals in the transaction of connection
+
+    :param tags: Change of the recipe count by tag id
+    :param users: Change of the recipe count by user id
+    :param totals: Change by name of Total"""
+    for table, key, changes in ((Tag.__table__, 'id', tags), (User.__table__, 'id', users),
+                                (Total.__table__, 'name', totals)):
+        rows = [{'key': k, 'delta': delta} for k, delta in (changes or {}).items() if delta and k is not None]
+        if not rows:
+            continue
+        column = 'value' if table is Total.__table__ else 'recipe_count'
+        connection.execute(table.update().where(table.c[key] == bindparam('key'))
+                           .values({column: table.c[column] + bindparam('delta')}), rows)
+
+
+def totals() -> dict:
+    """Totals by name, e.g. {'recipes': 120, 'tags': 15, 'users': 4}"""
+    return dict(db.session.query(Total.name, Total.value))
+
+
+@event.listens_for(Recipe.user_id, 'set', active_history=True)
+def _load_old_author(target, value, old_value, initiator):
+    """Makes the history of a changed author include the previous one, even if it wasn't loaded"""
+
+
+@event.listens_for(db.session, 'before_flush')
+def _count_deleted_recipes(session, flush_context, instances):
+    """Look up the authors and tags of deleted recipes before the flush deletes their rows"""
+    deleted = [obj for obj in session.deleted if isinstance(obj, Recipe)]
+    tags = Counter(tag_id for tag_id, in session.query(recipe_tag.c.tag_id).filter(recipe_tag.c.recipe_id.in_(_ids))
+                   .params(ids=[r.id for r in deleted])) if deleted else Counter()
+    session.info['deleted_recipes'] = tags, Counter(r.user_id for r in deleted)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_counts(session, flush_context):
+    """Count the recipes, tags, users and taggings added or removed in this flush"""
+    tags, users, totals_ = Counter(), Counter(), Counter()
+    deleted_tags, deleted_authors = session.info.pop('deleted_recipes', (Counter(), Counter()))
+    tags.subtract(deleted_tags)
+    users.subtract(deleted_authors)
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Recipe):
+                totals_['recipes'] += sign
+            elif isinstance(obj, Tag):
+                totals_['tags'] += sign
+            elif isinstance(obj, User):
+                totals_['users'] += sign
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, Recipe):
+            continue
+        history = inspect(obj).attrs.tags.history
+        tags.update(t.id for t in history.added)
+        tags.subtract(t.id for t in history.deleted)
+        author_history = inspect(obj).attrs.user_id.history
+        users.update(author_history.added)
+        users.subtract(author_history.deleted)
+    add_to_counts(session.connection(), tags, users, totals_)
+
+
+@event.listens_for(Total.__table__, 'after_create')
+def _create_totals(target, connection, **kw):
+    connection.execute(target.insert(), [{'name': name, 'value': 0} for name in total_names])
+
+
+def _actual_counts():
+    """Correlated subqueries counting the recipes of a tag and of a user, and the rows counted by each Total"""
+    recipe = Recipe.__table__
+    tag_count = select([func.count()]).select_from(recipe_tag.join(recipe, recipe_tag.c.recipe_id == recipe.c.id)) \
+        .where(recipe_tag.c.tag_id == Tag.__table__.c.id).as_scalar()
+    user_count = select([func.count()]).where(recipe.c.user_id == User.__table__.c.id).as_scalar()
+    total_counts = {'recipes': recipe, 'tags': Tag.__table__, 'users': User.__table__}
+    return tag_count, user_count, {name: select([func.count()]).select_from(table).as_scalar()
+                                   for name, table in total_counts.items()}
+
+
+def recount(dry_run: bool = False) -> Drift:
+    """Recount all recipe counts and totals and correct those that drifted. One statement per table
+
+    :param dry_run: Only report the drift"""
+    tag_count, user_count, total_counts = _actual_counts()
+    drifted = []
+    for table, actual in ((Tag.__table__, tag_count), (User.__table__, user_count)):
+        condition = table.c.recipe_count != actual
+        if dry_run:
+            drifted.append(db.session.execute(select([func.count()]).select_from(table).where(condition)).scalar())
+        else:
+            drifted.append(db.session.execute(table.update().where(condition).values(recipe_count=actual)).rowcount)
+
+    stored = totals()
+    actual_totals = dict(zip(total_counts, db.session.execute(select(list(total_counts.values()))).first()))
+    wrong = {name: value for name, value in actual_totals.items() if stored.get(name) != value}
+    if not dry_run:
+        for name, value in wrong.items():
+            if name in stored:
+                Total.query.filter_by(name=name).update({'value': value})
+            else:
+                db.session.add(Total(name=name, value=value))
+        db.session.commit()
+    return Drift(*drifted, len(wrong))
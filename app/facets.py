@@ -0,0 +1,181 @@
+"""Faceted recipe filtering: tags (all or any of them), skill levels and ranges of minutes and calories.
+
+Filters are planned around the most selective facet, the driver. Tag sizes are known from Tag.recipe_count, and
+several tags that must all match are intersected on the recipe_tag index. The skill level and range facets are counted
+on the (skill_level, minutes, calories) index. Without a selective facet all recipes drive the filter.
+
+Facet counts come from FACET_SAMPLE_SIZE recipes of the driver, so counting reads a bounded number of rows. They are
+exact if the driver has no more recipes than that, otherwise scaled up estimates. The listing then either looks up the
+recipes of the driver and sorts the matches, or walks all recipes newest first until a page is full, whichever reads
+fewer rows by the estimated number of matches"""
+from collections import Counter, namedtuple
+from typing import Optional, Tuple
+from sqlalchemy import select, exists, and_, func, case, bindparam, intersect
+from sqlalchemy.orm import joinedload
+from app import app, db
+from app.models import Recipe, Tag, Total, recipe_tag, skill_levels
+from app.pagination import Page, recipe_page
+
+# tags are names. minutes and calories are (lowest, highest) with None for no bound
+Facets = namedtuple('Facets', ['tags', 'match_all', 'skill_levels', 'minutes', 'calories'])
+# total and the counts by value are estimates if exact is False. tags are the most frequent (name, count) pairs
+FacetCounts = namedtuple('FacetCounts', ['total', 'exact', 'skill_levels', 'minutes', 'calories', 'tags'])
+
+MINUTE_BUCKETS = [(None, 15), (16, 30), (31, 60), (61, None)]
+CALORIE_BUCKETS = [(None, 300), (301, 600), (601, 1000), (1001, None)]
+MAX_TAGS = 10
+_ids = bindparam('ids', expanding=True)
+# Counting entries of the (skill_level, minutes, calories) index is cheap, so range facets are counted this far
+PROBE_LIMIT = 100000
+MAX_INTEGER = 2 ** 31 - 1   # Bounds beyond an INTEGER column are ignored, the database can't compare with them
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        number = int(value) if value else None
+    except ValueError:
+        return None
+    return number if number is None or abs(number) <= MAX_INTEGER else None
+
+
+def parse_facets(args) -> Facets:
+    """Get the facets from request arguments: tag (repeated), match ('all' or 'any'), skill (repeated),
+    min_minutes, max_minutes, min_calories and max_calories. Invalid values are ignored"""
+    tags = list(dict.fromkeys(t.strip() for t in args.getlist('tag') if t.strip()))[:MAX_TAGS]
+    return Facets(tags, args.get('match') != 'any', [s for s in skill_levels if s in args.getlist('skill')],
+                  (_int(args.get('min_minutes')), _int(args.get('max_minutes'))),
+                  (_int(args.get('min_calories')), _int(args.get('max_calories'))))
+
+
+def _range_condition(column, bounds: tuple):
+    low, high = bounds
+    return and_(*([column >= low] if low is not None else []), *([column <= high] if high is not None else []))
+
+
+def _sample(ids, order, limit: int):
+    """Select the first limit ids of a select of ids in order. A derived table, as some databases don't allow LIMIT in
+    IN"""
+    limited = ids.order_by(order).limit(limit).alias()
+    return select(list(limited.c)[:1])
+
+
+def _has_tag(tag_ids: list):
+    return exists().where(and_(recipe_tag.c.recipe_id == Recipe.id, recipe_tag.c.tag_id.in_(tag_ids)))
+
+
+class _Filter(object):
+    """The conditions of a set of facets and their driver"""
+
+    def __init__(self, facets: Facets):
+        self.facets = facets
+        self.empty = False  # True if nothing can match, e.g. because a required tag doesn't exist
+        self.conditions = self.range_conditions()
+        self.ranged = bool(facets.skill_levels) or facets.minutes != (None, None) or facets.calories != (None, None)
+
+        # Rarest first, so the database can stop checking a recipe early
+        self.tags = db.session.query(Tag.id, Tag.recipe_count).filter(Tag.name.in_(facets.tags)) \
+            .order_by(Tag.recipe_count, Tag.id).all() if facets.tags else []
+        if facets.match_all and len(self.tags) < len(facets.tags) or facets.tags and not self.tags:
+            self.empty = True
+        elif facets.match_all:
+            self.conditions.extend(_has_tag([tag_id]) for tag_id, _ in self.tags)
+        elif self.tags:
+            self.conditions.append(_has_tag([tag_id for tag_id, _ in self.tags]))
+        self.tag_conditions = self.conditions[3:]
+
+    def range_conditions(self, indexed: bool = True) -> list:
+        """Conditions of the skill level and range facets
+
+        :param indexed: False to keep the database from using the (skill_level, minutes, calories) index for them"""
+        skill, minutes, calories = Recipe.skill_level, Recipe.minutes, Recipe.calories
+        if not indexed:     # Expressions on the columns don't match an index, the usual way to steer query planners
+            skill, minutes, calories = skill + '', minutes + 0, calories + 0
+        # No condition without selected levels, so recipes with a level outside skill_levels aren't left out
+        return [skill.in_(self.facets.skill_levels) if self.facets.skill_levels else and_(),
+                _range_condition(minutes, self.facets.minutes), _range_condition(calories, self.facets.calories)]
+
+    def driver(self, limit: int) -> Tuple[int, object, object, Optional[list], int]:
+        """The most selective facet: its number of recipes, or an estimate if that's above limit, a select of their
+        ids, the order in which to sample them, their ids if they were already fetched, and the number of all
+        recipes. Samples are taken in id order, which is unrelated to the facets"""
+        total = db.session.query(Total.value).filter(Total.name == 'recipes').scalar() or 0
+        candidates = [(total, select([Recipe.id]), Recipe.id, None)]
+        if self.tags and self.facets.match_all:
+            rarest, count = self.tags[0]
+            candidates.append((count, select([recipe_tag.c.recipe_id]).where(recipe_tag.c.tag_id == rarest),
+                               recipe_tag.c.recipe_id, None))
+            if len(self.tags) > 1:
+                # Intersecting ranges of the index on recipe_tag is cheap. If more than limit are left, a sample of
+                # the rarest tag estimates the others
+                both = intersect(*(select([recipe_tag.c.recipe_id]).where(recipe_tag.c.tag_id == tag_id)
+                                   for tag_id, _ in self.tags))
+                found = [row[0] for row in db.session.execute(both.limit(limit + 1)).fetchall()]
+                if len(found) <= limit:
+                    candidates.append((len(found), both, None, found))
+        elif self.tags:
+            candidates.append((sum(count for _, count in self.tags), select([recipe_tag.c.recipe_id]).where(
+                recipe_tag.c.tag_id.in_([tag_id for tag_id, _ in self.tags])), recipe_tag.c.recipe_id, None))
+        if self.ranged:
+            ids = select([Recipe.id]).where(and_(*self.conditions[:3]))
+            probed = _count(ids, PROBE_LIMIT)
+            if probed < PROBE_LIMIT:    # Sorted as an expression, otherwise the database walks the whole table
+                candidates.append((probed, ids, Recipe.id + 0, None))
+        return min(candidates, key=lambda c: c[0]) + (total,)
+
+
+def _count(ids, limit: int) -> int:
+    """Count a select of ids, up to limit"""
+    return db.session.execute(select([func.count()]).select_from(ids.limit(limit).alias())).scalar()
+
+
+def _bucket(column, buckets: list):
+    """Index of the bucket of column's value, None outside all buckets"""
+    return case([(_range_condition(column, bucket), index) for index, bucket in enumerate(buckets)], else_=None)
+
+
+def facet_page(facets: Facets, per_page: int, after: Optional[str] = None,
+               before: Optional[str] = None) -> Tuple[Page, FacetCounts]:
+    """Get a page of the recipes matching facets, newest first, and the facet counts of all matching recipes
+
+    :param facets: Facets from parse_facets
+    :param per_page: Maximum number of recipes on the page
+    :param after: Cursor from the next link of the previous page
+    :param before: Cursor from the previous link of the next page"""
+    filter_ = _Filter(facets)
+    if filter_.empty:
+        return Page([], None, None), FacetCounts(0, True, [(s, 0) for s in skill_levels],
+                                                 [(b, 0) for b in MINUTE_BUCKETS], [(b, 0) for b in CALORIE_BUCKETS],
+                                                 [])
+    limit = app.config['FACET_SAMPLE_SIZE']
+    estimate, driver, order, ids, total = filter_.driver(limit)
+    exact = estimate <= limit
+    if ids is None:     # The driver or a sample of it. Looked up once, as it's used by several queries
+        ids = [row[0] for row in db.session.execute(driver if exact else _sample(driver, order, limit)).fetchall()]
+    matched = and_(Recipe.id.in_(_ids), *filter_.conditions)
+    counts = _facet_counts(matched, ids, exact, 1 if exact else estimate / limit)
+
+    query = Recipe.query.options(joinedload(Recipe.author))
+    walked = total * per_page / max(counts.total, 1)    # Recipes walked newest first to fill a page
+    if exact and estimate < walked:
+        query = query.filter(matched).params(ids=ids)
+    elif estimate < min(total, walked):
+        query = query.filter(Recipe.id.in_(driver), *filter_.conditions)
+    else:   # Otherwise databases tend to sort all recipes in a range rather than walk the newest ones
+        query = query.filter(*filter_.range_conditions(indexed=False), *filter_.tag_conditions)
+    return recipe_page(query, per_page, after, before), counts
+
+
+def _facet_counts(matched, ids: list, exact: bool, factor: float) -> FacetCounts:
+    """Count the recipes matching a condition on ids by facet value, and scale the counts by factor"""
+    rows = db.session.execute(select([Recipe.id, Recipe.skill_level, _bucket(Recipe.minutes, MINUTE_BUCKETS),
+                                      _bucket(Recipe.calories, CALORIE_BUCKETS)]).where(matched),
+                              {'ids': ids}).fetchall()
+    skills, minutes, calories = (Counter(row[column] for row in rows) for column in (1, 2, 3))
+    # Only the index on recipe_tag is read for the matching ids
+    tags = db.session.query(Tag.name, func.count()).join(recipe_tag, recipe_tag.c.tag_id == Tag.id) \
+        .filter(recipe_tag.c.recipe_id.in_(_ids)).group_by(Tag.name).order_by(func.count().desc(), Tag.name) \
+        .limit(MAX_TAGS).params(ids=[row[0] for row in rows]).all() if rows else []
+    return FacetCounts(round(len(rows) * factor), exact, [(s, round(skills[s] * factor)) for s in skill_levels],
+                       [(b, round(minutes[i] * factor)) for i, b in enumerate(MINUTE_BUCKETS)],
+                       [(b, round(calories[i] * factor)) for i, b in enumerate(CALORIE_BUCKETS)],
+                       [(name, round(count * factor)) for name, count in tags])
@@ -0,0 +1,94 @@
+"""Pool of featured recipes and tags for the index page, cached per worker process.
+
+The pool holds plain snapshots instead of ORM objects, so it can outlive the session that loaded it. Requests pick
+their favorites from the pool without touching the database. A stale pool keeps being served while a background
+thread refreshes it"""
+import random
+import threading
+import time
+from collections import namedtuple
+from app import app, db
+from app.models import User, Recipe, Tag
+from app.sampling import random_rows
+from app.counters import totals
+
+# Same attribute names as the models, so _recipe.html renders them like Recipe objects
+FeaturedAuthor = namedtuple('FeaturedAuthor', ['username'])
+FeaturedRecipe = namedtuple('FeaturedRecipe', ['id', 'version', 'uuid', 'name', 'thumbnail', 'minutes', 'skill_level',
+                                               'calories', 'author'])
+FeaturedTag = namedtuple('FeaturedTag', ['name', 'recipe_count'])
+
+
+class FeaturedPool(object):
+    """Candidate recipes and tags the index page samples from. Refreshed every FEATURED_REFRESH_SECONDS"""
+
+    def __init__(self):
+        self.recipes = []
+        self.tags = []
+        self.popular_tags = []  # Most recipes first
+        self.totals = {}
+        self.refreshed_at = None    # time.monotonic() of the last refresh, None if never loaded
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self):
+        """Load a new pool from the database. Needs an app context"""
+        size = app.config['FEATURED_POOL_SIZE']
+        recipes = random_rows(Recipe, size)
+        authors = {}
+        author_ids = {r.user_id for r in recipes if r.user_id is not None}
+        if author_ids:  # One query for all authors instead of a lazy load per recipe
+            authors = {user_id: FeaturedAuthor(username) for user_id, username in
+                       db.session.query(User.id, User.username).filter(User.id.in_(author_ids))}
+        new_recipes = [FeaturedRecipe(r.id, r.version, r.uuid, r.name, r.thumbnail, r.minutes, r.skill_level,
+                                      r.calories, authors.get(r.user_id, FeaturedAuthor(None))) for r in recipes]
+        new_tags = [FeaturedTag(t.name, t.recipe_count) for t in random_rows(Tag, size)]
+        popular_tags = [FeaturedTag(name, count) for name, count in db.session.query(Tag.name, Tag.recipe_count)
+                        .order_by(Tag.recipe_count.desc()).limit(size)]
+        new_totals = totals()
+        with self._lock:
+            self.recipes, self.tags = new_recipes, new_tags
+            self.popular_tags, self.totals = popular_tags, new_totals
+            self.refreshed_at = time.monotonic()
+
+    def expire(self):
+        """Mark the pool as stale, e.g. because a featured recipe was changed. The next request triggers a refresh"""
+        with self._lock:
+            if self.refreshed_at is not None:
+                self.refreshed_at = time.monotonic() - app.config['FEATURED_REFRESH_SECONDS'] - 1
+
+    def _refresh_in_background(self):
+        """Refresh in a separate thread and app context, so the current request can be served from the stale pool"""
+        def run():
+            try:
+                with app.app_context():
+                    self.refresh()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception('Could not refresh the featured pool')
+            finally:
+                self._refreshing = False
+
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=run, name='featured-refresh', daemon=True).start()
+
+    def pick(self, recipe_count: int, tag_count: int):
+        """Get random featured recipes and tags from the pool. Only the very first call per worker queries the
+        database in the request, later refreshes happen in the background. popular_tags and totals are loaded with them
+
+        :param recipe_count: Maximum number of recipes to return
+        :param tag_count: Maximum number of tags to return
+        :return: Tuple of recipe list and tag list"""
+        if self.refreshed_at is None:
+            self.refresh()
+        elif time.monotonic() - self.refreshed_at > app.config['FEATURED_REFRESH_SECONDS']:
+            self._refresh_in_background()
+        recipes, tags = self.recipes, self.tags
+        return (random.sample(recipes, min(recipe_count, len(recipes))),
+                random.sample(tags, min(tag_count, len(tags))))
+
+
+featured = FeaturedPool()
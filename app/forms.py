@@ -1,13 +1,65 @@
 """Collection of webforms for Flask-WTF"""
+from typing import Iterable, Optional
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, IntegerField, SelectField, TextAreaField, \
     MultipleFileField
 from wtforms.validators import DataRequired, EqualTo, ValidationError, Email, Length, NumberRange
 from flask_wtf.file import FileField, FileAllowed
-from app.models import User, skill_levels
-from app import thumbnails, images
+from sqlalchemy import or_, exists
+from sqlalchemy.exc import IntegrityError
+from app.models import User, Recipe, skill_levels, violated_constraint
+from app import db, thumbnails, images
 import flask_login
 
+# Errors of the fields that must be unique, also shown if a unique constraint catches a race. See violated_field
+username_taken = 'Please use a different username.'
+email_taken = 'Please use a different email address.'
+recipe_name_taken = 'You can only have one recipe with that name'
+
+
+def taken_user_fields(username: str, email: str, user_id: Optional[int] = None) -> set:
+    """Which of 'username' and 'email' another user already has. One query for both
+
+    :param user_id: The user that is being edited, who may keep its own username and email"""
+    query = db.session.query(User.username, User.email).filter(or_(User.username == username, User.email == email))
+    if user_id is not None:
+        query = query.filter(User.id != user_id)
+    taken = set()
+    for other_username, other_email in query.limit(2):
+        taken.update(field for field, value, other in (('username', username, other_username),
+                                                       ('email', email, other_email)) if value == other)
+    return taken
+
+
+def has_recipe_named(user_id: int, name: str, recipe_id: Optional[int] = None) -> bool:
+    """Whether a user has a recipe with name, other than the recipe with recipe_id. One query"""
+    condition = (Recipe.user_id == user_id) & (Recipe.name == name)
+    if recipe_id is not None:
+        condition &= Recipe.id != recipe_id
+    return db.session.query(exists().where(condition)).scalar()
+
+
+def violated_field(error: IntegrityError, table: str, fields: Iterable[str]) -> Optional[str]:
+    """The field whose unique constraint error violated, e.g. when a concurrent request took a name after the form was
+    validated. None if it's another error
+
+    :param table: Table of the fields, e.g. 'user'
+    :param fields: Field names, as in violated_constraint"""
+    constraint = violated_constraint(error)
+    return next((field for field in fields if constraint == '{}.{}'.format(table, field)), None)
+
+
+def _check_user_fields(form, user_id: Optional[int] = None) -> bool:
+    """Add errors to the username and email fields of form if another user has them. Fields that are already invalid
+    aren't checked"""
+    fields = [field for field in (form.username, form.email) if not field.errors]
+    if not fields:
+        return True
+    taken = taken_user_fields(form.username.data, form.email.data, user_id) & {field.name for field in fields}
+    for name in taken:
+        getattr(form, name).errors.append(username_taken if name == 'username' else email_taken)
+    return not taken
+
 
 # A form is a class, their members are the fields
 class LoginForm(FlaskForm):
@@ -29,18 +81,9 @@ class RegistrationForm(FlaskForm):
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Register')
 
-    # Will get called as a validator, because it has the form validate_<attr>
-    def validate_username(self, username: StringField):
-        """Custom validator to check if the username is already registered"""
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different username.')
-
-    def validate_email(self, email: StringField):
-        """Custom validator to check if the email is already registered"""
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different email address.')
+    def validate(self) -> bool:
+        """Validate the fields, then check that username and email are still free with a single query"""
+        return super().validate() & _check_user_fields(self)
 
 
 class EditUserForm(FlaskForm):
@@ -52,17 +95,10 @@ class EditUserForm(FlaskForm):
     new_password_confirm = PasswordField('Repeat new password', default=None, validators=[EqualTo('new_password')])
     submit = SubmitField('Save Changes')
 
-    def validate_username(self, username: StringField):
-        """Custom validator to check if the username is already registered"""
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None and username.data != flask_login.current_user.username:
-            raise ValidationError('Please use a different username.')
-
-    def validate_email(self, email: StringField):
-        """Custom validator to check if the email is already registered"""
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None and email.data != flask_login.current_user.email:
-            raise ValidationError('Please use a different email address.')
+    def validate(self) -> bool:
+        """Validate the fields, then check that username and email are free or the current user's own with a single
+        query"""
+        return super().validate() & _check_user_fields(self, flask_login.current_user.id)
 
 
 class CreateRecipeForm(FlaskForm):
@@ -81,8 +117,8 @@ class CreateRecipeForm(FlaskForm):
 
     def validate_name(self, name: StringField):
         """Custom validator to check whether the new recipe name is unique for this user"""
-        if flask_login.current_user.recipes.filter_by(name=name.data).first() is not None:
-            raise ValidationError('You can only have one recipe with that name')
+        if has_recipe_named(flask_login.current_user.id, name.data):
+            raise ValidationError(recipe_name_taken)
 
     def validate_thumbnail(self, thumbnail: FileField):
         """Custom validator to check whether a placeholder image was submitted"""
@@ -114,12 +150,37 @@ class EditRecipeForm(FlaskForm):
     submit = SubmitField('Create Recipe')
 
 
+class TagListField(StringField):
+    """Comma separated tag names. data is the list of distinct names, in the order they were entered"""
+
+    def process_formdata(self, valuelist):
+        self.data = []
+        for name in valuelist[0].split(',') if valuelist else []:
+            name = name.strip()
+            if name and name not in self.data:
+                self.data.append(name)
+
+    def _value(self):
+        return ', '.join(self.data) if self.data else ''
+
+
 class AddTagForm(FlaskForm):
-    tag_name = StringField('Tag name', validators=[Length(min=1, max=100)])
-    submit = SubmitField('Add Tag')
+    tag_names = TagListField('Tag names')
+    submit = SubmitField('Add Tags')
+
+    def validate_tag_names(self, tag_names: TagListField):
+        if not tag_names.data:
+            raise ValidationError('Enter at least one tag name')
+        if len(tag_names.data) > 20:
+            raise ValidationError('Add at most 20 tags at once')
+        if any(len(name) > 100 for name in tag_names.data):
+            raise ValidationError('Tag names can have at most 100 characters')
 
 
 class SearchForm(FlaskForm):
+    class Meta:
+        csrf = False    # The form is on every page. A token would write the session of anonymous visitors
+
     term = StringField('Term', validators=[Length(min=1, max=100)])
     kind = SelectField('Type', choices=[('recipe', 'Recipe'), ('tag', 'Tag')], default='recipe')
     go = SubmitField('Search')
@@ -0,0 +1,185 @@
+"""Cache of rendered recipe fragments: the recipe cards of listings and the parts of the recipe page.
+
+Templates wrap a fragment in {% call cached_fragment(recipe, part) %}. On a hit the block isn't rendered, so neither
+Jinja nor the lazy loads in it (author, tags, images) run. Entries are stored per recipe with the recipe's version,
+which is bumped whenever the recipe, its tags or images, or its author's name change. An entry of another version is a
+miss and gets replaced, so edits never need to find and invalidate cached fragments.
+
+FRAGMENT_CACHE selects 'memory' for an LRU of FRAGMENT_CACHE_SIZE recipes per worker process, 'filesystem' for files
+under VAR_FOLDER/fragments shared by all workers, or 'none'"""
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+from markupsafe import Markup
+from sqlalchemy import event, bindparam, inspect
+from app import app, db
+from app.models import User, Recipe, RecipeImage
+
+
+class MemoryCache(object):
+    """Least recently used entries of this process"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > app.config['FRAGMENT_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FilesystemCache(object):
+    """One JSON file per entry under VAR_FOLDER/fragments, shared by the worker processes of a host"""
+
+    @staticmethod
+    def _directory() -> str:
+        return os.path.join(app.config['VAR_FOLDER'], 'fragments')
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory(), key + '.json')
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, entry: dict):
+        """Write to a temporary file that is renamed when complete, so readers never see a partial entry"""
+        directory = self._directory()
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        directory = self._directory()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+
+
+caches = {'memory': MemoryCache(), 'filesystem': FilesystemCache()}
+
+
+def current_cache():
+    """The cache selected by FRAGMENT_CACHE, None if fragments aren't cached"""
+    return caches.get(app.config['FRAGMENT_CACHE'])
+
+
+def _key(recipe_id: int) -> str:
+    return 'recipe-{}'.format(recipe_id)
+
+
+@app.template_global()
+def cached_fragment(recipe, part: str, caller) -> Markup:
+    """Render the block of a call tag, or get it from the cache
+
+    :param recipe: Recipe, or a snapshot with its id and version like FeaturedRecipe
+    :param part: Name of the fragment. Fragments that render differently for the same recipe need different names
+    :param caller: The block, passed by Jinja"""
+    cache = current_cache()
+    recipe_id, version = getattr(recipe, 'id', None), getattr(recipe, 'version', None)
+    if cache is None or recipe_id is None or version is None:
+        return caller()
+    entry = cache.get(_key(recipe_id))
+    if entry is not None and entry['version'] == version and part in entry['parts']:
+        return Markup(entry['parts'][part])
+    html = caller()
+    parts = dict(entry['parts']) if entry is not None and entry['version'] == version else {}
+    parts[part] = str(html)
+    cache.set(_key(recipe_id), {'version': version, 'parts': parts})
+    return html
+
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_changed_recipes(session, flush_context, instances):
+    """Bump the version of recipes with changed attributes or tags. Incremented in SQL, so concurrent edits each get
+    their own version"""
+    for obj in session.dirty:
+        if isinstance(obj, Recipe) and session.is_modified(obj):
+            obj.version = Recipe.version + 1
+
+
+_recipe_ids = bindparam('recipe_ids', expanding=True)
+_user_ids = bindparam('user_ids', expanding=True)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_related_recipes(session, flush_context):
+    """Bump the version of recipes whose images were added or removed, or whose author was renamed, and forget the
+    fragments of deleted recipes once the transaction commits"""
+    recipe_ids, user_ids = set(), set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, RecipeImage) and obj.recipe_id is not None:
+            recipe_ids.add(obj.recipe_id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and inspect(obj).attrs.username.history.has_changes():
+            user_ids.add(obj.id)
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Recipe)]
+    if deleted:
+        session.info.setdefault('deleted_fragments', []).extend(deleted)
+    recipe_ids.difference_update(deleted)
+
+    table = Recipe.__table__
+    if recipe_ids:
+        session.connection().execute(table.update().where(table.c.id.in_(_recipe_ids))
+                                     .values(version=table.c.version + 1), recipe_ids=list(recipe_ids))
+    if user_ids:
+        session.connection().execute(table.update().where(table.c.user_id.in_(_user_ids))
+                                     .values(version=table.c.version + 1), user_ids=list(user_ids))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _forget_deleted_recipes(session):
+    deleted = session.info.pop('deleted_fragments', None)
+    cache = current_cache()
+    if deleted and cache is not None:
+        for recipe_id in deleted:
+            cache.delete(_key(recipe_id))
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_deleted_recipes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('deleted_fragments', None)
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _clear_caches(target, connection, **kw):
+    """A new database reuses recipe ids, so fragments of the previous one must not be served"""
+    for cache in caches.values():
+        cache.clear()
@@ -0,0 +1,164 @@
+"""Garbage collection of stored files that no recipe uses anymore.
+
+Only images/ and thumbnails/ of the blob storage are collected, so the fragment cache and anything else kept in
+VAR_FOLDER or under S3_PREFIX is left alone. Files are listed in batches and looked up in the blob table: a file whose
+blob has references is kept, which also keeps the rendered thumbnails/<width>/<name> of a used name. Files of blobs
+without references, and files without a blob row, like uploads of transactions that failed or never committed, are
+removed once they are older than the grace period, so uploads of requests that haven't committed yet are kept.
+Uploads that reuse stored content update its modification time, see BlobStorage.save, which is checked again right
+before a file is removed. Before removing, the recipe images and thumbnails are checked once more, so a refcount that
+drifted can't remove a used file.
+
+Runs with flask recipes gc, or every GC_INTERVAL_SECONDS in a background thread of the web workers"""
+import itertools
+import threading
+import time
+from collections import Counter
+from typing import Iterator, List, Optional
+from sqlalchemy import bindparam
+from app import app, db
+from app.models import Recipe, RecipeImage, Blob
+from app.storage import current_storage, change_references
+
+COLLECTED_PREFIXES = ('images/', 'thumbnails/')
+
+
+class GarbageReport(object):
+    """What a garbage collection found and removed"""
+
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.scanned = 0
+        self.removed = 0
+        self.reclaimed_bytes = 0
+        self.images_removed = 0     # Recipe image rows without a recipe
+
+    def __str__(self):
+        verb = 'would be removed' if self.dry_run else 'removed'
+        return '{} of {} files {verb} ({:.1f} MB), {} images without recipe {verb}'.format(
+            self.removed, self.scanned, self.reclaimed_bytes / 1024 ** 2, self.images_removed, verb=verb)
+
+
+def _batches(entries: Iterator, batch_size: int) -> Iterator[List]:
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+_names = bindparam('names', expanding=True)
+
+
+def _referenced_names(names: List[str], released: Counter) -> set:
+    """The names of a batch whose blob has references. One query on the primary key
+
+    :param released: References a dry run would have released before, by name"""
+    return {name for name, refcount in db.session.query(Blob.name, Blob.refcount).filter(
+        Blob.name.in_(_names), Blob.refcount > 0).params(names=names) if refcount > released[name]}
+
+
+def _used_names(names: List[str]) -> set:
+    """The names of a batch that recipe images or recipe thumbnails use. One indexed query per column"""
+    used = {name for name, in db.session.query(RecipeImage.file_name).filter(
+        RecipeImage.file_name.in_(_names), RecipeImage.recipe_id.isnot(None)).params(names=names)}
+    used.update(name for name, in db.session.query(Recipe.thumbnail).filter(Recipe.thumbnail.in_(_names))
+                .params(names=names))
+    return used
+
+
+def _remove_images_without_recipe(report: GarbageReport) -> Counter:
+    """Remove recipe image rows left over from recipe deletes before images were deleted with their recipe. Returns
+    the references they held by name"""
+    query = db.session.query(RecipeImage.file_name).filter(RecipeImage.recipe_id.is_(None))
+    names = Counter(name for name, in query)
+    report.images_removed = sum(names.values())
+    if not report.dry_run and names:
+        query.delete(synchronize_session=False)
+        change_references(db.session.connection(), {name: -count for name, count in names.items()})
+        db.session.commit()
+    return names
+
+
+def _older(modified: Optional[float], cutoff: float) -> bool:
+    """Whether a key still exists and was last modified before cutoff"""
+    return modified is not None and modified < cutoff
+
+
+def _entries(storage) -> Iterator:
+    return itertools.chain.from_iterable(storage.entries(prefix) for prefix in COLLECTED_PREFIXES)
+
+
+def collect_garbage(grace_seconds: int, dry_run: bool = False, batch_size: int = 1000) -> GarbageReport:
+    """Remove stored images and thumbnails that no recipe references and that were last modified more than
+    grace_seconds ago, along with their blob rows
+
+    :param grace_seconds: Minimum age of removed files
+    :param dry_run: Only report what would be removed
+    :param batch_size: Number of files checked per query"""
+    report = GarbageReport(dry_run)
+    released = _remove_images_without_recipe(report)
+    if not dry_run:     # Already subtracted from the refcounts
+        released = Counter()
+    storage = current_storage()
+    cutoff = time.time() - grace_seconds
+    for batch in _batches(_entries(storage), batch_size):
+        report.scanned += len(batch)
+        old = [(key, key.rsplit('/', 1)[-1], size) for key, size, modified in batch if modified < cutoff]
+        if not old:
+            continue
+        names = list({name for _, name, _ in old})
+        kept = _referenced_names(names, released)
+        kept.update(_used_names([name for name in names if name not in kept]))
+        unused = [(key, name, size) for key, name, size in old if name not in kept]
+        if not dry_run and unused:
+            removed_blobs = list({name for key, name, _ in unused if key.startswith('images/')})
+            if removed_blobs:
+                # Only rows still without references, in case a transaction referenced one since the check
+                Blob.query.filter(Blob.name.in_(_names), Blob.refcount <= 0).params(names=removed_blobs) \
+                    .delete(synchronize_session=False)
+                referenced = _referenced_names(removed_blobs, released)
+                unused = [entry for entry in unused if entry[1] not in referenced]
+            db.session.commit()
+            # A reupload since the listing refreshed the modification time and registers its blob only when it commits
+            unused = [entry for entry in unused if _older(storage.modified(entry[0]), cutoff)]
+            for key, _, _ in unused:
+                storage.delete(key)
+        report.removed += len(unused)
+        report.reclaimed_bytes += sum(size for _, _, size in unused)
+    return report
+
+
+class GarbageCollector(object):
+    """Runs collect_garbage every GC_INTERVAL_SECONDS in a daemon thread"""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['GC_INTERVAL_SECONDS'])
+            try:
+                with app.app_context():
+                    report = collect_garbage(app.config['GC_GRACE_SECONDS'])
+                    db.session.remove()
+                app.logger.info('Garbage collection: {}'.format(report))
+            except Exception:
+                app.logger.exception('Garbage collection failed')
+
+    def start(self):
+        """Start the thread, unless it's running or GC_INTERVAL_SECONDS is 0"""
+        with self._lock:
+            if self._thread is not None or not app.config['GC_INTERVAL_SECONDS']:
+                return
+            self._thread = threading.Thread(target=self._run, name='garbage-collector', daemon=True)
+            self._thread.start()
+
+
+garbage_collector = GarbageCollector()
+
+
+@app.before_first_request
+def _start_garbage_collector():
+    garbage_collector.start()
@@ -0,0 +1,66 @@
+"""HTTP caching of the pages anonymous visitors see.
+
+A page that looks the same for every visitor without a login gets an ETag hashed from the data it shows, a
+Last-Modified where that data has an update time, and a public Cache-Control, so browsers and reverse proxies can reuse
+it. Conditional requests are answered with 304 before the page is rendered. Logged in visitors and visitors with
+pending flashed messages get private pages as before. Both vary by Cookie, so a cache never hands the anonymous page
+to a logged in visitor.
+
+Anonymous views must not write the session, otherwise every response sets a cookie and can't be shared. The search
+form therefore has no CSRF token, and return URLs after login and logout come from the request, not the session"""
+import hashlib
+import os
+from datetime import datetime
+from typing import Callable, Optional
+import flask_login
+from flask import request, session, make_response
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
+from app import app
+from app.pagination import Page
+
+
+def _templates_modified() -> datetime:
+    """Newest modification time of the templates, so a deploy that changes the layout changes every validator"""
+    folder = os.path.join(app.root_path, app.template_folder)
+    return datetime.utcfromtimestamp(int(max(os.path.getmtime(os.path.join(folder, name))
+                                             for name in os.listdir(folder))))
+
+
+_layout_modified = _templates_modified()
+
+
+def is_public() -> bool:
+    """Whether the current request gets the same page as every anonymous visitor"""
+    return request.method in ('GET', 'HEAD') and not flask_login.current_user.is_authenticated \
+        and '_flashes' not in session
+
+
+def page_validators(page: Page) -> tuple:
+    """Validators of a recipe listing: the recipes on the page with their versions, and the links to other pages"""
+    return [(r.id, r.version) for r in page.items], page.next_cursor, page.prev_cursor
+
+
+def public_page(render: Callable[[], str], *validators, last_modified: Optional[datetime] = None) -> Response:
+    """Respond with a page that is cacheable if the request is public, see is_public
+
+    :param render: Renders the page. Not called if the client's copy is still valid
+    :param validators: Everything shown on the page that can change. Hashed into the ETag
+    :param last_modified: Update time of everything shown on the page, None if unknown"""
+    if not is_public():
+        response = make_response(render())
+        response.vary.add('Cookie')
+        return response
+    etag = hashlib.sha1(repr((_layout_modified,) + validators).encode()).hexdigest()
+    if last_modified is not None:
+        last_modified = max(last_modified.replace(microsecond=0), _layout_modified)  # HTTP dates are in seconds
+    if is_resource_modified(request.environ, etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ANONYMOUS_MAX_AGE']
+    response.vary.add('Cookie')     # Flask only adds it if the session was accessed, not for anonymous visitors
+    return response
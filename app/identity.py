@@ -0,0 +1,103 @@
+"""The logged in user, cached per worker process.
+
+flask_login loads the user of the session on every authenticated request. The loader keeps a CachedUser, the few
+columns the views and templates read, for USER_CACHE_SECONDS, so most requests don't query the user at all. Commits
+that change or delete a user drop its entry in this process. Other workers notice at the latest when their entry
+expires, so USER_CACHE_SECONDS bounds how long a changed username or email shows there. 0 disables the cache.
+
+Views compare users by id, e.g. current_user.id == recipe.user_id, instead of loading relationships to compare"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import flask_login
+from sqlalchemy import event
+from app import app, db, login
+from app.models import User, Recipe
+
+MAX_ENTRIES = 10000
+
+
+class CachedUser(flask_login.UserMixin):
+    """The columns of a user that identify it and show on every page. Equal to a User with the same id"""
+
+    def __init__(self, user: User):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+
+    @property
+    def recipes(self):
+        """The recipes of the user, as a query like User.recipes"""
+        return Recipe.query.filter(Recipe.user_id == self.id)
+
+    def __repr__(self):
+        return '<CachedUser {}>'.format(self.username)
+
+
+class UserCache(object):
+    """CachedUsers by id with the time they expire, least recently used first"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user: CachedUser):
+        with self._lock:
+            self._entries[user.id] = time.monotonic() + app.config['USER_CACHE_SECONDS'], user
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+users = UserCache()
+
+
+@login.user_loader
+def user_loader(user_id: str) -> Optional[CachedUser]:
+    """Get the user for flask_login from the cache, or from the database"""
+    user_id = int(user_id)
+    cached = users.get(user_id) if app.config['USER_CACHE_SECONDS'] > 0 else None
+    if cached is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        cached = CachedUser(user)
+        if app.config['USER_CACHE_SECONDS'] > 0:
+            users.set(cached)
+    return cached
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    """Remember the users changed in this transaction, their entries are dropped once it commits"""
+    changed = {user.id for user in session.dirty | session.deleted if isinstance(user, User)}
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        users.delete(user_id)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changed_users(session, previous_transaction):
+    session.info.pop('changed_users', None)
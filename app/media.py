@@ -0,0 +1,55 @@
+"""Serving uploaded images from the blob storage.
+
+Images are stored under content hash names (see app.storage). The content behind such a name never changes, so
+responses are cacheable forever and the hash is a strong ETag that can be checked without touching the storage.
+
+File transfer can be offloaded to the web server: Flask's USE_X_SENDFILE for Apache and lighttpd, or
+IMAGE_ACCEL_REDIRECT_PREFIX for an nginx internal location that aliases VAR_FOLDER"""
+import mimetypes
+import os
+from typing import List
+from flask import request, send_from_directory, abort, url_for
+from werkzeug.wrappers import Response
+from app import app
+from app.storage import current_storage, is_hash_name
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _accel_redirect(key: str, path: str) -> Response:
+    """Empty response telling nginx to send the file from its internal location"""
+    if not os.path.isfile(path):
+        abort(404)
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = app.config['IMAGE_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + key
+    return response
+
+
+def send_image(key: str) -> Response:
+    """Send an image from the blob storage. Files with hash names are sent cacheable forever, with their hash as ETag.
+    Supports If-None-Match, If-Modified-Since and Range requests
+
+    :param key: Storage key, like images/<name>"""
+    name = key.rsplit('/', 1)[-1]
+    immutable = is_hash_name(name)
+    etag = name.split('.')[0] if immutable else None
+    storage = current_storage()
+    path = storage.local_path(key)
+    if immutable and etag in request.if_none_match:
+        response = Response(status=304)   # Answered from the name alone
+    elif path is None:
+        response = storage.response(key)
+    elif app.config['IMAGE_ACCEL_REDIRECT_PREFIX']:
+        response = _accel_redirect(key, path)
+    else:
+        response = send_from_directory(os.path.dirname(path), name, conditional=True, add_etags=not immutable)
+    if immutable:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@app.template_global()
+def recipe_image_urls(recipe) -> List[str]:
+    """URLs of the images of a recipe"""
+    return [url_for('image', image_set='images', image_name=i.file_name) for i in recipe.images]
@@ -0,0 +1,148 @@
+"""Opt-in request instrumentation, enabled with METRICS.
+
+Every request records its wall time, the time spent in database queries, the number of queries and the time spent
+rendering templates. A Server-Timing header sends them to the browser's developer tools, and /metrics exposes totals
+and a latency histogram by endpoint in the Prometheus text format. Each worker process counts its own requests, so
+scrape every worker or sum them up. Queries slower than SLOW_QUERY_SECONDS are logged with the view that ran them,
+also with METRICS off.
+
+Wall time ends when the view has returned, so the time spent streaming a response isn't included"""
+import threading
+import time
+from collections import defaultdict
+import jinja2
+from flask import g, request, has_request_context, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_QUERY_LOG_LENGTH = 500     # Characters of a slow statement that are logged
+
+
+class EndpointMetrics(object):
+    """Totals of the requests to one endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.template_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)   # Requests that took at most the bound, not cumulative
+
+    def add(self, seconds: float, db_seconds: float, queries: int, template_seconds: float):
+        self.requests += 1
+        self.seconds += seconds
+        self.db_seconds += db_seconds
+        self.queries += queries
+        self.template_seconds += template_seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+_lock = threading.Lock()
+endpoints = defaultdict(EndpointMetrics)
+
+
+def _recording() -> bool:
+    return has_request_context() and 'metrics_start' in g
+
+
+@app.before_request
+def _start():
+    if app.config['METRICS']:
+        g.metrics_start = time.perf_counter()
+        g.metrics_db_seconds = 0.0
+        g.metrics_queries = 0
+        g.metrics_template_seconds = 0.0
+
+
+@app.after_request
+def _record(response: Response) -> Response:
+    if not _recording():
+        return response
+    seconds = time.perf_counter() - g.metrics_start
+    with _lock:
+        endpoints[request.endpoint or 'none'].add(seconds, g.metrics_db_seconds, g.metrics_queries,
+                                                  g.metrics_template_seconds)
+    response.headers['Server-Timing'] = 'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, total;dur={:.1f}'.format(
+        g.metrics_db_seconds * 1000, g.metrics_queries, g.metrics_template_seconds * 1000, seconds * 1000)
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_end(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['metrics_query_start']
+    in_request = has_request_context()
+    if in_request and 'metrics_start' in g:
+        g.metrics_db_seconds += seconds
+        g.metrics_queries += 1
+    if seconds >= app.config['SLOW_QUERY_SECONDS'] > 0:
+        app.logger.warning('Slow query in view {} ({:.0f} ms): {}'.format(
+            request.endpoint if in_request else 'none', seconds * 1000, statement[:SLOW_QUERY_LOG_LENGTH]))
+
+
+class _TimedTemplate(jinja2.Template):
+    """Template that adds the time it takes to render to the current request"""
+
+    def render(self, *args, **kwargs) -> str:
+        if not _recording():
+            return super().render(*args, **kwargs)
+        begin = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            g.metrics_template_seconds += time.perf_counter() - begin
+
+
+app.jinja_env.template_class = _TimedTemplate
+
+
+def _escape(label: str) -> str:
+    return label.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def exposition() -> str:
+    """The metrics of all endpoints in the Prometheus text format"""
+    with _lock:
+        snapshot = sorted((name, dict(vars(totals), buckets=list(totals.buckets)))
+                          for name, totals in endpoints.items())
+    lines = []
+    for metric, kind, help_, field in (
+            ('requests_total', 'counter', 'Requests by endpoint', 'requests'),
+            ('db_seconds_total', 'counter', 'Time spent in database queries', 'db_seconds'),
+            ('queries_total', 'counter', 'Database queries', 'queries'),
+            ('template_seconds_total', 'counter', 'Time spent rendering templates', 'template_seconds')):
+        lines += ['# HELP recipe_list_{} {}'.format(metric, help_), '# TYPE recipe_list_{} {}'.format(metric, kind)]
+        lines += ['recipe_list_{}{{endpoint="{}"}} {}'.format(metric, _escape(name), values[field])
+                  for name, values in snapshot]
+    lines += ['# HELP recipe_list_request_seconds Request latency', '# TYPE recipe_list_request_seconds histogram']
+    for name, values in snapshot:
+        label = _escape(name)
+        cumulative = 0
+        for bound, requests in zip(BUCKETS, values['buckets']):
+            cumulative += requests
+            lines.append('recipe_list_request_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                label, bound, cumulative))
+        lines.append('recipe_list_request_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+            label, values['requests']))
+        lines.append('recipe_list_request_seconds_sum{{endpoint="{}"}} {}'.format(label, values['seconds']))
+        lines.append('recipe_list_request_seconds_count{{endpoint="{}"}} {}'.format(label, values['requests']))
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    """Metrics view function. Not found unless METRICS is on"""
+    if not app.config['METRICS']:
+        abort(404)
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
@@ -1,18 +1,12 @@
 """Collection of models for flask-sqlalchemy ORM"""
 
-from app import db, login
+from app import db, passwords
 from datetime import datetime
-import werkzeug.security
 import flask_login
-from typing import Optional
+from typing import Optional, Dict, Iterable, List
 import uuid as uuid_lib
 from sqlalchemy.orm import validates
-
-
-@login.user_loader
-def user_loader(user_id: str):
-    """Get user from database by id for flask_login"""
-    return User.query.get(int(user_id))
+from sqlalchemy import exc
 
 
 # ORM models are just classes with the db columns as member variables
@@ -21,8 +15,9 @@ class User(db.Model, flask_login.UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))  # Long enough for sha512, see app.passwords
     about_me = db.Column(db.String(300), default='')
+    recipe_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')    # See app.counters
     # This is not an actual field but a high level view of all connected recipes.
     # Creates a recipe.author and a user.recipes
     recipes = db.relationship('Recipe', backref='author', lazy='dynamic')
@@ -40,12 +35,12 @@ class User(db.Model, flask_login.UserMixin):
         self.about_me = '' if about_me is None else about_me
 
     def set_password(self, password):
-        """Set user's password hash to a hash of password"""
-        self.password_hash = werkzeug.security.generate_password_hash(password)
+        """Set user's password hash to a hash of password, with the policy of app.passwords"""
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
         """check whether the stored password hash is equal to the hash of password"""
-        return werkzeug.security.check_password_hash(self.password_hash, password)
+        return passwords.check_password(self.password_hash, password)
 
     @validates('about_me')
     def validate_about_me(self, key, about_me):
@@ -62,26 +57,35 @@ skill_levels = ['beginner', 'intermediate', 'advanced', 'pro']
 # An association table for many-to-many relationships
 recipe_tag = db.Table('recipe_tag',
                       db.Column('recipe_id', db.Integer, db.ForeignKey('recipe.id')),
-                      db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')))
+                      db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
+                      db.Index('ix_recipe_tag_recipe_id', 'recipe_id', 'tag_id'),
+                      db.Index('ix_recipe_tag_tag_id', 'tag_id', 'recipe_id'))
 
 
 class Recipe(db.Model):
     """Recipe database model class. Params: body: str, timestamp: Optional[str], user_id: int"""
     __tablename__ = 'recipe'
-    __table_args__ = (db.UniqueConstraint('name', 'user_id'), )
+    # The composite index serves the skill level, minutes and calories facets. See app.facets
+    __table_args__ = (db.UniqueConstraint('name', 'user_id'),
+                      db.Index('ix_recipe_skill_level_minutes_calories', 'skill_level', 'minutes', 'calories'))
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     minutes = db.Column(db.Integer)
     skill_level = db.Column(db.String(10))
     calories = db.Column(db.Integer)
-    thumbnail = db.Column(db.String(30))
+    thumbnail = db.Column(db.String(30), index=True)
     description = db.Column(db.String(100))
     body = db.Column(db.String(500))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))   # user is not capital because it's that way in the db
-    uuid = db.Column(db.String(36))
-    images = db.relationship('RecipeImage', backref='recipe', lazy='dynamic')
+    uuid = db.Column(db.String(36), index=True, unique=True)
+    # Bumped on every change that shows on the recipe's pages, for the fragment cache. See app.fragments
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Along with version. Indexed for the newest update, see app.search
+    updated = db.Column(db.DateTime, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Images go with their recipe, so their blob references are released. See app.storage
+    images = db.relationship('RecipeImage', backref='recipe', lazy='dynamic', cascade='all, delete-orphan')
     # Defines a many-to-many relationship. secondary is the association table used
     tags = db.relationship('Tag', secondary=recipe_tag, backref=db.backref('recipes', lazy='dynamic'), lazy='dynamic')
 
@@ -110,14 +114,11 @@ class Recipe(db.Model):
             self.skill_level = skill_level
         else:
             self.skill_level = skill_levels[0]
-        while True:
-            provisional_uuid = str(uuid_lib.uuid4())
-            if Recipe.query.filter_by(uuid=provisional_uuid).first() is None:
-                self.uuid = provisional_uuid
-                break
+        # Collisions are caught by the unique index when flushing, see add_recipe
+        self.uuid = str(uuid_lib.uuid4())
 
     def has_tag(self, tag):
-        return self.tags.filter(Tag.id == tag.id).count() > 0
+        return db.session.query(self.tags.filter(Tag.id == tag.id).exists()).scalar()
 
     def add_tag(self, tag):
         if not self.has_tag(tag):
@@ -127,14 +128,85 @@ class Recipe(db.Model):
         if self.has_tag(tag):
             self.tags.remove(tag)
 
+    def _current_tags(self) -> Dict[str, 'Tag']:
+        """The recipe's tags by name, with one query"""
+        return {} if self.id is None else {t.name: t for t in self.tags}
+
+    def add_tags(self, names: Iterable[str]):
+        """Add tags by name, creating the ones that don't exist. Looks up the recipe's tags and the named tags with one
+        query each. The flush inserts all recipe_tag rows with one executemany
+
+        :param names: Tag names. Tags the recipe already has are skipped"""
+        for tag in tags_named(set(names) - self._current_tags().keys()):
+            self.tags.append(tag)
+
+    def remove_tags(self, names: Iterable[str]):
+        """Remove tags by name with one query. Names of tags the recipe doesn't have are ignored"""
+        current = self._current_tags()
+        for name in set(names) & current.keys():
+            self.tags.remove(current[name])
+
+    def set_tags(self, names: Iterable[str]):
+        """Replace the recipe's tags with the named ones. Takes two queries, like add_tags"""
+        names, current = set(names), self._current_tags()
+        added = tags_named(names - current.keys())  # Before the removals, so its autoflush doesn't write them early
+        for name in current.keys() - names:
+            self.tags.remove(current[name])
+        for tag in added:
+            self.tags.append(tag)
+
     def __repr__(self):
         return '<Recipe name: {}, description: {}>'.format(self.name, self.description)
 
 
+# The unique constraints by how each dialect names them in its errors: SQLite lists the columns, Postgres names the
+# constraint or unique index. Values are <table>.<field>, see violated_constraint
+_unique_constraints = {
+    'sqlite': {'user.username': 'user.username', 'user.email': 'user.email', 'recipe.name, recipe.user_id': 'recipe.name',
+               'recipe.uuid': 'recipe.uuid', 'tag.name': 'tag.name', 'blob.name': 'blob.name'},
+    'postgresql': {'ix_user_username': 'user.username', 'ix_user_email': 'user.email',
+                   'recipe_name_user_id_key': 'recipe.name', 'ix_recipe_uuid': 'recipe.uuid', 'ix_tag_name': 'tag.name',
+                   'blob_pkey': 'blob.name'},
+}
+_sqlite_unique_prefix = 'UNIQUE constraint failed: '
+
+
+def violated_constraint(error: exc.IntegrityError) -> Optional[str]:
+    """The unique constraint an integrity error violated as <table>.<field>, e.g. 'user.email' or 'recipe.name' for
+    the name of a recipe among its author's. Matches the exact identifier the database reports, never the values in
+    the message. None for other errors and other dialects"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        identifier = getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+    else:
+        message = str(error.orig)
+        identifier = message[len(_sqlite_unique_prefix):] if message.startswith(_sqlite_unique_prefix) else None
+    return _unique_constraints.get(dialect, {}).get(identifier)
+
+
+def add_recipe(recipe: Recipe, attempts: int = 3):
+    """Add a new recipe to the session and flush it, so it gets an id. If its uuid is already taken, the session is
+    rolled back and the recipe flushed again with a new uuid. Other integrity errors, like a duplicate name, are raised
+    after rolling back. Add the recipe before anything else in the transaction, because a retry rolls that back too
+
+    :param recipe: New recipe that's not in the database yet
+    :param attempts: How many uuids to try"""
+    for attempt in range(attempts):
+        db.session.add(recipe)
+        try:
+            db.session.flush()
+            return
+        except exc.IntegrityError as error:
+            db.session.rollback()
+            if attempt + 1 == attempts or violated_constraint(error) != 'recipe.uuid':
+                raise
+            recipe.uuid = str(uuid_lib.uuid4())
+
+
 class RecipeImage(db.Model):
     """Images for recipe. Each recipe may have multiple images"""
     id = db.Column(db.Integer, primary_key=True)
-    file_name = db.Column(db.String(100))
+    file_name = db.Column(db.String(100), index=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'))
 
     def __init__(self, file_name: str, recipe_id: str):
@@ -150,9 +222,43 @@ class RecipeImage(db.Model):
         return '<Image name: {}, Recipe name: {}>'.format(self.file_name, recipe_name)
 
 
+class Blob(db.Model):
+    """An uploaded file in the blob storage, named by its content hash. Identical uploads share one blob.
+    refcount is the number of recipe images and recipe thumbnails using it, kept up to date by app.storage"""
+    name = db.Column(db.String(40), primary_key=True)
+    size = db.Column(db.Integer)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, name: str, size: Optional[int] = None):
+        """Register a stored blob without references
+
+        :param name: Content hash name of the blob, <hash>.<extension>
+        :param size: Size in bytes"""
+        self.name = name
+        self.size = size
+        self.refcount = 0
+
+    def __repr__(self):
+        return '<Blob name: {} References: {}>'.format(self.name, self.refcount)
+
+
+def tags_named(names: Iterable[str]) -> List['Tag']:
+    """Get the tags with the given names with one query. Missing tags are created and added to the session"""
+    names = set(names)
+    if not names:
+        return []
+    tags = Tag.query.filter(Tag.name.in_(names)).all()
+    new = [Tag(name) for name in names - {t.name for t in tags}]
+    db.session.add_all(new)
+    return tags + new
+
+
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), index=True, unique=True)
+    # Indexed for the most popular tags. See app.counters
+    recipe_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
 
     def __init__(self, name: str, recipe: Optional[Recipe] = None):
         """ Create a tag with a name
@@ -164,3 +270,14 @@ class Tag(db.Model):
     def __repr__(self):
         return '<Tag name: {} ID: {}>'.format(self.name, self.id)
 
+
+class Total(db.Model):
+    """Number of rows of a table, kept up to date by app.counters so it's never counted. One row per total_names"""
+    name = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Total {}: {}>'.format(self.name, self.value)
+
+
+total_names = ('recipes', 'tags', 'users')
@@ -0,0 +1,115 @@
+"""Keyset pagination for recipe listings. Pages continue after or before the sort key of the last or first item
+instead of skipping an offset, so every page costs the same as the first one.
+
+Cursors are opaque to users: url-safe base64 of the JSON sort key"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Optional
+from flask import request, url_for
+from sqlalchemy import or_
+from app.models import Recipe
+
+MAX_ID = 2 ** 31 - 1    # Largest id of an INTEGER column on every database
+
+# items are in display order. Cursors are None if there is no page in that direction
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(key: tuple) -> str:
+    """Encode a sort key as an opaque cursor for URLs"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[list]:
+    """Decode a cursor created with encode_cursor. Returns None for missing or malformed cursors"""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return key if isinstance(key, list) else None
+
+
+def keyset_page(fetch: Callable, key: Callable, per_page: int, after: Optional[str] = None,
+                before: Optional[str] = None, parse: Callable = lambda key: key) -> Page:
+    """Get one page of a keyset paginated listing
+
+    :param fetch: fetch(boundary, backwards, limit) returns up to limit items beyond the boundary key, in the order of
+        travel. boundary is None for the first page. backwards means towards the start of the listing
+    :param key: Function returning the JSON serializable sort key of an item
+    :param per_page: Number of items on a page
+    :param after: Cursor of the item the page starts after, from a next link
+    :param before: Cursor of the item the page ends before, from a previous link. Takes precedence over after
+    :param parse: Converts a decoded key back to the boundary for fetch. Returns None for invalid keys"""
+    boundary = _parse_cursor(before, parse)
+    backwards = boundary is not None
+    if not backwards:
+        boundary = _parse_cursor(after, parse)
+    items = list(fetch(boundary, backwards, per_page + 1))
+    more = len(items) > per_page    # One extra item tells whether there's another page in the direction of travel
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+    has_next = True if backwards else more
+    has_prev = more if backwards else boundary is not None
+    return Page(items, encode_cursor(key(items[-1])) if items and has_next else None,
+                encode_cursor(key(items[0])) if items and has_prev else None)
+
+
+def _parse_cursor(cursor: Optional[str], parse: Callable):
+    key = decode_cursor(cursor)
+    return None if key is None else parse(key)
+
+
+def parse_id(value) -> int:
+    """Convert the id of a decoded key. Raises ValueError for ids the database can't compare with"""
+    value = int(value)
+    if not 0 <= value <= MAX_ID:
+        raise ValueError('Id out of range: {}'.format(value))
+    return value
+
+
+def _parse_recipe_key(key: list) -> Optional[tuple]:
+    try:
+        return datetime.fromisoformat(key[0]), parse_id(key[1])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def recipe_page(query, per_page: int, after: Optional[str] = None, before: Optional[str] = None) -> Page:
+    """Page through the recipes of query newest first, on (timestamp, id) so the timestamp index is used
+
+    :param query: Query of recipes, e.g. target_user.recipes"""
+    def fetch(boundary, backwards, limit):
+        query_ = query
+        if boundary is not None:
+            timestamp, recipe_id = boundary
+            if backwards:
+                query_ = query_.filter(Recipe.timestamp >= timestamp,
+                                       or_(Recipe.timestamp > timestamp, Recipe.id > recipe_id))
+            else:
+                query_ = query_.filter(Recipe.timestamp <= timestamp,
+                                       or_(Recipe.timestamp < timestamp, Recipe.id < recipe_id))
+        if backwards:
+            query_ = query_.order_by(Recipe.timestamp.asc(), Recipe.id.asc())
+        else:
+            query_ = query_.order_by(Recipe.timestamp.desc(), Recipe.id.desc())
+        return query_.limit(limit).all()
+
+    return keyset_page(fetch, lambda r: (r.timestamp.isoformat(), r.id), per_page, after, before, _parse_recipe_key)
+
+
+def page_urls(page: Page) -> tuple:
+    """URLs of the previous and next page of the current view, or None if there is none. Other query arguments, e.g.
+    filters, are kept. Arguments named like a part of the path are dropped, the path already has them"""
+    args = {name: values for name, values in request.args.lists()
+            if name not in ('after', 'before') and name not in request.view_args}
+
+    def url(**cursor):
+        return url_for(request.endpoint, **request.view_args, **args, **cursor)
+    return (url(before=page.prev_cursor) if page.prev_cursor else None,
+            url(after=page.next_cursor) if page.next_cursor else None)
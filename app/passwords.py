@@ -0,0 +1,73 @@
+"""Password hashing policy: PBKDF2 with the hash function of PASSWORD_HASH_ALGORITHM and PASSWORD_HASH_ITERATIONS.
+
+Hashing is deliberately slow, so it runs in a pool of PASSWORD_HASH_WORKERS threads per worker process. hashlib
+releases the GIL while hashing, so the pool bounds how many cores a burst of logins and registrations occupies, and
+other requests of a threaded worker keep running. Hashes of another policy still verify. A successful login rehashes
+them in the background, which upgrades or downgrades stored hashes as the policy changes"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional
+import werkzeug.security
+from app import app, db
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    """The hashing pool, created on first use so forked web workers each get their own"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                           thread_name_prefix='password-hash')
+        return _executor
+
+
+def policy() -> str:
+    """The werkzeug method of the configured policy, e.g. 'pbkdf2:sha256:150000'"""
+    return 'pbkdf2:{}:{:d}'.format(app.config['PASSWORD_HASH_ALGORITHM'], app.config['PASSWORD_HASH_ITERATIONS'])
+
+
+def hash_password(password: str) -> str:
+    """Hash password with the configured policy, in the hashing pool"""
+    return _pool().submit(werkzeug.security.generate_password_hash, password, policy(), 16).result()
+
+
+def check_password(password_hash: Optional[str], password: str) -> bool:
+    """Whether password matches password_hash, which may be of another policy. Checked in the hashing pool"""
+    if not password_hash:
+        return False
+    return _pool().submit(werkzeug.security.check_password_hash, password_hash, password).result()
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Whether password_hash was made with another policy than the configured one"""
+    method = password_hash.split('$', 1)[0]
+    if method.startswith('pbkdf2:') and method.count(':') == 1:    # Iterations were left out for the default
+        method += ':{:d}'.format(werkzeug.security.DEFAULT_PBKDF2_ITERATIONS)
+    return method != policy()
+
+
+def rehash_later(user_id: int, password_hash: str, password: str) -> Future:
+    """Replace the hash of a user that was made with another policy, in the hashing pool. Skipped if the user's hash
+    has changed in the meantime, e.g. by a password change
+
+    :param password_hash: The hash password was checked against"""
+    from app.models import User     # app.models uses this module
+    method = policy()
+
+    def rehash():
+        new_hash = werkzeug.security.generate_password_hash(password, method, 16)
+        with app.app_context():
+            try:
+                user = User.__table__
+                db.session.execute(user.update().where(user.c.id == user_id)
+                                   .where(user.c.password_hash == password_hash).values(password_hash=new_hash))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning('Could not rehash the password of user {}: {}'.format(user_id, e))
+            finally:
+                db.session.remove()
+    return _pool().submit(rehash)
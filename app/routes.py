@@ -1,21 +1,54 @@
 """Specifies which URLS the application implements and what behavior those URLS have in view functions"""
 import os
-import shutil
-from app import app, db, thumbnails, images, upload_sets
-from flask import render_template, flash, redirect, url_for, request, send_from_directory, session, g
+from app import app, db, upload_sets, csrf, passwords
+from flask import render_template, flash, redirect, url_for, request, send_from_directory, session, g, Response, \
+    stream_with_context, abort
 import flask_login
 from app.forms import LoginForm, RegistrationForm, CreateRecipeForm, \
-    EditUserForm, AddTagForm, SearchForm, EmptyForm, EditRecipeForm
-from app.models import User, Recipe, RecipeImage, Tag
+    EditUserForm, AddTagForm, SearchForm, EmptyForm, EditRecipeForm, has_recipe_named, violated_field, \
+    username_taken, email_taken, recipe_name_taken
+from app.models import User, Recipe, RecipeImage, Tag, add_recipe, skill_levels
+from app.sampling import random_row
+from app.featured import featured
+from app.search import search_page
+from app.facets import parse_facets, facet_page, MINUTE_BUCKETS, CALORIE_BUCKETS
+from app.pagination import Page, recipe_page, page_urls
+from app.bulk import export_records, format_records, encode_lines
+from app.media import send_image
+from app.storage import current_storage, upload_pool, register_uploads
+from app.http_cache import public_page, page_validators
+from app.thumbnails import thumbnail_queue, thumbnail_key, source_key, sizes as thumbnail_sizes, is_placeholder, \
+    VECTOR_EXTENSIONS
 import werkzeug.urls
-import random
 from sqlalchemy import exc
+from sqlalchemy.orm import joinedload
 
 
-@app.before_first_request
-def before_first():
-    """Initialize session last_url"""
-    session['last_url'] = url_for('index')
+def _local_url(url: str) -> str:
+    """url as a path on this site, or None if it points to another site. Relative URLs starting with // or /\\ are
+    relative to the scheme and lead elsewhere in browsers"""
+    if not url:
+        return None
+    parsed = werkzeug.urls.url_parse(url)
+    if parsed.netloc and parsed.netloc != request.host or parsed.scheme not in ('', 'http', 'https') \
+            or not parsed.path.startswith('/') or parsed.path.startswith(('//', '/\\')):
+        return None
+    return parsed.path + ('?' + parsed.query if parsed.query else '')
+
+
+def _return_url() -> str:
+    """Where to send the user back to: the next argument, else the page the request came from, else the index.
+    Derived from the request, so page views don't write the session and stay cacheable"""
+    return _local_url(request.args.get('next')) or _local_url(request.referrer) or url_for('index')
+
+
+def _unique_field_error(form, error: exc.IntegrityError, messages: dict) -> bool:
+    """Add the message of the user field whose unique constraint the error violates to the form, False if none is"""
+    field = violated_field(error, 'user', messages)
+    if field is None:
+        return False
+    getattr(form, field).errors.append(messages[field])
+    return True
 
 
 @app.before_request
@@ -28,12 +61,10 @@ def before_request():
 @app.route('/index')
 def index():
     """Index view function. Renders an index site"""
-    session['last_url'] = url_for('index')
-    # TODO: Choose these by hand (also make this query use a database random function if database grows)
-    favorite_recipes = [] if Recipe.query.count() < 9 else random.sample(Recipe.query.all(), 9)
-    favorite_tags = [] if Tag.query.count() < 6 else random.sample(Tag.query.all(), 6)
+    # TODO: Choose these by hand
+    favorite_recipes, favorite_tags = featured.pick(9, 6)
     return render_template('index.html', title='Home', favorite_recipes=favorite_recipes,
-                           favorite_tags=favorite_tags)
+                           favorite_tags=favorite_tags, popular_tags=featured.popular_tags[:6], totals=featured.totals)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -49,12 +80,11 @@ def login():
             flash('Invalid username or password')
             return redirect(url_for('login'))
         flask_login.login_user(target_user, remember=form.remember_me.data)
+        if passwords.needs_rehash(target_user.password_hash):
+            passwords.rehash_later(target_user.id, target_user.password_hash, form.password.data)
 
-        next_page = request.args.get('next')    # Where the user is supposed to redirect after login
-        # netloc !='' means it redirects to another page, not a relative URL
-        if not next_page or werkzeug.urls.url_parse(next_page).netloc != '':
-            next_page = session['last_url']
-        return redirect(next_page)
+        # The next argument of the login link. The referrer is the login page itself
+        return redirect(_local_url(request.args.get('next')) or url_for('index'))
     return render_template('login.html', title='Sign In', form=form)
 
 
@@ -62,7 +92,8 @@ def login():
 def logout():
     """Logout view function. Logs the current user out"""
     flask_login.logout_user()
-    return redirect(session['last_url'])
+    session.pop('last_url', None)   # Left by earlier versions, which remembered the page in the session
+    return redirect(_return_url())
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -76,62 +107,86 @@ def register():
         target_user = User(username=form.username.data, email=form.email.data,
                            password=form.password.data, about_me=form.about_me.data)
         db.session.add(target_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except exc.IntegrityError as error:    # Taken by a concurrent registration since the form was validated
+            db.session.rollback()
+            if not _unique_field_error(form, error, {'username': username_taken, 'email': email_taken}):
+                raise
+            return render_template('register.html', title='Register', form=form)
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
 
 
 @app.route('/search', methods=['POST'])
+@csrf.exempt    # Only redirects, and a token would write the session of every page with the search form
 def search():
     """View function for handling search POST requests.
     Separate from search results view function to allow reloading without form resubmission"""
     if g.search_form.validate_on_submit():
         return redirect(url_for('search_results', kind=g.search_form.kind.data, term=g.search_form.term.data))
-    return redirect(session['last_url'])
+    return redirect(_return_url())
 
 
 @app.route('/search/results/<kind>/<term>')
 def search_results(kind: str, term: str):
     """Display search results. Separate request handling to allow reloading without form resubmission."""
+    per_page = int(app.config.get('MAX_SEARCH_RESULTS'))
+    after, before = request.args.get('after'), request.args.get('before')
     if kind == 'tag':
         target_tag = Tag.query.filter(Tag.name == term).first()
-        relevant_recipes = [] if target_tag is None else target_tag.recipes[:app.config.get('MAX_SEARCH_RESULTS')]
+        page = Page([], None, None) if target_tag is None else \
+            recipe_page(target_tag.recipes.options(joinedload(Recipe.author)), per_page, after, before)
         title = 'Tag {}'.format('' if target_tag is None else target_tag.name)
         full_term = 'Recipes in the Tag Named: ' + term
     elif kind == 'recipe':
-        relevant_recipes = Recipe.query.filter(Recipe.name.contains(term))[:app.config.get('MAX_SEARCH_RESULTS')]
+        page = search_page(term, per_page, after, before)
         title = 'Search results'
-        full_term = 'Recipe Names Including: ' + term
+        full_term = 'Recipes Matching: ' + term
     else:
         flash('Not a valid search kind')
         return redirect(url_for('index'))
-    session['last_url'] = url_for('search_results', kind=kind, term=term)
-    return render_template('search_results.html', recipes=relevant_recipes, title=title, search_term=full_term,
-                           display_author=True)
+    prev_url, next_url = page_urls(page)
+    return public_page(lambda: render_template('search_results.html', recipes=page.items, title=title,
+                                               search_term=full_term, display_author=True, prev_url=prev_url,
+                                               next_url=next_url),
+                       kind, term, page_validators(page))
+
+
+@app.route('/search/filter')
+def filter_recipes():
+    """Display the recipes matching facets given as query arguments, see app.facets.parse_facets, with the facet
+    counts of all matching recipes"""
+    facets = parse_facets(request.args)
+    page, counts = facet_page(facets, int(app.config.get('MAX_SEARCH_RESULTS')),
+                              request.args.get('after'), request.args.get('before'))
+    prev_url, next_url = page_urls(page)
+    return public_page(lambda: render_template('search_results.html', recipes=page.items, title='Filter',
+                                               search_term='Filtered Recipes', display_author=True, facets=facets,
+                                               counts=counts, minute_buckets=MINUTE_BUCKETS,
+                                               calorie_buckets=CALORIE_BUCKETS, prev_url=prev_url, next_url=next_url),
+                       facets, counts, page_validators(page))
 
 
 @app.route('/recipe/<uuid>/add-tag', methods=['POST'])
 @flask_login.login_required
 def add_tag(uuid):
-    """Add a Tag to a recipe. Does not display anything, but just processes data from a form elsewhere."""
+    """Add comma separated Tags to a recipe. Does not display anything, but just processes data from a form
+    elsewhere."""
     form = AddTagForm()
-    if not form.tag_name.data:
-        return redirect(session['last_url'])
+    if not form.tag_names.data:
+        return redirect(_return_url())
     if form.validate_on_submit():
         target_recipe = Recipe.query.filter_by(uuid=uuid).first()
-        target_tag = Tag.query.filter_by(name=form.tag_name.data).first()
-        if target_tag is None:
-            target_tag = Tag(form.tag_name.data)
-            db.session.add(target_tag)
         if target_recipe is None:
             flash('That recipe does not exist')
             return redirect(url_for('index'))
-        if flask_login.current_user != target_recipe.author:
+        if flask_login.current_user.id != target_recipe.user_id:
             flash("You're not authorized to add a tag to this recipe")
             return redirect(url_for('recipe', uuid=uuid))
 
-        target_recipe.add_tag(target_tag)
+        target_recipe.add_tags(form.tag_names.data)
         db.session.commit()
         return redirect(url_for('recipe', uuid=uuid))
     else:
@@ -143,21 +198,17 @@ def recipe(uuid: str):
     """Recipe view function. Displays the recipe with uuid."""
     target_recipe = Recipe.query.filter_by(uuid=uuid).first_or_404()
 
-    session['last_url'] = url_for('recipe', uuid=uuid)  # To jump back after login and logout
-
-    tag_names = [t.name for t in target_recipe.tags]
-
-    edit_priv = flask_login.current_user == target_recipe.author if flask_login.current_user.is_authenticated else False
-
-    recipe_images = [i.file_name for i in target_recipe.images]
-    image_urls = [url_for('image', image_set='images', image_name=i) for i in recipe_images]
+    edit_priv = flask_login.current_user.is_authenticated and flask_login.current_user.id == target_recipe.user_id
 
-    add_tag_form = AddTagForm()
+    # Tags and images are loaded by the template, only if its fragments aren't cached. See app.fragments
+    # Forms only for the author, their CSRF tokens would write the session
+    add_tag_form = AddTagForm() if edit_priv else None
 
-    delete_form = EmptyForm()
+    delete_form = EmptyForm() if edit_priv else None
 
-    return render_template('recipe.html', title='Recipe', recipe=target_recipe, image_urls=image_urls,
-                           tag_names=tag_names, edit_priv=edit_priv, add_tag_form=add_tag_form, delete_form=delete_form)
+    return public_page(lambda: render_template('recipe.html', title='Recipe', recipe=target_recipe, edit_priv=edit_priv,
+                                               add_tag_form=add_tag_form, delete_form=delete_form),
+                       target_recipe.id, target_recipe.version, last_modified=target_recipe.updated)
 
 
 @app.route('/recipe/<uuid>/delete', methods=['POST'])
@@ -169,11 +220,12 @@ def delete_recipe(uuid: str):
         if target_recipe is None:
             flash('That recipe does not exist')
             return redirect(url_for('index'))
-        if target_recipe.author != flask_login.current_user:
+        if target_recipe.user_id != flask_login.current_user.id:
             flash('Only the author may delete a recipe')
             return redirect(url_for('index'))
         db.session.delete(target_recipe)
         db.session.commit()
+        featured.expire()
         flash('Recipe deleted')
         return redirect(url_for('user', username=flask_login.current_user.username))
 
@@ -186,10 +238,13 @@ def tag(tag_name: str):
         flash('Tag {} does not exist').format(tag_name)
         return redirect(url_for('index'))
 
-    session['last_url'] = url_for('tag', tag_name=tag_name)
-    relevant_recipes = target_tag.recipes[:app.config.get('MAX_SEARCH_RESULTS')]
-    return render_template('search_results.html', title="Tag {}".format(tag_name), search_term=target_tag.name,
-                           recipes=relevant_recipes)
+    page = recipe_page(target_tag.recipes, int(app.config.get('MAX_SEARCH_RESULTS')),
+                       request.args.get('after'), request.args.get('before'))
+    prev_url, next_url = page_urls(page)
+    return public_page(lambda: render_template('search_results.html', title="Tag {}".format(tag_name),
+                                               search_term=target_tag.name, recipe_count=target_tag.recipe_count,
+                                               recipes=page.items, prev_url=prev_url, next_url=next_url),
+                       tag_name, target_tag.recipe_count, page_validators(page))
 
 
 @app.route('/user/<username>')
@@ -200,45 +255,29 @@ def user(username: str):
         flash('User {} does not exist'.format(username))
         return redirect(url_for('index'))
 
-    session['last_url'] = url_for('user', username=username)  # To jump back after login and logout
+    edit_priv = flask_login.current_user.is_authenticated and flask_login.current_user.id == target_user.id
 
-    edit_priv = flask_login.current_user == target_user if flask_login.current_user.is_authenticated else False
-
-    recipes = list(target_user.recipes)
+    page = recipe_page(target_user.recipes, app.config['RECIPES_PER_PAGE'],
+                       request.args.get('after'), request.args.get('before'))
+    recipes = page.items
     col_count = 3
     recipes_matrix = [recipes[row:row+col_count] for row in range(0, len(recipes), col_count)]
 
-    return render_template('user.html', title='User Profile', user=target_user,
-                           edit_privilege=edit_priv, recipes=recipes_matrix)
+    prev_url, next_url = page_urls(page)
+    return public_page(lambda: render_template('user.html', title='User Profile', user=target_user,
+                                               edit_privilege=edit_priv, recipes=recipes_matrix, prev_url=prev_url,
+                                               next_url=next_url),
+                       target_user.username, target_user.about_me, target_user.recipe_count, page_validators(page))
 
 
 @app.route('/random_recipe')
 def random_recipe():
     """Random recipe view function. Selects a random recipe and redirects to that recipe's URL"""
-    try:
-        recipe_uuid = random.choice(db.session.query(Recipe.uuid).all())[0]
-    except IndexError:
+    target_recipe = random_row(Recipe)
+    if target_recipe is None:
         flash('There are no recipes')
         return redirect(url_for('index'))
-    return redirect(url_for('recipe', uuid=recipe_uuid))
-
-
-def _appropriate_thumbnail_file_name(recipe_images):
-    """Helper function to locate a file_name for thumbnail. Use first image if it exists, otherwise use placeholder
-
-    :param recipe_images: data from MultipleFileField with images. The first image will be selected if not None"""
-    first_filename = recipe_images[0].filename if recipe_images else None
-    if not first_filename:
-        return 'placeholder.png'
-    else:
-        try:
-            shutil.copy2(os.path.join(app.config['VAR_FOLDER'], 'images', first_filename),
-                         os.path.join(app.config['VAR_FOLDER'], 'thumbnails'))
-            return first_filename
-        except (FileNotFoundError, IOError):
-            app.logger.error(
-                'Could not open file {} for storing as a thumbnail, using placeholder'.format(first_filename))
-            return 'placeholder.png'
+    return redirect(url_for('recipe', uuid=target_recipe.uuid))
 
 
 @app.route('/create_recipe', methods=['GET', 'POST'])
@@ -247,50 +286,92 @@ def create_recipe():
     """View function to create recipe. Renders an input form for various information and saves it to database"""
     form = CreateRecipeForm()
     if form.validate_on_submit():
+        # Files are stored before the transaction begins, so it isn't held open while they are written
+        images = form.recipe_images.data or []
+        files = [f for f in images if f] + ([form.thumbnail.data] if form.thumbnail.data else [])
+        uploads = upload_pool.store([(f.stream, f.filename) for f in files])
+        stored_names = iter(upload.name for upload in uploads)
 
         r = Recipe(form.name.data, flask_login.current_user.id, 'placeholder.png', form.description.data,
-                   form.minutes.data, form.skill_level.data, form.calories.data, form.body.data)
+                   form.minutes.data, skill_levels[form.skill_level.data], form.calories.data, form.body.data)
         try:
-            db.session.add(r)
-            db.session.commit()     # Needs to be done here so id gets generated for adding the thumbnail
-        except exc.IntegrityError:
-            db.session.rollback()
-            flash('Each of your recipe names must be unique')
-            app.logger.warning('Had to rollback because of duplicate recipe names')
-            return render_template('create_recipe.html', title='Create Recipe', form=form)
-
-        for recipe_image in form.recipe_images.data:
-            recipe_image_name = images.save(recipe_image) if recipe_image else 'placeholder.png'
-            i = RecipeImage(recipe_image_name, r.id)
-            db.session.add(i)
-
-        # Needs to be back here because the files need to be saved on disk already
-        r.thumbnail = _appropriate_thumbnail_file_name(form.recipe_images.data) if not form.thumbnail.data\
-            else thumbnails.save(form.thumbnail.data)
-
-        db.session.commit()
+            add_recipe(r)   # Flushed first for its id. A retry with a new uuid rolls back what came before
+            register_uploads(uploads)
+            image_names = [next(stored_names) if f else 'placeholder.png' for f in images]
+            db.session.add_all(RecipeImage(name, r.id) for name in image_names)
+            # The uploaded thumbnail or the first image. The downscaled versions are rendered by the thumbnail workers
+            r.thumbnail = next(stored_names) if form.thumbnail.data \
+                else next((n for n in image_names if n != 'placeholder.png'), 'placeholder.png')
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()   # The stored files are left to the garbage collector
+            if isinstance(error, exc.IntegrityError) and violated_field(error, 'recipe', ['name']):
+                flash(recipe_name_taken)
+                app.logger.warning('Had to rollback because of duplicate recipe names')
+                return render_template('create_recipe.html', title='Create Recipe', form=form)
+            raise
+        thumbnail_queue.submit(r.thumbnail)
 
         flash('Recipe {} created successfully'.format(r.name))
         return redirect(url_for('recipe', uuid=r.uuid))
     return render_template('create_recipe.html', title='Create Recipe', form=form)
 
 
+@app.route('/export')
+@flask_login.login_required
+def export():
+    """Export view function. Streams all recipes with their tags and images as a JSON Lines download.
+    ?format=csv exports CSV instead, ?gzip=1 compresses the download"""
+    format_ = 'csv' if request.args.get('format') == 'csv' else 'jsonl'
+    compress = request.args.get('gzip') == '1'
+    lines = format_records(export_records(app.config['EXPORT_BATCH_SIZE']), format_)
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if format_ == 'csv' else 'application/x-ndjson'
+    file_name = 'recipes.{}{}'.format(format_, '.gz' if compress else '')
+    # stream_with_context keeps the request and its database session alive while the response is sent
+    return Response(stream_with_context(encode_lines(lines, compress)), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=' + file_name})
+
+
 @app.route('/image/<image_set>/<image_name>')
 def image(image_set: str, image_name: str):
     """View function to retrieve an image in a given image set"""
-    if image_set in upload_sets:
-        return send_from_directory(os.path.join(app.config['VAR_FOLDER'], image_set), image_name)
+    if image_set in upload_sets and image_name != 'placeholder.png':
+        return send_image('{}/{}'.format(image_set, image_name))
     else:
-        app.logger.warning('Invalid upload set for image view function, using placeholder')
+        if image_set not in upload_sets:
+            app.logger.warning('Invalid upload set for image view function, using placeholder')
         return send_from_directory(os.path.join(app.config['STATIC_FOLDER'], 'images'), 'placeholder.png')
 
 
-@flask_login.login_required
+@app.route('/thumbnail/<int:width>/<image_name>')
+def thumbnail(width: int, image_name: str):
+    """View function for a downscaled thumbnail. Serves the placeholder and queues the thumbnail until it is ready"""
+    if width not in thumbnail_sizes():
+        abort(404)
+    if is_placeholder(image_name):  # Nothing to render, it is the placeholder already
+        return send_from_directory(os.path.join(app.config['STATIC_FOLDER'], 'images'), 'placeholder.png')
+    key = thumbnail_key(image_name, width)
+    if current_storage().exists(key):
+        return send_image(key)
+
+    source = source_key(image_name)
+    if source is not None and source.lower().endswith(VECTOR_EXTENSIONS):
+        return send_image(source)
+    thumbnail_queue.submit(image_name, source)    # For recipes from before thumbnails were rendered, or lost jobs
+    response = send_from_directory(os.path.join(app.config['STATIC_FOLDER'], 'images'), 'placeholder.png')
+    response.cache_control.no_cache = True  # Ask again, the thumbnail should be ready soon
+    return response
+
+
 @app.route('/user/<username>/edit', methods=['GET', 'POST'])
+@flask_login.login_required
 def edit(username: str):
     """Edit the information of the user with the given username. Will redirect to index if user does not exist"""
     target_user = User.query.filter_by(username=username).first()
-    if not target_user or target_user != flask_login.current_user:
+    if not target_user or target_user.id != flask_login.current_user.id:
         flash('You can not access this page')
         app.logger.warning('The wrong user gained access to the edit user profile page')
         return redirect(url_for('index'))
@@ -314,18 +395,24 @@ def edit(username: str):
         target_user.email = form.email.data
         target_user.about_me = form.about_me.data
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except exc.IntegrityError as error:
+            db.session.rollback()
+            if not _unique_field_error(form, error, {'username': username_taken, 'email': email_taken}):
+                raise
+            return render_template('edit_user.html', title='Edit User', form=form, username=username)
         return redirect(url_for('user', username=target_user.username))
 
     return render_template('edit_user.html', title='Edit User', form=form, username=target_user.username)
 
 
-@flask_login.login_required
 @app.route('/recipe/<uuid>/edit', methods=['GET', 'POST'])
+@flask_login.login_required
 def edit_recipe(uuid: str):
     """Edit the information of the recipe with the given uuid. Will redirect to index if recipe does not exist"""
     target_recipe = Recipe.query.filter_by(uuid=uuid).first()
-    if not target_recipe or target_recipe.author != flask_login.current_user:
+    if not target_recipe or target_recipe.user_id != flask_login.current_user.id:
         flash('You can not access this page')
         app.logger.warning('The wrong user gained access to the edit recipe page')
         return redirect(url_for('index'))
@@ -334,27 +421,37 @@ def edit_recipe(uuid: str):
     if request.method == 'GET':     # This is so values don't get overwritten on POST
         form.name.default = target_recipe.name
         form.minutes.default = target_recipe.minutes
-        form.skill_level.default = target_recipe.skill_level
+        # The form's choices are indexes of skill_levels
+        form.skill_level.default = skill_levels.index(target_recipe.skill_level) \
+            if target_recipe.skill_level in skill_levels else 0
         form.calories.default = target_recipe.calories
         form.description.default = target_recipe.description
         form.body.default = target_recipe.body
         form.process()
 
     elif form.validate_on_submit():
-        # Can't be a validator because form doesn't know the exact recipe
-        if flask_login.current_user.recipes.filter_by(name=form.name.data).first() is not None \
-                and target_recipe.name != form.name.data:
-            flash('You can only have one recipe with that name')
+        # Can't be a validator because form doesn't know the exact recipe. Only a new name can be taken
+        if target_recipe.name != form.name.data and has_recipe_named(target_recipe.user_id, form.name.data):
+            flash(recipe_name_taken)
             return render_template('edit_recipe.html', title='Edit Recipe', form=form, recipe_name=target_recipe.name)
 
         target_recipe.name = form.name.data
         target_recipe.minutes = form.minutes.data
-        target_recipe.skill_level = form.skill_level.data
+        target_recipe.skill_level = skill_levels[form.skill_level.data]
         target_recipe.calories = form.calories.data
         target_recipe.description = form.description.data
         target_recipe.body = form.body.data
 
-        db.session.commit()
+        recipe_name = target_recipe.name
+        try:
+            db.session.commit()
+        except exc.IntegrityError as error:
+            db.session.rollback()
+            if not violated_field(error, 'recipe', ['name']):
+                raise
+            flash(recipe_name_taken)
+            return render_template('edit_recipe.html', title='Edit Recipe', form=form, recipe_name=recipe_name)
+        featured.expire()
         flash('Changes saved successfully!')
         return redirect(url_for('recipe', uuid=target_recipe.uuid))
 
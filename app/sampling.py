@@ -0,0 +1,97 @@
+"""Database-side random sampling of rows, so views never have to load a whole table to pick a few random entries.
+
+The sampler is chosen per database dialect and can be overridden with the RANDOM_SAMPLER config variable"""
+import random
+from typing import Optional
+from sqlalchemy import func, tablesample
+from sqlalchemy.orm import aliased
+from app import app, db
+
+
+def _id_range_sample(model, k: int, attempts: int = 5) -> list:
+    """Sample by drawing random primary keys between the smallest and largest id and fetching them in one query.
+    Draws again for ids that hit gaps left by deleted rows, falls back to ORDER BY RANDOM() if the table is too sparse
+
+    :param model: Model class with an integer primary key named id
+    :param k: Maximum number of rows to return
+    :param attempts: How often to redraw ids that did not exist before falling back"""
+    # Separate subqueries, because SQLite only answers a min() or max() from the index if it's alone in the query
+    low, high = db.session.query(db.session.query(func.min(model.id)).as_scalar(),
+                                 db.session.query(func.max(model.id)).as_scalar()).one()
+    if low is None:
+        return []
+    if high - low + 1 <= k:     # Small id range, every row fits into the sample anyway
+        rows = model.query.filter(model.id.between(low, high)).all()
+        return random.sample(rows, len(rows))
+
+    found = {}
+    for _ in range(attempts):
+        missing = k - len(found)
+        if missing <= 0:
+            break
+        # Oversample a bit, so a few gaps don't cost an extra round trip
+        candidates = {random.randint(low, high) for _ in range(missing * 2)} - found.keys()
+        if not candidates:
+            continue
+        for row in model.query.filter(model.id.in_(candidates)).all():
+            found[row.id] = row
+    if len(found) < k:
+        app.logger.debug('Id range sampling of {} only found {} of {} rows'.format(model.__name__, len(found), k))
+        return _order_by_random_sample(model, k)
+    return random.sample(list(found.values()), k)
+
+
+def _order_by_random_sample(model, k: int) -> list:
+    """Sample with ORDER BY RANDOM() LIMIT k. The database scans the table, but only k rows are transferred"""
+    return model.query.order_by(func.random()).limit(k).all()
+
+
+def _tablesample_sample(model, k: int) -> list:
+    """Sample with Postgres' TABLESAMPLE SYSTEM, which only reads a few random pages instead of the whole table.
+    The sampled percentage is derived from the planner's row estimate, so no count is needed"""
+    estimate = db.session.execute('SELECT reltuples FROM pg_class WHERE relname = :name',
+                                  {'name': model.__tablename__}).scalar()
+    if not estimate or estimate < k * 100:  # Sampling pages of a small table is unreliable
+        return _id_range_sample(model, k)
+
+    percent = min(100.0, 100.0 * k * 10 / estimate)
+    sampled = aliased(model, tablesample(model.__table__, func.system(percent)))
+    rows = db.session.query(sampled).order_by(func.random()).limit(k).all()
+    return rows if len(rows) == k else _id_range_sample(model, k)
+
+
+samplers = {
+    'id_range': _id_range_sample,
+    'order_by_random': _order_by_random_sample,
+    'tablesample': _tablesample_sample,
+}
+
+# Which sampler to use for RANDOM_SAMPLER='auto'. Other dialects use ORDER BY RANDOM()
+_dialect_samplers = {
+    'postgresql': 'tablesample',
+    'sqlite': 'id_range',
+}
+
+
+def _sampler():
+    """Get the sampling function for the configured sampler or the current database dialect"""
+    name = app.config.get('RANDOM_SAMPLER', 'auto')
+    if name == 'auto':
+        name = _dialect_samplers.get(db.engine.dialect.name, 'order_by_random')
+    return samplers[name]
+
+
+def random_rows(model, k: int) -> list:
+    """Get up to k distinct random rows of model in random order
+
+    :param model: Model class with an integer primary key named id
+    :param k: Maximum number of rows. Less are returned if the table has less rows"""
+    if k <= 0:
+        return []
+    return _sampler()(model, k)
+
+
+def random_row(model) -> Optional[db.Model]:
+    """Get a single random row of model or None if the table is empty"""
+    rows = random_rows(model, 1)
+    return rows[0] if rows else None
@@ -0,0 +1,517 @@
+"""Full-text search over recipe names, descriptions, bodies and tag names.
+
+The backend is selected by the database dialect of SQLALCHEMY_DATABASE_URI, or explicitly with SEARCH_BACKEND:
+'fts5' keeps an SQLite FTS5 table, 'tsvector' a weighted Postgres tsvector table with a GIN index and 'like' falls back
+to scanning recipe names. The index tables live next to the models, are created with db.create_all() and are kept in
+sync in the same transaction whenever a flush adds, changes or deletes recipes.
+
+'memory' is for databases without full-text extensions: an inverted index in each worker process, built on the first
+request and updated from the ORM events of the worker's committed transactions. Other workers and flask recipes import
+write behind its back, so searches check every SEARCH_INDEX_CHECK_SECONDS whether the recipe total or the newest update
+time changed and then rebuild the index. Changes by the worker itself show at once, but also cause such a rebuild"""
+import re
+import threading
+import time
+from array import array
+from collections import defaultdict
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Optional, Iterable
+from sqlalchemy import event, text, bindparam, inspect, select, func
+from sqlalchemy.orm import object_session, joinedload
+from app import app, db
+from app.models import Recipe, Total
+from app.pagination import Page, keyset_page, parse_id
+
+MAX_QUERY_TERMS = 10
+
+
+def tokens(text: Optional[str]) -> List[str]:
+    """Split text into lowercase word tokens"""
+    return re.findall(r'\w+', text.lower()) if text else []
+
+
+def query_terms(term: str) -> List[str]:
+    """Split a user supplied search string into lowercase word tokens. Everything else is dropped, so the tokens
+    are safe to put into the query syntax of any backend"""
+    return tokens(term)[:MAX_QUERY_TERMS]
+
+
+class SearchBackend(object):
+    """Interface of a search backend. Index maintenance methods get the connection of the current transaction"""
+    name = None
+    tables = ()     # Tables owned by the backend, which are not part of the models
+    in_database = True  # Whether the index is updated in the flushing transaction
+
+    def create(self, connection):
+        """Create the index tables if they don't exist"""
+
+    def drop(self, connection):
+        """Drop the index tables if they exist"""
+
+    def update(self, connection, recipe_ids: List[int]):
+        """(Re-)index the recipes with the given ids from their current rows"""
+
+    def remove(self, connection, recipe_ids: List[int]):
+        """Remove the recipes with the given ids from the index"""
+
+    def rebuild(self, connection):
+        """Index all recipes from scratch"""
+
+    def search(self, term: str, limit: int, boundary: Optional[tuple] = None, backwards: bool = False) -> List[tuple]:
+        """Get the sort keys (score, recipe id) of the recipes matching term. Lower keys are better matches
+
+        :param limit: Maximum number of keys to return
+        :param boundary: Only return keys after this one, or before it if backwards. Used for keyset pagination
+        :param backwards: Return the keys before boundary in descending order instead"""
+        raise NotImplementedError
+
+
+def _keyset_sql(select: str, boundary: Optional[tuple], backwards: bool) -> str:
+    """Wrap a statement selecting (score, id) columns into one returning the keys after or before :score, :id"""
+    statement = 'SELECT score, id FROM ({}) matches'.format(select)
+    if boundary is not None:
+        statement += ' WHERE (score, id) {} (:score, :id)'.format('<' if backwards else '>')
+    return statement + (' ORDER BY score DESC, id DESC' if backwards else ' ORDER BY score, id') + ' LIMIT :limit'
+
+
+def _keyset_parameters(boundary: Optional[tuple], limit: int, **parameters) -> dict:
+    if boundary is not None:
+        parameters['score'], parameters['id'] = boundary
+    parameters['limit'] = limit
+    return parameters
+
+
+# Tag names of a recipe as one space separated string, for the INSERT ... SELECT statements of the backends
+_sqlite_tag_names = '(SELECT group_concat(tag.name, \' \') FROM recipe_tag JOIN tag ON tag.id = recipe_tag.tag_id ' \
+                    'WHERE recipe_tag.recipe_id = recipe.id)'
+_postgres_tag_names = '(SELECT string_agg(tag.name, \' \') FROM recipe_tag JOIN tag ON tag.id = recipe_tag.tag_id ' \
+                      'WHERE recipe_tag.recipe_id = recipe.id)'
+
+
+def _with_ids(statement: str):
+    """Compile statement with an expanding :ids parameter for IN clauses"""
+    return text(statement).bindparams(bindparam('ids', expanding=True))
+
+
+class Fts5Backend(SearchBackend):
+    """SQLite FTS5 virtual table with the recipe id as rowid, ranked with bm25"""
+    name = 'fts5'
+    tables = ('recipe_fts',)
+    _select = 'SELECT recipe.id, recipe.name, recipe.description, recipe.body, {} FROM recipe'.format(
+        _sqlite_tag_names)
+    _insert = 'INSERT INTO recipe_fts (rowid, name, description, body, tags) '
+    # Column weights for name, description, body, tags
+    _rank = 'bm25(recipe_fts, 10.0, 4.0, 1.0, 5.0)'
+
+    def create(self, connection):
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS recipe_fts "
+                           "USING fts5(name, description, body, tags, prefix='2 3')")
+
+    def drop(self, connection):
+        connection.execute('DROP TABLE IF EXISTS recipe_fts')
+
+    def update(self, connection, recipe_ids: List[int]):
+        self.remove(connection, recipe_ids)
+        connection.execute(_with_ids(self._insert + self._select + ' WHERE recipe.id IN :ids'), ids=recipe_ids)
+
+    def remove(self, connection, recipe_ids: List[int]):
+        connection.execute(_with_ids('DELETE FROM recipe_fts WHERE rowid IN :ids'), ids=recipe_ids)
+
+    def rebuild(self, connection):
+        connection.execute('DELETE FROM recipe_fts')
+        connection.execute(self._insert + self._select)
+
+    def search(self, term: str, limit: int, boundary: Optional[tuple] = None, backwards: bool = False) -> List[tuple]:
+        terms = query_terms(term)
+        if not terms:
+            return []
+        match = ' '.join('"{}"*'.format(t) for t in terms)  # Prefix match on every term, all terms must match
+        select = 'SELECT {} AS score, rowid AS id FROM recipe_fts WHERE recipe_fts MATCH :match'.format(self._rank)
+        rows = db.session.execute(text(_keyset_sql(select, boundary, backwards)),
+                                  _keyset_parameters(boundary, limit, match=match))
+        return [tuple(row) for row in rows]
+
+
+class TsvectorBackend(SearchBackend):
+    """Postgres table of one weighted tsvector per recipe with a GIN index, ranked with ts_rank.
+    Names weigh most, then tags, description and body"""
+    name = 'tsvector'
+    tables = ('recipe_search',)
+    _select = "SELECT recipe.id, " \
+              "setweight(to_tsvector('simple', coalesce(recipe.name, '')), 'A') || " \
+              "setweight(to_tsvector('simple', coalesce({}, '')), 'B') || " \
+              "setweight(to_tsvector('simple', coalesce(recipe.description, '')), 'C') || " \
+              "setweight(to_tsvector('simple', coalesce(recipe.body, '')), 'D') FROM recipe".format(
+                  _postgres_tag_names)
+    _upsert = ' ON CONFLICT (recipe_id) DO UPDATE SET document = EXCLUDED.document'
+
+    def create(self, connection):
+        connection.execute('CREATE TABLE IF NOT EXISTS recipe_search '
+                           '(recipe_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_recipe_search_document '
+                           'ON recipe_search USING GIN (document)')
+
+    def drop(self, connection):
+        connection.execute('DROP TABLE IF EXISTS recipe_search')
+
+    def update(self, connection, recipe_ids: List[int]):
+        connection.execute(_with_ids('INSERT INTO recipe_search (recipe_id, document) ' + self._select +
+                                     ' WHERE recipe.id IN :ids' + self._upsert), ids=recipe_ids)
+
+    def remove(self, connection, recipe_ids: List[int]):
+        connection.execute(_with_ids('DELETE FROM recipe_search WHERE recipe_id IN :ids'), ids=recipe_ids)
+
+    def rebuild(self, connection):
+        connection.execute('DELETE FROM recipe_search')
+        connection.execute('INSERT INTO recipe_search (recipe_id, document) ' + self._select)
+
+    def search(self, term: str, limit: int, boundary: Optional[tuple] = None, backwards: bool = False) -> List[tuple]:
+        terms = query_terms(term)
+        if not terms:
+            return []
+        # Negated, so lower is better like for the other backends. Double precision, so cursors compare exactly
+        select = "SELECT -CAST(ts_rank(document, query) AS DOUBLE PRECISION) AS score, recipe_id AS id " \
+                 "FROM recipe_search, to_tsquery('simple', :query) query WHERE document @@ query"
+        rows = db.session.execute(text(_keyset_sql(select, boundary, backwards)),
+                                  _keyset_parameters(boundary, limit, query=' & '.join(t + ':*' for t in terms)))
+        return [tuple(row) for row in rows]
+
+
+class LikeBackend(SearchBackend):
+    """No index, scans recipe names with LIKE '%term%'. For databases without a full-text backend"""
+    name = 'like'
+
+    def search(self, term: str, limit: int, boundary: Optional[tuple] = None, backwards: bool = False) -> List[tuple]:
+        query = db.session.query(Recipe.id).filter(Recipe.name.contains(term))
+        if boundary is not None:
+            query = query.filter(Recipe.id < boundary[1] if backwards else Recipe.id > boundary[1])
+        query = query.order_by(Recipe.id.desc() if backwards else Recipe.id)
+        return [(0, row[0]) for row in query.limit(limit)]
+
+
+class MemoryBackend(SearchBackend):
+    """Inverted index held in the worker process. Maps every token to a sorted array of the ids of the recipes
+    containing it. All query terms are prefixes and must match, results are ordered newest first"""
+    name = 'memory'
+    in_database = False
+
+    def __init__(self):
+        self._postings = {}     # token -> array of sorted recipe ids
+        self._vocabulary = []   # Sorted tokens, for prefix lookups
+        self._documents = {}    # recipe id -> (tokens, tag names), to find the postings to change on updates
+        self._lock = threading.RLock()
+        self.built = False
+        self.signature = None   # Recipe total and newest update time the index was built from
+        self.checked_at = 0.0   # When the signature was last compared to the database
+
+    @staticmethod
+    def _document_tokens(name, description, body, tag_names: Iterable[str]) -> frozenset:
+        return frozenset(tokens(' '.join(filter(None, (name, description, body) + tuple(tag_names)))))
+
+    def _add_posting(self, token: str, recipe_id: int):
+        posting = self._postings.get(token)
+        if posting is None:
+            self._postings[token] = array('l', [recipe_id])
+            insort(self._vocabulary, token)
+        elif posting[-1] < recipe_id:  # New recipes have the highest ids
+            posting.append(recipe_id)
+        else:
+            insort(posting, recipe_id)
+
+    def _remove_posting(self, token: str, recipe_id: int):
+        posting = self._postings[token]
+        del posting[bisect_left(posting, recipe_id)]
+        if not posting:
+            del self._postings[token]
+            del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def put(self, recipe_id: int, name: str, description: str, body: str, tag_names: Iterable[str]):
+        """Add or replace the document of a recipe"""
+        tag_names = tuple(tag_names)
+        new_tokens = self._document_tokens(name, description, body, tag_names)
+        with self._lock:
+            old_tokens = self._documents.get(recipe_id, (frozenset(), ()))[0]
+            for token in old_tokens - new_tokens:
+                self._remove_posting(token, recipe_id)
+            for token in new_tokens - old_tokens:
+                self._add_posting(token, recipe_id)
+            self._documents[recipe_id] = (new_tokens, tag_names)
+
+    def delete(self, recipe_id: int):
+        """Remove the document of a recipe, if it's indexed"""
+        with self._lock:
+            old_tokens = self._documents.pop(recipe_id, (frozenset(), ()))[0]
+            for token in old_tokens:
+                self._remove_posting(token, recipe_id)
+
+    def tag_names(self, recipe_id: int) -> tuple:
+        """Tag names of a recipe as of the last indexing"""
+        return self._documents.get(recipe_id, (frozenset(), ()))[1]
+
+    def _load(self, connection, recipe_ids: Optional[List[int]] = None) -> list:
+        """Read (id, name, description, body, tag names) of the given or all recipes"""
+        recipes = 'SELECT id, name, description, body FROM recipe'
+        recipe_tags = 'SELECT recipe_tag.recipe_id, tag.name FROM recipe_tag JOIN tag ON tag.id = recipe_tag.tag_id'
+        if recipe_ids is None:
+            recipe_rows = connection.execute(text(recipes))
+            tag_rows = connection.execute(text(recipe_tags))
+        else:
+            recipe_rows = connection.execute(_with_ids(recipes + ' WHERE id IN :ids'), ids=recipe_ids)
+            tag_rows = connection.execute(_with_ids(recipe_tags + ' WHERE recipe_tag.recipe_id IN :ids'),
+                                          ids=recipe_ids)
+        tags = {}
+        for recipe_id, tag_name in tag_rows:
+            tags.setdefault(recipe_id, []).append(tag_name)
+        return [tuple(row) + (tags.get(row[0], ()),) for row in recipe_rows]
+
+    def update(self, connection, recipe_ids: List[int]):
+        for recipe_id, name, description, body, tag_names in self._load(connection, recipe_ids):
+            self.put(recipe_id, name, description, body, tag_names)
+
+    def remove(self, connection, recipe_ids: List[int]):
+        for recipe_id in recipe_ids:
+            self.delete(recipe_id)
+
+    @staticmethod
+    def _signature(connection) -> tuple:
+        """Changes whenever any process adds, changes or deletes recipes"""
+        total = select([Total.value]).where(Total.name == 'recipes').as_scalar()
+        return tuple(connection.execute(select([total, select([func.max(Recipe.updated)]).as_scalar()])).first())
+
+    def rebuild(self, connection):
+        signature = self._signature(connection)  # Before loading, so changes made meanwhile cause another rebuild
+        postings, documents = defaultdict(list), {}
+        for recipe_id, name, description, body, tag_names in self._load(connection):
+            document_tokens = self._document_tokens(name, description, body, tag_names)
+            documents[recipe_id] = (document_tokens, tuple(tag_names))
+            for token in document_tokens:
+                postings[token].append(recipe_id)
+        postings = {token: array('l', sorted(ids)) for token, ids in postings.items()}
+        with self._lock:
+            self._postings, self._documents, self._vocabulary = postings, documents, sorted(postings)
+            self.built = True
+            self.signature, self.checked_at = signature, time.monotonic()
+
+    def refresh(self, connection):
+        """Build the index if it isn't yet, or rebuild it if recipes changed since it was built. Compares with the
+        database at most every SEARCH_INDEX_CHECK_SECONDS, 0 never does"""
+        if not self.built:
+            self.rebuild(connection)
+            return
+        interval = app.config['SEARCH_INDEX_CHECK_SECONDS']
+        with self._lock:
+            if interval <= 0 or time.monotonic() - self.checked_at < interval:
+                return
+            self.checked_at = time.monotonic()   # Concurrent searches don't check too
+        if self._signature(connection) != self.signature:
+            self.rebuild(connection)
+
+    def clear(self):
+        """Forget the whole index. The next search builds it again"""
+        with self._lock:
+            self._postings, self._documents, self._vocabulary = {}, {}, []
+            self.built = False
+            self.signature, self.checked_at = None, 0.0
+
+    def _prefix_posting(self, prefix: str):
+        """Sorted ids of the recipes containing a token starting with prefix"""
+        postings = []
+        for i in range(bisect_left(self._vocabulary, prefix), len(self._vocabulary)):
+            if not self._vocabulary[i].startswith(prefix):
+                break
+            postings.append(self._postings[self._vocabulary[i]])
+        if len(postings) == 1:
+            return postings[0]
+        return array('l', sorted(set().union(*postings)))
+
+    @staticmethod
+    def _intersect(postings: list) -> list:
+        """Ids contained in every one of the sorted postings. Walks the shortest one and binary searches the others"""
+        postings = sorted(postings, key=len)
+        result = list(postings[0])
+        for posting in postings[1:]:
+            matches = []
+            low = 0
+            for recipe_id in result:
+                low = bisect_left(posting, recipe_id, low)
+                if low == len(posting):
+                    break
+                if posting[low] == recipe_id:
+                    matches.append(recipe_id)
+            result = matches
+            if not result:
+                break
+        return result
+
+    def search(self, term: str, limit: int, boundary: Optional[tuple] = None, backwards: bool = False) -> List[tuple]:
+        terms = query_terms(term)
+        if not terms or limit <= 0:
+            return []
+        self.refresh(db.session.connection())
+        with self._lock:
+            postings = [self._prefix_posting(t) for t in terms]
+            matches = self._intersect(postings) if all(postings) else []
+        # Score is the negated id, so the newest recipes come first
+        if backwards:
+            start = bisect_right(matches, boundary[1])
+            return [(-i, i) for i in matches[start:start + limit]]
+        end = len(matches) if boundary is None else bisect_left(matches, boundary[1])
+        return [(-i, i) for i in reversed(matches[max(0, end - limit):end])]
+
+
+backends = {backend.name: backend for backend in (Fts5Backend(), TsvectorBackend(), LikeBackend(), MemoryBackend())}
+
+# Which backend to use for SEARCH_BACKEND='auto'
+_dialect_backends = {
+    'sqlite': 'fts5',
+    'postgresql': 'tsvector',
+}
+
+
+def backend_for(dialect_name: str) -> SearchBackend:
+    """Get the configured search backend, or the default one for dialect_name if SEARCH_BACKEND is 'auto'"""
+    name = app.config.get('SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = _dialect_backends.get(dialect_name, 'like')
+    return backends[name]
+
+
+def current_backend() -> SearchBackend:
+    """Get the search backend for the database the app is connected to"""
+    return backend_for(db.engine.dialect.name)
+
+
+def _parse_search_key(key: list) -> Optional[tuple]:
+    try:
+        return float(key[0]), parse_id(key[1])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def search_page(term: str, per_page: int, after: Optional[str] = None, before: Optional[str] = None) -> Page:
+    """Get a page of recipes matching term, best matches first
+
+    :param term: Search string as entered by the user. Every word must match the start of a word in the recipe
+    :param per_page: Maximum number of recipes on the page
+    :param after: Cursor from the next link of the previous page
+    :param before: Cursor from the previous link of the next page"""
+    backend = current_backend()
+    page = keyset_page(lambda boundary, backwards, limit: backend.search(term, limit, boundary, backwards),
+                       lambda key: key, per_page, after, before, _parse_search_key)
+    if not page.items:
+        return page
+    # Listings show the author of every recipe
+    by_id = {r.id: r for r in Recipe.query.options(joinedload(Recipe.author))
+             .filter(Recipe.id.in_([i for _, i in page.items]))}
+    return page._replace(items=[by_id[i] for _, i in page.items if i in by_id])
+
+
+def search_recipes(term: str, limit: int) -> List[Recipe]:
+    """Get up to limit recipes matching term, best matches first"""
+    return search_page(term, limit).items
+
+
+def reindex(recipe_ids: Optional[List[int]] = None):
+    """Update the index for recipes written without the ORM, e.g. with bulk inserts. Rebuilds the whole index if
+    recipe_ids is None. Runs in the current transaction, so commit afterwards"""
+    connection = db.session.connection()
+    backend = backend_for(connection.dialect.name)
+    if recipe_ids is None:
+        backend.rebuild(connection)
+    elif recipe_ids:
+        backend.update(connection, list(recipe_ids))
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def _create_index_tables(target, connection, **kw):
+    backend_for(connection.dialect.name).create(connection)
+
+
+@event.listens_for(db.Model.metadata, 'before_drop')
+def _drop_index_tables(target, connection, **kw):
+    backend_for(connection.dialect.name).drop(connection)
+
+
+_indexed_attributes = ('name', 'description', 'body', 'tags')
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_index(session, flush_context):
+    """Index recipes that were added or had searchable attributes changed in this flush and drop deleted ones"""
+    changed, deleted = set(), set()
+    for obj in session.new:
+        if isinstance(obj, Recipe):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Recipe) and any(inspect(obj).attrs[a].history.has_changes()
+                                           for a in _indexed_attributes):
+            changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Recipe):
+            deleted.add(obj.id)
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    backend = backend_for(connection.dialect.name)
+    if not backend.in_database:
+        return
+    if changed - deleted:
+        backend.update(connection, list(changed - deleted))
+    if deleted:
+        backend.remove(connection, list(deleted))
+
+
+def _memory_backend(connection) -> Optional[MemoryBackend]:
+    """The memory backend if it's in use and already built, otherwise None"""
+    backend = backend_for(connection.dialect.name)
+    return backend if isinstance(backend, MemoryBackend) and backend.built else None
+
+
+# recipe_tag is a plain table without mapper events, so tag changes are taken from the history of Recipe.tags.
+# Changes are collected per session and only applied to the memory index once the transaction commits
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+def _queue_memory_put(mapper, connection, target):
+    if _memory_backend(connection) is None:
+        return
+    tag_history = inspect(target).attrs.tags.history
+    object_session(target).info.setdefault('memory_index', []).append(
+        (target.id, target.name, target.description, target.body,
+         [t.name for t in tag_history.added], [t.name for t in tag_history.deleted]))
+
+
+@event.listens_for(Recipe, 'after_delete')
+def _queue_memory_delete(mapper, connection, target):
+    if _memory_backend(connection) is None:
+        return
+    object_session(target).info.setdefault('memory_index', []).append((target.id, None, None, None, None, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_memory_changes(session):
+    changes = session.info.pop('memory_index', None)
+    if not changes:
+        return
+    backend = backends['memory']
+    for recipe_id, name, description, body, added_tags, deleted_tags in changes:
+        if added_tags is None:
+            backend.delete(recipe_id)
+        else:
+            tag_names = [t for t in backend.tag_names(recipe_id) if t not in deleted_tags] + added_tags
+            backend.put(recipe_id, name, description, body, tag_names)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_memory_changes(session, transaction):
+    """Drop changes of transactions that ended without commit. Committed changes are already applied by now"""
+    if transaction.parent is None:
+        session.info.pop('memory_index', None)
+
+
+@app.before_first_request
+def _build_memory_index():
+    """Build the memory index when a worker starts serving, instead of in the first search request"""
+    backend = current_backend()
+    if isinstance(backend, MemoryBackend) and not backend.built:
+        backend.rebuild(db.session.connection())
@@ -6,7 +6,7 @@ if (addTagForm) {
     if (addTagForm.classList.contains('expanded')) addTagForm.classList.remove('expanded');
     else {
       addTagForm.classList.add('expanded');
-      document.getElementById('tag_name').focus();
+      document.getElementById('tag_names').focus();
     }
   });
   addTagForm.addEventListener('submit', () => {
@@ -0,0 +1,440 @@
+"""Blob storage for uploaded images, with a local filesystem and an S3 compatible backend.
+
+Uploads are content addressed: an upload is stored once as images/<hash>.<extension>, with the first HASH_LENGTH hex
+digits of the SHA-256 of its content, however many recipes use it. Uploads are hashed while they are streamed to the
+storage in chunks, so large files never sit in memory. Keys are paths relative to the storage root, like
+images/<name> and thumbnails/150/<name> for rendered thumbnails.
+
+Every blob has a row in the blob table. Its refcount follows the recipe images and recipe thumbnails using it, updated
+in the same flush that changes them. BLOB_STORAGE selects the backend: 'local' stores in VAR_FOLDER, 's3' in
+S3_BUCKET with boto3. S3_ENDPOINT_URL points it at other S3 compatible stores like MinIO"""
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from flask import Response, abort, redirect, request, safe_join
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.dialects import postgresql
+from app import app, db
+from app.models import Recipe, RecipeImage, Blob
+
+HASH_LENGTH = 24    # 96 bits. Hash names have to fit into the 30 characters of Recipe.thumbnail
+_hash_name = re.compile(r'^[0-9a-f]{%d}\.[a-z0-9]+$' % HASH_LENGTH)
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024    # Uploads to remote storages are buffered in memory up to this size, then on disk
+_names = bindparam('names', expanding=True)
+
+# A stored upload: its hash name, its size in bytes and whether storing it created the file, rather than finding the
+# same content already stored
+StoredUpload = namedtuple('StoredUpload', ['name', 'size', 'created'])
+
+
+def is_hash_name(name: str) -> bool:
+    return bool(name) and bool(_hash_name.match(name))
+
+
+def _copy_hashing(stream: BinaryIO, f: BinaryIO) -> Tuple[str, int]:
+    """Copy a stream to a file in chunks. Returns the hash name stem of the content and its size"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        f.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest()[:HASH_LENGTH], size
+
+
+class BlobStorage(object):
+    """Interface of the storage backends"""
+    name = None
+
+    def save(self, stream: BinaryIO, extension: str) -> StoredUpload:
+        """Store the content of a stream as images/<hash>.<extension>. If it is already stored, its modification time
+        is updated instead, so the garbage collector doesn't remove it while the new reference isn't committed yet"""
+        raise NotImplementedError
+
+    def put(self, key: str, path: str):
+        """Store a local file under a key, replacing what is there"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        """Size in bytes, None if the key doesn't exist"""
+        raise NotImplementedError
+
+    def modified(self, key: str) -> Optional[float]:
+        """Modification timestamp, None if the key doesn't exist"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Delete a key if it exists"""
+        raise NotImplementedError
+
+    def entries(self, prefix: str = '') -> Iterator[Tuple[str, int, float]]:
+        """(key, size, modification timestamp) of all keys starting with prefix"""
+        raise NotImplementedError
+
+    def keys(self, prefix: str = '') -> Iterator[str]:
+        """All keys starting with prefix"""
+        return (key for key, _, _ in self.entries(prefix))
+
+    @contextmanager
+    def fetch(self, key: str) -> Iterator[str]:
+        """Context manager providing a local path to the content of a key, downloaded if the storage is remote"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of a key on this machine, None for remote storages"""
+        return None
+
+    def response(self, key: str) -> Response:
+        """Response sending the content of a key, for storages without local_path"""
+        raise NotImplementedError
+
+
+class LocalStorage(BlobStorage):
+    """Files in VAR_FOLDER. Writes go to a temporary file in the target directory that is renamed when complete"""
+    name = 'local'
+
+    @property
+    def root(self) -> str:
+        return app.config['VAR_FOLDER']
+
+    def local_path(self, key: str) -> str:
+        return safe_join(self.root, key)    # Raises NotFound for keys leaving the root
+
+    @contextmanager
+    def _temporary(self, directory: str):
+        """Temporary file in directory, to be renamed to its final name once complete. Removed if it wasn't"""
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                yield f, temporary
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def save(self, stream: BinaryIO, extension: str) -> StoredUpload:
+        directory = os.path.join(self.root, 'images')
+        with self._temporary(directory) as (f, temporary):
+            stem, size = _copy_hashing(stream, f)
+            name = '{}.{}'.format(stem, extension)
+            f.close()
+            path = os.path.join(directory, name)
+            created = not os.path.exists(path)
+            if created:
+                os.replace(temporary, path)
+            else:   # Same content is already stored
+                os.utime(path)
+        return StoredUpload(name, size, created)
+
+    def put(self, key: str, path: str):
+        target = self.local_path(key)
+        with open(path, 'rb') as source, self._temporary(os.path.dirname(target)) as (f, temporary):
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+            f.close()
+            os.replace(temporary, target)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.local_path(key))
+
+    def size(self, key: str) -> Optional[int]:
+        path = self.local_path(key)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    def modified(self, key: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.local_path(key))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def entries(self, prefix: str = '') -> Iterator[Tuple[str, int, float]]:
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:   # Renamed or deleted since it was listed
+                        continue
+                    yield key, stat.st_size, stat.st_mtime
+
+    @contextmanager
+    def fetch(self, key: str) -> Iterator[str]:
+        path = self.local_path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        yield path
+
+
+class S3Storage(BlobStorage):
+    """Objects in S3_BUCKET under S3_PREFIX. Uploads are spooled to a temporary file while they are hashed and sent as
+    multipart uploads. Served through the app, or by redirecting to S3_PUBLIC_URL, e.g. a CDN in front of the bucket.
+    Credentials come from the usual AWS environment variables or config files"""
+    name = 's3'
+
+    def __init__(self):
+        self._clients = {}  # boto3 clients can't be shared with forked worker processes, one per process
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if pid not in self._clients:
+            import boto3    # Only needed for this backend
+            self._clients = {pid: boto3.client('s3', endpoint_url=app.config['S3_ENDPOINT_URL'] or None)}
+        return self._clients[pid]
+
+    @property
+    def bucket(self) -> str:
+        return app.config['S3_BUCKET']
+
+    def _key(self, key: str) -> str:
+        return app.config['S3_PREFIX'] + key
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _upload(self, key: str, f: BinaryIO):
+        extra = {'ContentType': mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+        self.client.upload_fileobj(f, self.bucket, self._key(key), ExtraArgs=extra)
+
+    def save(self, stream: BinaryIO, extension: str) -> StoredUpload:
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as f:
+            stem, size = _copy_hashing(stream, f)
+            name = '{}.{}'.format(stem, extension)
+            key = self._key('images/' + name)
+            created = not self.exists('images/' + name)
+            if not created:     # Copying it onto itself updates the modification time
+                self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+                                        MetadataDirective='REPLACE', ContentType=mimetypes.guess_type(key)[0] or
+                                        'application/octet-stream')
+            else:
+                f.seek(0)
+                self._upload('images/' + name, f)
+        return StoredUpload(name, size, created)
+
+    def put(self, key: str, path: str):
+        with open(path, 'rb') as f:
+            self._upload(key, f)
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> Optional[int]:
+        head = self._head(key)
+        return None if head is None else head['ContentLength']
+
+    def modified(self, key: str) -> Optional[float]:
+        head = self._head(key)
+        return None if head is None else head['LastModified'].timestamp()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def entries(self, prefix: str = '') -> Iterator[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(app.config['S3_PREFIX']):], item['Size'], item['LastModified'].timestamp()
+
+    @contextmanager
+    def fetch(self, key: str) -> Iterator[str]:
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1]) as f:
+            self.client.download_fileobj(self.bucket, self._key(key), f)
+            f.flush()
+            yield f.name
+
+    def response(self, key: str) -> Response:
+        if app.config['S3_PUBLIC_URL']:
+            return redirect(app.config['S3_PUBLIC_URL'].rstrip('/') + '/' + self._key(key))
+        arguments = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if request.range is not None:
+            arguments['Range'] = request.headers['Range']
+        try:
+            result = self.client.get_object(**arguments)
+        except self.client.exceptions.NoSuchKey:
+            abort(404)
+        response = Response(result['Body'].iter_chunks(CHUNK_SIZE), mimetype=result.get('ContentType'),
+                            status=206 if 'ContentRange' in result else 200, direct_passthrough=True)
+        response.headers['Content-Length'] = result['ContentLength']
+        response.headers['Accept-Ranges'] = 'bytes'
+        if 'ContentRange' in result:
+            response.headers['Content-Range'] = result['ContentRange']
+        return response
+
+
+storages = {'local': LocalStorage(), 's3': S3Storage()}
+
+
+def current_storage() -> BlobStorage:
+    """The storage selected by BLOB_STORAGE"""
+    return storages[app.config['BLOB_STORAGE']]
+
+
+def _insert_blobs(connection, rows: List[dict]):
+    """Insert blob rows, skipping names that a concurrent transaction inserted since they were looked up. Other
+    dialects than SQLite and Postgres still fail on such a race
+
+    :param rows: Dicts with name, size and refcount"""
+    blob = Blob.__table__
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(blob).on_conflict_do_nothing(index_elements=[blob.c.name])
+    else:
+        statement = blob.insert().prefix_with('OR IGNORE', dialect='sqlite')
+    connection.execute(statement, rows)
+
+
+def change_references(connection, changes: Dict[str, int]):
+    """Add to the refcounts of blobs, creating rows for blobs that don't have one yet
+
+    :param connection: Connection of the current transaction
+    :param changes: Difference of the refcount by blob name. Names that aren't hash names are ignored"""
+    changes = {name: delta for name, delta in changes.items() if delta and is_hash_name(name)}
+    if not changes:
+        return
+    blob = Blob.__table__
+    existing = {name for name, in connection.execute(
+        select([blob.c.name]).where(blob.c.name.in_(bindparam('names', expanding=True))), names=list(changes))}
+    new = [name for name in changes if name not in existing]
+    if new:
+        # Inserted without references and counted up below, in case a concurrent transaction inserted it first
+        _insert_blobs(connection, [{'name': name, 'size': None, 'refcount': 0} for name in new])
+    counted = [name for name in changes if name in existing or changes[name] > 0]  # New rows don't go below 0
+    if counted:
+        connection.execute(blob.update().where(blob.c.name == bindparam('blob_name'))
+                           .values(refcount=blob.c.refcount + bindparam('delta')),
+                           [{'blob_name': name, 'delta': changes[name]} for name in counted])
+
+
+_referencing_attributes = {Recipe: 'thumbnail', RecipeImage: 'file_name'}
+
+
+# active_history loads the old value of an expired attribute when it is set, so the reference it held is released
+@event.listens_for(Recipe.thumbnail, 'set', active_history=True)
+@event.listens_for(RecipeImage.file_name, 'set', active_history=True)
+def _load_old_reference(target, value, old_value, initiator):
+    pass
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_references(session, flush_context):
+    """Count the blob references of recipe images and thumbnails added, changed or deleted in this flush"""
+    changes = Counter()
+    for obj in session.new:
+        attribute = _referencing_attributes.get(type(obj))
+        if attribute is not None:
+            changes[getattr(obj, attribute)] += 1
+    for obj in session.dirty:
+        attribute = _referencing_attributes.get(type(obj))
+        if attribute is not None:
+            history = inspect(obj).attrs[attribute].history
+            changes.update(history.added)
+            changes.subtract(history.deleted)
+    for obj in session.deleted:
+        attribute = _referencing_attributes.get(type(obj))
+        if attribute is not None:
+            history = inspect(obj).attrs[attribute].history
+            changes.subtract(history.deleted or history.unchanged)
+    change_references(session.connection(), changes)
+
+
+def _extension(file_name: str) -> str:
+    return os.path.splitext(file_name)[1].lower().lstrip('.') or 'bin'
+
+
+def save_upload(stream: BinaryIO, file_name: str) -> str:
+    """Store an uploaded file and register its blob. Its references are counted when a recipe or image using the
+    returned name is flushed
+
+    :param stream: Content of the file
+    :param file_name: Original file name, for the extension
+    :return: The hash name"""
+    upload = current_storage().save(stream, _extension(file_name))
+    register_uploads([upload])
+    return upload.name
+
+
+class UploadPool(object):
+    """Stores several uploads at once in a pool of UPLOAD_WORKERS threads, created on first use so forked web workers
+    each get their own. Writing files and sending them to S3 mostly waits for I/O, so the threads overlap"""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=app.config['UPLOAD_WORKERS'],
+                                                    thread_name_prefix='upload')
+            return self._executor
+
+    def store(self, uploads: List[Tuple[BinaryIO, str]]) -> List[StoredUpload]:
+        """Store uploads concurrently, without registering them yet, see register_uploads. If one fails, the error is
+        raised once all are done. The files of the others are left to the garbage collector, like those of a
+        transaction that fails
+
+        :param uploads: Content and original file name of each upload
+        :return: The stored uploads in the order given"""
+        storage = current_storage()
+
+        def save(stream: BinaryIO, file_name: str) -> StoredUpload:
+            with app.app_context():     # For the config in the pool's threads
+                return storage.save(stream, _extension(file_name))
+        if len(uploads) <= 1:
+            return [storage.save(stream, _extension(file_name)) for stream, file_name in uploads]
+        futures = [self._get_executor().submit(save, *upload) for upload in uploads]
+        stored, error = [], None
+        for future in futures:
+            try:
+                stored.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return stored
+
+    def shutdown(self):
+        """Wait for running uploads and stop the threads. The next store starts new ones"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+upload_pool = UploadPool()
+
+
+def register_uploads(uploads: List[StoredUpload]):
+    """Insert blob rows for stored uploads that don't have one yet, in the current transaction. Files of a transaction
+    that fails aren't removed here: another request may have stored the same content and not committed yet. The
+    garbage collector removes them once the grace period is over"""
+    sizes = {upload.name: upload.size for upload in uploads}
+    if not sizes:
+        return
+    existing = {name for name, in db.session.query(Blob.name).filter(Blob.name.in_(_names)).params(names=list(sizes))}
+    new = [{'name': name, 'size': size, 'refcount': 0} for name, size in sizes.items() if name not in existing]
+    if new:
+        _insert_blobs(db.session.connection(), new)
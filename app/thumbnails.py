@@ -0,0 +1,155 @@
+"""Downscaled thumbnails of recipe images, generated by a worker pool instead of in the request.
+
+The thumbnail column of a recipe holds the file name of its source image in the blob storage: an uploaded thumbnail or
+the first recipe image, both under images/, or a full size thumbnail under thumbnails/ from before thumbnails were
+rendered. For every width in THUMBNAIL_SIZES a copy that fits into a width x width square is stored as
+thumbnails/<width>/<name>. The placeholder is served until it exists"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+from flask import url_for
+from PIL import Image, ImageOps
+from app import app
+from app.storage import current_storage
+
+# Formats without a raster to downscale. Their source is served as is
+VECTOR_EXTENSIONS = ('.svg',)
+PLACEHOLDER = 'placeholder.png'     # Image and thumbnail name of recipes without images, see create_recipe
+_save_options = {'JPEG': {'quality': 85, 'optimize': True}, 'PNG': {'optimize': True}}
+
+
+def sizes() -> List[int]:
+    """Thumbnail widths from THUMBNAIL_SIZES, smallest first"""
+    return sorted(int(size) for size in str(app.config['THUMBNAIL_SIZES']).split(','))
+
+
+def thumbnail_key(name: str, width: int) -> str:
+    return 'thumbnails/{}/{}'.format(width, name)
+
+
+def source_key(name: str) -> Optional[str]:
+    """Storage key of the image a thumbnail is made from, None if it doesn't exist"""
+    storage = current_storage()
+    for key in ('images/' + name, 'thumbnails/' + name):
+        if storage.exists(key):
+            return key
+    return None
+
+
+def render(source: str, directory: str, name: str, widths: List[int]) -> List[str]:
+    """Write downscaled copies of source to directory/<width>/name. Each copy goes to a temporary file that is renamed
+    when complete, so readers never see a partial thumbnail. Runs in worker processes, so only takes plain arguments
+
+    :return: Paths of the written thumbnails"""
+    written = []
+    with Image.open(source) as original:
+        format_ = original.format
+        upright = ImageOps.exif_transpose(original)   # Phone photos are often stored sideways with an EXIF rotation
+        for width in widths:
+            target_directory = os.path.join(directory, str(width))
+            os.makedirs(target_directory, exist_ok=True)
+            thumbnail = upright.copy()
+            thumbnail.thumbnail((width, width), Image.LANCZOS)
+            if format_ == 'JPEG' and thumbnail.mode not in ('RGB', 'L'):
+                thumbnail = thumbnail.convert('RGB')
+            handle, temporary = tempfile.mkstemp(dir=target_directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    thumbnail.save(f, format=format_, **_save_options.get(format_, {}))
+                os.replace(temporary, os.path.join(target_directory, name))
+            except BaseException:
+                os.remove(temporary)
+                raise
+            written.append(os.path.join(target_directory, name))
+    return written
+
+
+def render_stored(source: str, name: str, widths: List[int]):
+    """Render the thumbnails of a stored image in a temporary directory and store them. Runs in worker processes"""
+    storage = current_storage()
+    with storage.fetch(source) as source_file, tempfile.TemporaryDirectory() as directory:
+        for width, path in zip(widths, render(source_file, directory, name, widths)):
+            storage.put(thumbnail_key(name, width), path)
+
+
+def is_placeholder(name: Optional[str]) -> bool:
+    """Whether an image name stands for the static placeholder, which has no stored thumbnails"""
+    return not name or '/' in name or name == PLACEHOLDER  # The constructor default is a path to it
+
+
+@app.template_global()
+def thumbnail_url(name: str, width: Optional[int] = None) -> str:
+    """URL of the thumbnail of an image name, the smallest size by default"""
+    if is_placeholder(name):
+        return url_for('static', filename='images/placeholder.png')
+    return url_for('thumbnail', width=width or sizes()[0], image_name=name)
+
+
+@app.template_global()
+def thumbnail_srcset(name: str) -> str:
+    """srcset attribute with all thumbnail sizes, as pixel densities relative to the smallest"""
+    widths = sizes()
+    return ', '.join('{} {:g}x'.format(thumbnail_url(name, width), width / widths[0]) for width in widths)
+
+
+class ThumbnailQueue(object):
+    """Hands thumbnails to a pool of THUMBNAIL_WORKERS, created on first use so forked web workers each get their own.
+    THUMBNAIL_EXECUTOR selects 'process', 'thread', or 'inline' to render in the calling thread"""
+
+    def __init__(self):
+        self._executor = None
+        self._pending = set()   # Names queued or rendering, so repeated requests don't queue them again
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        kind = app.config['THUMBNAIL_EXECUTOR']
+        if kind == 'inline':
+            return None
+        with self._lock:
+            if self._executor is None:
+                pool = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+                self._executor = pool(max_workers=app.config['THUMBNAIL_WORKERS'])
+            return self._executor
+
+    def _done(self, name: str, future):
+        with self._lock:
+            self._pending.discard(name)
+        if future.exception() is not None:
+            app.logger.warning('Could not create thumbnails of {}: {}'.format(name, future.exception()))
+
+    def submit(self, name: str, source: Optional[str] = None):
+        """Queue the thumbnails of an image
+
+        :param name: File name of the thumbnail, as in Recipe.thumbnail
+        :param source: Storage key of the source image. Looked up with source_key if None"""
+        source = source or source_key(name)
+        if source is None or source.lower().endswith(VECTOR_EXTENSIONS):
+            return
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+        arguments = (source, name, sizes())
+        executor = self._get_executor()
+        if executor is None:
+            try:
+                render_stored(*arguments)
+            except Exception as e:
+                app.logger.warning('Could not create thumbnails of {}: {}'.format(name, e))
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+        else:
+            executor.submit(render_stored, *arguments).add_done_callback(lambda future: self._done(name, future))
+
+    def shutdown(self):
+        """Wait for queued thumbnails and stop the workers"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+thumbnail_queue = ThumbnailQueue()
@@ -0,0 +1 @@
+"""Benchmarks for the recipe list. Run a benchmark with python -m benchmarks.<name> from the project root"""
@@ -0,0 +1,118 @@
+"""Helpers shared by the benchmarks: throwaway databases, synthetic data and timing"""
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, List
+from PIL import Image
+from app import app, db
+from app.models import User, Recipe, RecipeImage, Tag, recipe_tag, skill_levels
+from app.counters import recount
+from app.storage import save_upload, change_references
+
+# Words for recipe names and texts, so text search has realistic matches
+vocabulary = ['tomato', 'basil', 'garlic', 'onion', 'pepper', 'chicken', 'beef', 'tofu', 'rice', 'noodle', 'soup',
+              'salad', 'bread', 'cake', 'pie', 'curry', 'stew', 'roast', 'grilled', 'spicy', 'sweet', 'sour',
+              'lemon', 'butter', 'cheese', 'mushroom', 'potato', 'carrot', 'ginger', 'honey', 'bake', 'simmer',
+              'chop', 'stir', 'fry', 'boil', 'season', 'serve', 'fresh', 'crispy', 'creamy', 'smoky', 'vegan']
+
+
+def words(count: int, filler: float = 0.0) -> str:
+    """Random text of count words. A filler fraction of them are rare made up words, the rest from the vocabulary"""
+    return ' '.join('w{}'.format(random.randrange(50000)) if random.random() < filler else random.choice(vocabulary)
+                    for _ in range(count))
+
+
+def use_database(uri: str = None):
+    """Point the app at a fresh database. Defaults to an SQLite file in a temporary directory.
+    Must be called before anything else touches the database"""
+    if uri is None:
+        uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='recipe_bench_'), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.drop_all()
+    db.create_all()
+    return uri
+
+
+def seed(recipes: int, tags: int = 100, users: int = 10, batch_size: int = 10000):
+    """Insert synthetic users, recipes and tags with executemany batches. Grows an already seeded database
+
+    :param recipes: Number of recipes to add
+    :param tags: Number of tags to create on first call. Every recipe gets up to 3 random tags
+    :param users: Number of users to create on first call. Recipes are distributed evenly among them"""
+    if User.query.count() == 0:
+        db.session.execute(User.__table__.insert(), [
+            {'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'about_me': ''}
+            for i in range(users)])
+        db.session.execute(Tag.__table__.insert(), [{'name': 'tag{}'.format(i)} for i in range(tags)])
+        db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    tag_ids = [row[0] for row in db.session.query(Tag.id)]
+
+    start = (db.session.query(db.func.max(Recipe.id)).scalar() or 0) + 1
+    now = datetime.utcnow()
+    for offset in range(start, start + recipes, batch_size):
+        ids = range(offset, min(offset + batch_size, start + recipes))
+        db.session.execute(Recipe.__table__.insert(), [{
+            'id': i, 'name': '{} {}'.format(words(2), i), 'user_id': user_ids[i % len(user_ids)],
+            'minutes': random.randint(5, 180), 'skill_level': random.choice(skill_levels),
+            'calories': random.randint(100, 2000), 'thumbnail': 'placeholder.png',
+            'description': words(8, filler=0.8), 'body': words(40, filler=0.95),
+            'timestamp': now - timedelta(minutes=i), 'uuid': '{:036d}'.format(i)} for i in ids])
+        db.session.execute(recipe_tag.insert(), [
+            {'recipe_id': i, 'tag_id': t} for i in ids for t in random.sample(tag_ids, min(3, len(tag_ids)))])
+        db.session.commit()
+    recount()   # The inserts bypass the counters
+
+
+def seed_images(images: int, distinct: int = 10) -> List[str]:
+    """Store distinct small PNG images and attach images references to them to random recipes, with executemany.
+    Returns the names of the stored images
+
+    :param images: Number of recipe images to add
+    :param distinct: Number of different images stored. Recipes share them like identical uploads do"""
+    names = []
+    for i in range(distinct):
+        stream = io.BytesIO()
+        Image.new('RGB', (640, 480), (i * 25 % 256, 120, 200)).save(stream, 'PNG')
+        stream.seek(0)
+        names.append(save_upload(stream, 'image{}.png'.format(i)))
+    db.session.commit()
+    max_id = db.session.query(db.func.max(Recipe.id)).scalar() or 0
+    rows = [{'file_name': random.choice(names), 'recipe_id': random.randint(1, max_id)} for _ in range(images)]
+    if rows:
+        db.session.execute(RecipeImage.__table__.insert(), rows)
+        change_references(db.session.connection(), Counter(row['file_name'] for row in rows))  # Bypassed the flush
+    db.session.commit()
+    return names
+
+
+def statistics_of(samples: List[float]) -> dict:
+    """Latency statistics of samples in milliseconds"""
+    samples = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+    return {'mean': statistics.mean(samples), 'p50': percentile(0.5), 'p95': percentile(0.95),
+            'p99': percentile(0.99), 'max': samples[-1]}
+
+
+def timed(function: Callable, repeat: int = 20) -> dict:
+    """Call function repeat times and return latency statistics in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - begin) * 1000)
+        db.session.remove()     # Don't let the identity map serve later calls
+    return statistics_of(samples)
+
+
+def report(label: str, stats: dict):
+    """Print one line of timing statistics"""
+    print('{:<40} mean {mean:9.2f} ms  p50 {p50:9.2f} ms  p95 {p95:9.2f} ms  p99 {p99:9.2f} ms  max {max:9.2f} ms'
+          .format(label, **stats))
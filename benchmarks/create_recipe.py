@@ -0,0 +1,55 @@
+"""Latency of creating a recipe with 1, 10 and 25 uploaded images, by number of upload threads. Every image has new
+content, so each one is written to the storage.
+
+Usage: python -m benchmarks.create_recipe [--images N ...] [--workers N ...] [--size KB] [--requests N]
+                                          [--database URI]"""
+import argparse
+import io
+import os
+import tempfile
+from itertools import count
+from app import app, db
+from app.models import User
+from app.storage import upload_pool
+from benchmarks.common import use_database, seed, timed, report
+
+_names = count()
+
+
+def _create(client, images: int, size: int):
+    """Post a recipe with images of size random bytes each. The storage only hashes and writes them"""
+    response = client.post('/create_recipe', content_type='multipart/form-data', data={
+        'name': 'Benchmark {}'.format(next(_names)), 'skill_level': '0', 'minutes': '5', 'calories': '5',
+        'recipe_images': [(io.BytesIO(os.urandom(size)), 'image{}.png'.format(i)) for i in range(images)]})
+    if response.status_code != 302:
+        raise RuntimeError('Creating a recipe failed with status {}'.format(response.status_code))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, nargs='+', default=[1, 10, 25])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Upload threads to compare')
+    parser.add_argument('--size', type=int, default=500, help='KB per image')
+    parser.add_argument('--requests', type=int, default=20, help='Recipes per configuration')
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app.config.update(WTF_CSRF_ENABLED=False, THUMBNAIL_EXECUTOR='inline', THUMBNAIL_SIZES='150',
+                      VAR_FOLDER=tempfile.mkdtemp(prefix='recipe_bench_var_'))
+    use_database(args.database)
+    seed(1000)
+    db.session.add(User('bench', 'bench@example.com', 'secret'))
+    db.session.commit()
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'secret'})
+    print('--- {} KB images, {} ({})'.format(args.size, app.config['BLOB_STORAGE'], db.engine.dialect.name))
+    for workers in args.workers:
+        upload_pool.shutdown()
+        app.config['UPLOAD_WORKERS'] = workers
+        for images in args.images:
+            report('{} images, {} upload threads'.format(images, workers),
+                   timed(lambda: _create(client, images, args.size * 1024), args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Latency of faceted filtering: a page of matching recipes with the facet counts, for single facets and combinations
+of them, from broad to selective.
+
+Usage: python -m benchmarks.facets [recipes] [--repeat N] [--database URI]"""
+import argparse
+from werkzeug.datastructures import MultiDict
+from app import app, db
+from app.facets import parse_facets, facet_page
+from benchmarks.common import use_database, seed, timed, report
+
+filters = [
+    'match=all',
+    'skill=pro',
+    'tag=tag1',
+    'tag=tag1&tag=tag2',
+    'tag=tag1&tag=tag2&match=any',
+    'min_minutes=20&max_minutes=25',
+    'skill=beginner&skill=pro&min_minutes=30&max_minutes=60&max_calories=500',
+    'tag=tag1&skill=advanced&max_minutes=30',
+    'tag=tag1&tag=tag2&tag=tag3&match=any&min_calories=1500',
+    'max_minutes=5&min_calories=1990',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recipes', nargs='?', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    seed(args.recipes)
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    per_page = int(app.config['MAX_SEARCH_RESULTS'])
+    print('--- {} recipes ({})'.format(args.recipes, db.engine.dialect.name))
+    with app.test_request_context():
+        for query in filters:
+            facets = parse_facets(MultiDict(arg.split('=') for arg in query.split('&')))
+            page, counts = facet_page(facets, per_page)
+            stats = timed(lambda: facet_page(facets, per_page), args.repeat)
+            report(query[:40], stats)
+            print('    {} recipes{}, {} on the first page'.format(counts.total, '' if counts.exact else ' (estimated)',
+                                                                  len(page.items)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Requests per second of anonymous page views: rendered from scratch, rendered from cached fragments, and revalidated
+with If-None-Match, which is answered with 304 before rendering.
+
+Usage: python -m benchmarks.http_cache [recipes] [--requests N] [--database URI]"""
+import argparse
+from app import app, db
+from app.models import Recipe
+from app.search import reindex
+from benchmarks.common import use_database, seed, timed
+
+pages = ['/recipe/{uuid}', '/tag/tag1', '/user/user1', '/search/results/tag/tag1', '/search/results/recipe/tomato']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recipes', nargs='?', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per page and mode')
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    seed(args.recipes)
+    reindex()
+    db.session.commit()
+    uuid = db.session.query(Recipe.uuid).first()[0]
+    print('--- {} recipes ({}), requests per second'.format(args.recipes, db.engine.dialect.name))
+    print('{:<40} {:>12} {:>12} {:>12}'.format('page', 'render', 'fragments', '304'))
+    client = app.test_client()
+    for page in pages:
+        url = page.format(uuid=uuid)
+        rates = []
+        for fragment_cache, revalidate in (('none', False), ('memory', False), ('memory', True)):
+            app.config['FRAGMENT_CACHE'] = fragment_cache
+            headers = {'If-None-Match': client.get(url).headers['ETag']} if revalidate else {}
+            stats = timed(lambda: client.get(url, headers=headers), args.requests)
+            rates.append(1000 / stats['mean'])
+        print('{:<40} {:>12.0f} {:>12.0f} {:>12.0f}'.format(page, *rates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Login throughput by password hashing policy: latency of one login and logins per second with concurrent clients,
+while the hashing pool bounds how many hashes run at once. Also shows how an index page view is slowed down during a
+burst of logins.
+
+Usage: python -m benchmarks.login [--iterations N ...] [--algorithm NAME] [--logins N] [--concurrency N]
+                                  [--workers N] [--database URI]"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db, passwords
+from app.models import User
+from benchmarks.common import use_database, seed, statistics_of, timed, report
+
+USERS = 50
+
+
+def _login(client, i: int) -> float:
+    """Log in user i and out again, returns the milliseconds of the login"""
+    begin = time.perf_counter()
+    response = client.post('/login', data={'username': 'login{}'.format(i % USERS), 'password': 'secret'})
+    elapsed = (time.perf_counter() - begin) * 1000
+    if response.status_code != 302:
+        raise RuntimeError('Login failed with status {}'.format(response.status_code))
+    client.get('/logout')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, nargs='+', default=[50000, 150000, 600000])
+    parser.add_argument('--algorithm', default='sha256')
+    parser.add_argument('--logins', type=int, default=100, help='Logins per policy')
+    parser.add_argument('--concurrency', type=int, default=8, help='Clients logging in at once')
+    parser.add_argument('--workers', type=int, default=app.config['PASSWORD_HASH_WORKERS'],
+                        help='Threads of the hashing pool')
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PASSWORD_HASH_WORKERS'] = args.workers
+    app.config['PASSWORD_HASH_ALGORITHM'] = args.algorithm
+    use_database(args.database)
+    seed(1000)
+    print('--- pbkdf2:{}, {} hashing threads, {} concurrent clients ({})'.format(
+        args.algorithm, args.workers, args.concurrency, db.engine.dialect.name))
+    for iterations in args.iterations:
+        app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        User.query.filter(User.username.like('login%')).delete(synchronize_session=False)
+        password_hash = passwords.hash_password('secret')   # Hashed once, so logins don't rehash
+        db.session.execute(User.__table__.insert(), [
+            {'username': 'login{}'.format(i), 'email': 'login{}@example.com'.format(i), 'about_me': '',
+             'password_hash': password_hash} for i in range(USERS)])
+        db.session.commit()
+        db.session.remove()
+
+        client = app.test_client()
+        report('{} iterations: login'.format(iterations), timed(lambda: _login(client, 0), 10))
+
+        clients = [app.test_client() for _ in range(args.concurrency)]
+        index_latencies = []
+        done = threading.Event()
+
+        def view_index():   # Another request of the same worker, during the burst
+            index_client = app.test_client()
+            while not done.is_set():
+                begin = time.perf_counter()
+                index_client.get('/index')
+                index_latencies.append((time.perf_counter() - begin) * 1000)
+
+        viewer = threading.Thread(target=view_index)
+        viewer.start()
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            latencies = list(executor.map(lambda i: _login(clients[i % args.concurrency], i), range(args.logins)))
+        elapsed = time.perf_counter() - begin
+        done.set()
+        viewer.join()
+        report('{} iterations: concurrent login'.format(iterations), statistics_of(latencies))
+        report('{} iterations: index during logins'.format(iterations), statistics_of(index_latencies))
+        print('{:<40} {:.1f} logins/s'.format('{} iterations: throughput'.format(iterations), args.logins / elapsed))
+
+
+if __name__ == '__main__':
+    main()
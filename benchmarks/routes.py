@@ -0,0 +1,221 @@
+"""Latency, queries per request and throughput of the main routes, on a seeded database of configurable size.
+
+Drives the routes in process with the Flask test client, or over HTTP against a local gunicorn started on the same
+database with --gunicorn. Queries are only counted in process. Requests that fail, i.e. don't answer with 2xx, 3xx or
+304, are reported as errors.
+
+Usage: python -m benchmarks.routes [recipes] [--users N] [--tags N] [--images N] [--requests N] [--login]
+                                   [--database URI] [--gunicorn] [--workers N] [--concurrency N]"""
+import argparse
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Callable, List, Tuple
+from sqlalchemy import event
+from app import app, db
+from app.models import User, Recipe
+from app.search import reindex
+from benchmarks.common import use_database, seed, seed_images, statistics_of, vocabulary
+
+PASSWORD = 'benchmark'
+_csrf_token = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+_names = count()
+
+
+class _TestClient(object):
+    """Sends requests to the app in process and counts the queries of each"""
+
+    def __init__(self):
+        self.client = app.test_client()
+        self.queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.queries += 1
+
+    def get(self, url: str) -> Tuple[int, bytes]:
+        response = self.client.get(url)
+        return response.status_code, response.get_data()
+
+    def post(self, url: str, data: dict) -> Tuple[int, bytes]:
+        response = self.client.post(url, data=data, content_type='multipart/form-data')
+        return response.status_code, response.get_data()
+
+
+class _HttpClient(object):
+    """Sends requests to a server over HTTP, with a connection per thread"""
+
+    def __init__(self, base_url: str):
+        import requests     # Only needed with --gunicorn
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.queries = None
+
+    def get(self, url: str) -> Tuple[int, bytes]:
+        response = self.session.get(self.base_url + url, allow_redirects=False)
+        return response.status_code, response.content
+
+    def post(self, url: str, data: dict) -> Tuple[int, bytes]:
+        files = {key: value for key, value in data.items() if isinstance(value, tuple)}
+        fields = {key: value for key, value in data.items() if not isinstance(value, tuple)}
+        response = self.session.post(self.base_url + url, data=fields, files=files, allow_redirects=False)
+        return response.status_code, response.content
+
+
+def _token(client, url: str) -> str:
+    """The CSRF token of the form on the page at url"""
+    return _csrf_token.search(client.get(url)[1].decode()).group(1)
+
+
+def _login(client):
+    status, _ = client.post('/login', {'username': 'bench', 'password': PASSWORD,
+                                       'csrf_token': _token(client, '/login')})
+    if status != 302:
+        sys.exit('Logging in failed with status {}'.format(status))
+
+
+def _png() -> bytes:
+    from PIL import Image
+    stream = io.BytesIO()
+    Image.new('RGB', (640, 480), (random.randrange(256), 80, 160)).save(stream, 'PNG')
+    return stream.getvalue()
+
+
+def _create_recipe(client) -> Tuple[int, bytes]:
+    """Post a new recipe with a unique name and an image. The form is fetched first, for its CSRF token"""
+    token = _token(client, '/create_recipe')
+    image = (io.BytesIO(_png()), 'image.png') if isinstance(client, _TestClient) else ('image.png', _png())
+    return client.post('/create_recipe', {
+        'csrf_token': token, 'name': 'Benchmark {} {}'.format(random.choice(vocabulary), next(_names)),
+        'minutes': '30', 'skill_level': '1', 'calories': '500', 'description': 'Benchmark recipe',
+        'body': 'Stir well', 'recipe_images': image})
+
+
+def _routes(uuids: List[str], users: int, tags: int, images: List[str]) -> List[Tuple[str, Callable]]:
+    """Route names and functions sending a request to them with random arguments"""
+    def get(pattern: str, *choices: Callable) -> Callable:
+        return lambda client: client.get(pattern.format(*(choice() for choice in choices)))
+    return [
+        ('index', get('/index')),
+        ('recipe', get('/recipe/{}', lambda: random.choice(uuids))),
+        ('search_results recipe', get('/search/results/recipe/{}', lambda: random.choice(vocabulary))),
+        ('search_results tag', get('/search/results/tag/tag{}', lambda: random.randrange(tags))),
+        ('tag', get('/tag/tag{}', lambda: random.randrange(tags))),
+        ('user', get('/user/user{}', lambda: random.randrange(users))),
+        ('image', get('/image/images/{}', lambda: random.choice(images))),
+        ('create_recipe (form and post)', _create_recipe),    # Last, it needs a login
+    ]
+
+
+def _run(clients: list, send: Callable, requests: int) -> Tuple[List[float], int, int, float]:
+    """Send requests from every client concurrently. Returns the latencies in milliseconds, the number of errors, the
+    number of queries and the elapsed seconds"""
+    def one(client) -> Tuple[float, bool]:
+        begin = time.perf_counter()
+        status, _ = send(client)
+        return (time.perf_counter() - begin) * 1000, status >= 400
+
+    queries = clients[0].queries
+    begin = time.perf_counter()
+    if len(clients) == 1:
+        results = [one(clients[0]) for _ in range(requests)]
+    else:
+        with ThreadPoolExecutor(len(clients)) as executor:
+            results = list(executor.map(lambda i: one(clients[i % len(clients)]), range(requests)))
+    elapsed = time.perf_counter() - begin
+    return [r[0] for r in results], sum(r[1] for r in results), \
+        clients[0].queries - queries if queries is not None else None, elapsed
+
+
+def _report(label: str, send: Callable, clients: list, requests: int):
+    """Send requests and print one line of statistics"""
+    latencies, errors, queries, elapsed = _run(clients, send, requests)
+    print('{:<36} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {mean:>9.2f} {:>9.0f} {:>8} {:>7}'.format(
+        label, requests / elapsed, '-' if queries is None else '{:.1f}'.format(queries / requests), errors,
+        **statistics_of(latencies)))
+
+
+def _start_gunicorn(uri: str, workers: int, port: int) -> subprocess.Popen:
+    """Start gunicorn serving the app on the benchmark database and wait until it answers"""
+    import requests
+    environment = dict(os.environ, DATABASE_URL=uri, VAR_FOLDER=app.config['VAR_FOLDER'],
+                       SECRET_KEY=app.config['SECRET_KEY'])
+    try:
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'recipelist:app', '-b',
+                                   '127.0.0.1:{}'.format(port), '-w', str(workers), '--log-level', 'warning'],
+                                  env=environment, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except OSError as e:
+        sys.exit('Could not start gunicorn: {}'.format(e))
+    for _ in range(100):
+        if server.poll() is not None:
+            sys.exit('gunicorn exited with {}. Is it installed?'.format(server.returncode))
+        try:
+            requests.get('http://127.0.0.1:{}/index'.format(port))
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    sys.exit('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recipes', nargs='?', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--images', type=int, default=1000, help='Recipe images, sharing 10 stored files')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route')
+    parser.add_argument('--login', action='store_true', help='Send the GET requests logged in, too')
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    parser.add_argument('--gunicorn', action='store_true', help='Send requests over HTTP to a local gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients with --gunicorn')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    app.config['VAR_FOLDER'] = tempfile.mkdtemp(prefix='recipe_bench_var_')  # Uploads don't land in the app folder
+    uri = use_database(args.database)
+    seed(args.recipes, args.tags, args.users)
+    images = seed_images(args.images)
+    db.session.add(User('bench', 'bench@example.com', PASSWORD))
+    reindex()
+    db.session.commit()
+    uuids = [uuid for uuid, in db.session.query(Recipe.uuid).limit(10000)]
+    db.session.remove()
+
+    server = None
+    if args.gunicorn:
+        server = _start_gunicorn(uri, args.workers, args.port)
+        clients = [_HttpClient('http://127.0.0.1:{}'.format(args.port)) for _ in range(args.concurrency)]
+    else:
+        clients = [_TestClient()]
+    try:
+        print('--- {} recipes, {} users, {} tags, {} images ({}, {})'.format(
+            args.recipes, args.users, args.tags, args.images, db.engine.dialect.name,
+            'gunicorn, {} workers, {} clients'.format(args.workers, args.concurrency) if server else 'test client'))
+        print('{:<36} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7}'.format(
+            'route', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms', 'req/s', 'queries', 'errors'))
+        routes = _routes(uuids, args.users, args.tags, images)
+        for label, send in routes[:-1]:
+            _report(label, send, clients, args.requests)
+        for client in clients:
+            _login(client)
+        if args.login:
+            for label, send in routes[:-1]:
+                _report(label + ' (logged in)', send, clients, args.requests)
+        _report(*routes[-1], clients=clients, requests=args.requests)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
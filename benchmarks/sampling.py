@@ -0,0 +1,42 @@
+"""Compare random recipe sampling against loading the whole table as the recipe table grows.
+
+Usage: python -m benchmarks.sampling [sizes...] [--database URI] [--skip-full-load-above N]"""
+import argparse
+import random
+from app import app, db
+from app.models import Recipe
+from app.sampling import random_rows, samplers
+from benchmarks.common import use_database, seed, timed, report
+
+
+def _full_load_sample():
+    """What the index view used to do"""
+    return random.sample(Recipe.query.all(), 9) if Recipe.query.count() >= 9 else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    parser.add_argument('--skip-full-load-above', type=int, default=200000,
+                        help='Do not time loading the full table above this many recipes')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed(size - seeded)
+        seeded = size
+        print('--- {} recipes ({})'.format(size, db.engine.dialect.name))
+        for name, sampler in samplers.items():
+            if name == 'tablesample' and db.engine.dialect.name != 'postgresql':
+                continue
+            report('sampler {}'.format(name), timed(lambda: sampler(Recipe, 9)))
+        report('random_rows (RANDOM_SAMPLER={})'.format(app.config['RANDOM_SAMPLER']),
+               timed(lambda: random_rows(Recipe, 9)))
+        if size <= args.skip_full_load_above:
+            report('full table load', timed(_full_load_sample, repeat=5))
+
+
+if __name__ == '__main__':
+    main()
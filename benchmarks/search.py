@@ -0,0 +1,40 @@
+"""Compare the full-text search backends against scanning recipe names with LIKE '%term%'.
+
+Usage: python -m benchmarks.search [sizes...] [--database URI]"""
+import argparse
+import time
+from app import app, db
+from app.search import search_recipes, reindex, current_backend, backends
+from benchmarks.common import use_database, seed, timed, report
+
+terms = ['tomato', 'spicy chicken', 'cre', 'mushroom soup', 'w4242', 'does-not-exist']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000, 300000])
+    parser.add_argument('--database', help='Database URI. Defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed(size - seeded)     # Bulk inserts bypass the ORM, so the index has to be rebuilt
+        seeded = size
+        reindex()
+        db.session.commit()
+        limit = int(app.config['MAX_SEARCH_RESULTS'])
+        print('--- {} recipes ({})'.format(size, db.engine.dialect.name))
+        for backend in (current_backend().name, 'memory', 'like'):
+            app.config['SEARCH_BACKEND'] = backend
+            if backend == 'memory':
+                begin = time.perf_counter()
+                backends['memory'].rebuild(db.session.connection())
+                print('memory index built in {:.2f} s'.format(time.perf_counter() - begin))
+            for term in terms:
+                report('{} "{}"'.format(backend, term), timed(lambda: search_recipes(term, limit)))
+            app.config['SEARCH_BACKEND'] = 'auto'
+
+
+if __name__ == '__main__':
+    main()
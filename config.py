@@ -16,6 +16,37 @@ _defaults = {
     'VAR_FOLDER': os.path.join(basedir, 'app', 'var'),
     'SEND_FILE_MAX_AGE_DEFAULT': 0,
     'MAX_SEARCH_RESULTS': 50,
+    'RECIPES_PER_PAGE': 30,
+    'RANDOM_SAMPLER': 'auto',
+    'FEATURED_REFRESH_SECONDS': 300,
+    'FEATURED_POOL_SIZE': 60,
+    'SEARCH_BACKEND': 'auto',
+    'SEARCH_INDEX_CHECK_SECONDS': 30,
+    'IMPORT_BATCH_SIZE': 1000,
+    'EXPORT_BATCH_SIZE': 1000,
+    'THUMBNAIL_SIZES': '150,300',
+    'THUMBNAIL_EXECUTOR': 'process',
+    'THUMBNAIL_WORKERS': 2,
+    'USE_X_SENDFILE': False,
+    'BLOB_STORAGE': 'local',
+    'UPLOAD_WORKERS': 4,
+    'S3_BUCKET': '',
+    'S3_PREFIX': '',
+    'S3_ENDPOINT_URL': '',
+    'S3_PUBLIC_URL': '',
+    'GC_INTERVAL_SECONDS': 0,
+    'GC_GRACE_SECONDS': 24 * 3600,
+    'FRAGMENT_CACHE': 'memory',
+    'FRAGMENT_CACHE_SIZE': 5000,
+    'ANONYMOUS_MAX_AGE': 60,
+    'FACET_SAMPLE_SIZE': 1000,
+    'IMAGE_ACCEL_REDIRECT_PREFIX': '',
+    'METRICS': False,
+    'USER_CACHE_SECONDS': 30,
+    'PASSWORD_HASH_ALGORITHM': 'sha256',
+    'PASSWORD_HASH_ITERATIONS': 150000,
+    'PASSWORD_HASH_WORKERS': 2,
+    'SLOW_QUERY_SECONDS': 0.5,
     'LOG_TO_STDOUT': False
 }
 
@@ -26,6 +57,14 @@ def _warn_default(variable_name: str):
     return _defaults[variable_name]
 
 
+def _flag(variable_name: str) -> bool:
+    """Get a switch from an environment variable. Only '1', 'true', 'yes' and 'on' turn it on, in any case"""
+    value = os.environ.get(variable_name)
+    if not value:
+        return _defaults[variable_name]
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or _warn_default('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or _warn_default('SQLALCHEMY_DATABASE_URI')
@@ -35,5 +74,66 @@ class Config(object):
     VAR_FOLDER = os.environ.get('VAR_FOLDER') or _defaults['VAR_FOLDER']
     SEND_FILE_MAX_AGE_DEFAULT = os.environ.get('SEND_FILE_MAX_AGE_DEFAULT') or _warn_default(
         'SEND_FILE_MAX_AGE_DEFAULT')
-    MAX_SEARCH_RESULTS = os.environ.get('MAX_SEARCH_RESULTS') or _defaults['MAX_SEARCH_RESULTS']
+    MAX_SEARCH_RESULTS = os.environ.get('MAX_SEARCH_RESULTS') or _defaults['MAX_SEARCH_RESULTS']  # Per page
+    RECIPES_PER_PAGE = int(os.environ.get('RECIPES_PER_PAGE') or _defaults['RECIPES_PER_PAGE'])  # On user pages
+    # 'auto' picks a sampler for the database dialect. Others: 'id_range', 'tablesample', 'order_by_random'
+    RANDOM_SAMPLER = os.environ.get('RANDOM_SAMPLER') or _defaults['RANDOM_SAMPLER']
+    # How often each worker reloads the pool of recipes and tags the index page picks its favorites from
+    FEATURED_REFRESH_SECONDS = int(os.environ.get('FEATURED_REFRESH_SECONDS') or _defaults['FEATURED_REFRESH_SECONDS'])
+    FEATURED_POOL_SIZE = int(os.environ.get('FEATURED_POOL_SIZE') or _defaults['FEATURED_POOL_SIZE'])
+    # 'auto' picks the full-text search backend for the database dialect. Others: 'fts5', 'tsvector', 'like' and
+    # 'memory' for an in-process index where the database has no full-text support
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or _defaults['SEARCH_BACKEND']
+    # How often the 'memory' search backend checks for recipes changed by other workers and rebuilds its index. 0 only
+    # if a single worker writes recipes
+    SEARCH_INDEX_CHECK_SECONDS = int(os.environ.get('SEARCH_INDEX_CHECK_SECONDS') or
+                                     _defaults['SEARCH_INDEX_CHECK_SECONDS'])
+    # Recipes per transaction of flask recipes import
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or _defaults['IMPORT_BATCH_SIZE'])
+    # Recipes fetched at a time by flask recipes export and the export view
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE') or _defaults['EXPORT_BATCH_SIZE'])
+    # Comma separated widths of generated thumbnails. The first one is shown on listings, the others on HiDPI screens
+    THUMBNAIL_SIZES = os.environ.get('THUMBNAIL_SIZES') or _defaults['THUMBNAIL_SIZES']
+    # Where thumbnails are rendered: 'process' or 'thread' pool of THUMBNAIL_WORKERS, or 'inline' in the request
+    THUMBNAIL_EXECUTOR = os.environ.get('THUMBNAIL_EXECUTOR') or _defaults['THUMBNAIL_EXECUTOR']
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or _defaults['THUMBNAIL_WORKERS'])
+    # Where uploads are stored: 'local' in VAR_FOLDER or 's3' in S3_BUCKET under S3_PREFIX. S3_ENDPOINT_URL is for other
+    # S3 compatible stores, S3_PUBLIC_URL to redirect image requests to the bucket or a CDN instead of proxying them
+    BLOB_STORAGE = os.environ.get('BLOB_STORAGE') or _defaults['BLOB_STORAGE']
+    S3_BUCKET = os.environ.get('S3_BUCKET') or _defaults['S3_BUCKET']
+    S3_PREFIX = os.environ.get('S3_PREFIX') or _defaults['S3_PREFIX']
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or _defaults['S3_ENDPOINT_URL']
+    S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL') or _defaults['S3_PUBLIC_URL']
+    # Threads per worker process that store the files of one upload form concurrently
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS') or _defaults['UPLOAD_WORKERS'])
+    # Stored files no recipe uses are removed once they are GC_GRACE_SECONDS old, by flask recipes gc or every
+    # GC_INTERVAL_SECONDS in the web workers. 0 disables the background collection
+    GC_INTERVAL_SECONDS = int(os.environ.get('GC_INTERVAL_SECONDS') or _defaults['GC_INTERVAL_SECONDS'])
+    GC_GRACE_SECONDS = int(os.environ.get('GC_GRACE_SECONDS') or _defaults['GC_GRACE_SECONDS'])
+    # Rendered recipe cards and pages: 'memory' for FRAGMENT_CACHE_SIZE recipes per worker, 'filesystem' for a cache
+    # under VAR_FOLDER that all workers share, or 'none'
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE') or _defaults['FRAGMENT_CACHE']
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or _defaults['FRAGMENT_CACHE_SIZE'])
+    # Seconds browsers and reverse proxies may reuse pages of anonymous visitors without revalidating. See app.http_cache
+    ANONYMOUS_MAX_AGE = int(os.environ.get('ANONYMOUS_MAX_AGE') or _defaults['ANONYMOUS_MAX_AGE'])
+    # Filters matching at most FACET_SAMPLE_SIZE recipes get exact facet counts, broader ones counts estimated from a
+    # sample of that size. See app.facets
+    FACET_SAMPLE_SIZE = int(os.environ.get('FACET_SAMPLE_SIZE') or _defaults['FACET_SAMPLE_SIZE'])
+    # Let the web server send files: X-Sendfile for Apache and lighttpd, or X-Accel-Redirect to an nginx internal
+    # location aliasing VAR_FOLDER, e.g. '/_var/' for: location /_var/ { internal; alias /path/to/app/var/; }
+    USE_X_SENDFILE = _flag('USE_X_SENDFILE')
+    IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('IMAGE_ACCEL_REDIRECT_PREFIX') or \
+        _defaults['IMAGE_ACCEL_REDIRECT_PREFIX']
+    # Passwords are hashed with PBKDF2 using this hashlib algorithm and number of iterations, in a pool of
+    # PASSWORD_HASH_WORKERS threads. Logins rehash passwords of other policies. See app.passwords
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM') or _defaults['PASSWORD_HASH_ALGORITHM']
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS') or _defaults['PASSWORD_HASH_ITERATIONS'])
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or _defaults['PASSWORD_HASH_WORKERS'])
+    # How long a worker reuses the logged in user it loaded for a session, 0 to load it on every request. See
+    # app.identity
+    USER_CACHE_SECONDS = int(os.environ.get('USER_CACHE_SECONDS') or _defaults['USER_CACHE_SECONDS'])
+    # Record the time and queries of every request, for Server-Timing headers and /metrics. See app.metrics
+    METRICS = _flag('METRICS')
+    # Queries taking at least this long are logged with their view. 0 disables the log
+    SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS') or _defaults['SLOW_QUERY_SECONDS'])
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT') or _defaults['LOG_TO_STDOUT']     # Required for heroku logging
@@ -0,0 +1,49 @@
+"""recipe search index
+
+Revision ID: 3f1c2a9d7b54
+Revises: ac93d3477e86
+Create Date: 2026-10-18 10:12:41.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b54'
+down_revision = 'ac93d3477e86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Indexing a recipe looks up its tags
+    op.create_index('ix_recipe_tag_recipe_id', 'recipe_tag', ['recipe_id', 'tag_id'], unique=False)
+
+    # Full-text index tables aren't models, they are maintained by app/search.py
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE recipe_fts USING fts5(name, description, body, tags, prefix='2 3')")
+        op.execute("INSERT INTO recipe_fts (rowid, name, description, body, tags) "
+                   "SELECT recipe.id, recipe.name, recipe.description, recipe.body, "
+                   "(SELECT group_concat(tag.name, ' ') FROM recipe_tag JOIN tag ON tag.id = recipe_tag.tag_id "
+                   "WHERE recipe_tag.recipe_id = recipe.id) FROM recipe")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("CREATE TABLE recipe_search (recipe_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)")
+        op.execute("CREATE INDEX ix_recipe_search_document ON recipe_search USING GIN (document)")
+        op.execute("INSERT INTO recipe_search (recipe_id, document) SELECT recipe.id, "
+                   "setweight(to_tsvector('simple', coalesce(recipe.name, '')), 'A') || "
+                   "setweight(to_tsvector('simple', coalesce((SELECT string_agg(tag.name, ' ') FROM recipe_tag "
+                   "JOIN tag ON tag.id = recipe_tag.tag_id WHERE recipe_tag.recipe_id = recipe.id), '')), 'B') || "
+                   "setweight(to_tsvector('simple', coalesce(recipe.description, '')), 'C') || "
+                   "setweight(to_tsvector('simple', coalesce(recipe.body, '')), 'D') FROM recipe")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS recipe_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP TABLE IF EXISTS recipe_search")
+
+    op.drop_index('ix_recipe_tag_recipe_id', table_name='recipe_tag')
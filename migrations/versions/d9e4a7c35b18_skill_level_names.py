@@ -0,0 +1,29 @@
+"""skill level names
+
+Revision ID: d9e4a7c35b18
+Revises: c6b2e8d41f07
+Create Date: 2026-10-19 11:05:27.118430
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9e4a7c35b18'
+down_revision = 'c6b2e8d41f07'
+branch_labels = None
+depends_on = None
+
+# The edit form stored the index of the skill level instead of its name
+skill_levels = ['beginner', 'intermediate', 'advanced', 'pro']
+
+
+def upgrade():
+    recipe = sa.table('recipe', sa.column('skill_level', sa.String(10)))
+    for index, name in enumerate(skill_levels):
+        op.execute(recipe.update().where(recipe.c.skill_level == str(index)).values(skill_level=name))
+
+
+def downgrade():
+    pass    # The names are what the app expects, the indexes were never meant to be stored
@@ -1,9 +1,72 @@
 """This file defines the flask application instance"""
+import sys
+import click
+from flask.cli import AppGroup
 from app import app, db
 from app.models import User, Recipe, RecipeImage, Tag
+from app.bulk import import_recipes, read_records, open_text, file_format, export_records, format_records, \
+    encode_lines
+from app.garbage import collect_garbage
+from app.counters import recount
 
 
 @app.shell_context_processor
 def make_shell_context():
     """flask shell (the terminal command) registers the contents returned by this function when run"""
     return {'db': db, 'User': User, 'Recipe': Recipe, 'RecipeImage': RecipeImage, 'Tag': Tag}
+
+
+recipes_cli = AppGroup('recipes', help='Bulk operations on recipes')
+
+
+@recipes_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_', type=click.Choice(['jsonl', 'csv']), help='Default: from the file name')
+@click.option('--batch-size', type=int, help='Recipes per transaction. Default: IMPORT_BATCH_SIZE')
+@click.option('--author', help='Username for records without an author')
+def import_command(path, format_, batch_size, author):
+    """Import recipes from a JSON Lines or CSV file, optionally gzip compressed"""
+    with open_text(path) as stream:
+        stats = import_recipes(read_records(stream, format_ or file_format(path)),
+                               batch_size or app.config['IMPORT_BATCH_SIZE'], author,
+                               progress=lambda s: click.echo('{} imported ({:.0f}/s)'.format(s.imported, s.rate)))
+    click.echo(str(stats))
+
+
+@recipes_cli.command('export')
+@click.argument('path', default='-')
+@click.option('--format', 'format_', type=click.Choice(['jsonl', 'csv']), help='Default: from the file name')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress. Default: if the file name ends with .gz')
+def export_command(path, format_, compress):
+    """Export all recipes with their tags and images to a JSON Lines or CSV file, or to stdout if PATH is -"""
+    lines = format_records(export_records(app.config['EXPORT_BATCH_SIZE']), format_ or file_format(path))
+    compress = compress or path.endswith('.gz')
+    output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    try:
+        for chunk in encode_lines(lines, compress):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+@recipes_cli.command('gc')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed')
+@click.option('--grace', type=int, help='Minimum age in seconds of removed files. Default: GC_GRACE_SECONDS')
+@click.option('--batch-size', type=int, default=1000, help='Files checked per query')
+def gc_command(dry_run, grace, batch_size):
+    """Remove stored images and thumbnails that no recipe uses anymore"""
+    grace = app.config['GC_GRACE_SECONDS'] if grace is None else grace
+    click.echo(str(collect_garbage(grace, dry_run, batch_size)))
+
+
+@recipes_cli.command('recount')
+@click.option('--dry-run', is_flag=True, help='Only report the counts that drifted')
+def recount_command(dry_run):
+    """Recount the recipes of every tag and user and the totals, and correct counts that drifted"""
+    drift = recount(dry_run)
+    click.echo('{} {} tag counts, {} user counts and {} totals'.format(
+        'Would correct' if dry_run else 'Corrected', drift.tags, drift.users, drift.totals))
+
+
+app.cli.add_command(recipes_cli)
@@ -0,0 +1,32 @@
+"""Shared helpers for the test cases"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+
+class QueryCounter(object):
+    """Context manager recording the SQL statements executed on db.engine while it's active"""
+
+    def __init__(self):
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@contextmanager
+def query_budget(test_case, budget: int):
+    """Fail test_case if the code in the with block executes more than budget SQL statements"""
+    with QueryCounter() as counter:
+        yield counter
+    test_case.assertLessEqual(len(counter), budget, 'Query budget exceeded:\n' + '\n'.join(counter.statements))
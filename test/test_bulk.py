@@ -0,0 +1,113 @@
+import gzip
+import io
+import json
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag, skill_levels
+from app.bulk import import_recipes, read_records, export_records, format_records, encode_lines
+from app.search import search_recipes
+from test import QueryCounter
+
+
+def _jsonl(records):
+    return io.StringIO(''.join(json.dumps(r) + '\n' for r in records))
+
+
+class ImportCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.add(Tag('soups'))
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+
+    def test_jsonl(self):
+        records = [{'name': 'Soup {}'.format(i), 'author': 'bob', 'body': 'Boil it', 'minutes': '20',
+                    'tags': ['soups', 'tag{}'.format(i % 3)], 'images': ['soup{}.png'.format(i)]} for i in range(10)]
+        stats = import_recipes(read_records(_jsonl(records), 'jsonl'), batch_size=4)
+        self.assertEqual((stats.imported, stats.skipped, stats.tags_created), (10, 0, 3))
+        recipe = Recipe.query.filter_by(name='Soup 4').one()
+        self.assertEqual(recipe.author, self.testUser)
+        self.assertEqual(recipe.minutes, 20)
+        self.assertEqual(sorted(t.name for t in recipe.tags), ['soups', 'tag1'])
+        self.assertEqual([i.file_name for i in recipe.images], ['soup4.png'])
+        self.assertEqual(len(search_recipes('soup', 20)), 10)
+
+    def test_csv(self):
+        stream = io.StringIO('name,description,tags,images\nBread,Crusty,baking|breakfast,\nToast,,breakfast,\n')
+        stats = import_recipes(read_records(stream, 'csv'), default_author='bob')
+        self.assertEqual(stats.imported, 2)
+        self.assertEqual(Tag.query.filter_by(name='breakfast').one().recipes.count(), 2)
+
+    def test_skips(self):
+        db.session.add(Recipe('Bread', self.testUser.id))
+        db.session.commit()
+        records = [{'name': 'Bread', 'author': 'bob'}, {'name': 'Toast', 'author': 'bob'},
+                   {'name': 'Toast', 'author': 'bob'}, {'name': 'Cake', 'author': 'alice'}, {'author': 'bob'},
+                   {'name': 'Pie', 'author': 'bob', 'timestamp': 'yesterday'},
+                   {'name': 'Tart', 'author': 'bob', 'timestamp': 1600000000}]
+        stats = import_recipes(records)
+        self.assertEqual((stats.imported, stats.skipped), (1, 6))
+        self.assertEqual(Recipe.query.count(), 2)
+
+    def test_statements_per_batch(self):
+        def statements(count):
+            records = [{'name': 'Cake {} {}'.format(count, i), 'author': 'bob', 'tags': ['cake'],
+                        'images': ['cake.png']} for i in range(count)]
+            with QueryCounter() as counter:
+                import_recipes(records, batch_size=count)
+            return len(counter)
+        statements(1)   # Resolve the author and create the tag
+        self.assertEqual(statements(5), statements(50))
+
+
+class ExportCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+        self.user_id = self.testUser.id
+        self.records = [{'name': 'Soup {}'.format(i), 'author': 'bob', 'description': 'Hot, "red"', 'body': 'Boil',
+                         'minutes': i, 'skill_level': skill_levels[1], 'calories': 100, 'thumbnail': 'placeholder.png',
+                         'timestamp': '2020-01-01T12:00:0{}'.format(i), 'uuid': 'uuid-{}'.format(i),
+                         'tags': ['soups', 'tag{}'.format(i)], 'images': ['soup{}.png'.format(i)]} for i in range(5)]
+        import_recipes(self.records)
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+
+    def test_round_trip(self):
+        self.assertEqual(list(export_records(batch_size=2)), self.records)
+        for format_ in ('jsonl', 'csv'):
+            data = b''.join(encode_lines(format_records(export_records(), format_), compress=True, lines_per_chunk=2))
+            stream = io.StringIO(gzip.decompress(data).decode(), newline='')
+            self.assertEqual([(r['name'], r['tags'], r['images']) for r in read_records(stream, format_)],
+                             [(r['name'], r['tags'], r['images']) for r in self.records])
+
+    def test_statements_per_batch(self):
+        with QueryCounter() as counter:
+            list(export_records(batch_size=2))
+        self.assertEqual(len(counter), 1 + 2 * 3)     # Recipes, then tags and images for each of 3 batches
+
+    def test_view(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get('/export').status_code, 302)
+            with client.session_transaction() as session:
+                session['_user_id'] = str(self.user_id)
+            response = client.get('/export?format=csv&gzip=1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/gzip')
+            self.assertIn('recipes.csv.gz', response.headers['Content-Disposition'])
+            self.assertEqual(gzip.decompress(response.data).decode().count('Soup'), 5)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
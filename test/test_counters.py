@@ -0,0 +1,79 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+from app.bulk import import_recipes
+from app.counters import recount, totals
+
+
+class CounterCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.bob, self.alice = User('bob', 'bobsmail@gmail.com'), User('alice', 'alicesmail@gmail.com')
+        self.soup, self.hot = Tag('soup'), Tag('hot')
+        db.session.add_all([self.bob, self.alice, self.soup, self.hot])
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+
+    def add(self, name: str, author: User, *tags: Tag) -> Recipe:
+        recipe = Recipe(name, author.id)
+        for tag in tags:
+            recipe.tags.append(tag)
+        db.session.add(recipe)
+        db.session.commit()
+        return recipe
+
+    def counts(self):
+        db.session.expire_all()
+        return (self.soup.recipe_count, self.hot.recipe_count, self.bob.recipe_count, self.alice.recipe_count,
+                totals())
+
+    def test_create_and_delete(self):
+        self.add('Soup', self.bob, self.soup, self.hot)
+        recipe = self.add('Stew', self.alice, self.hot)
+        self.assertEqual(self.counts(), (1, 2, 1, 1, {'recipes': 2, 'tags': 2, 'users': 2}))
+        db.session.delete(recipe)
+        db.session.commit()
+        self.assertEqual(self.counts(), (1, 1, 1, 0, {'recipes': 1, 'tags': 2, 'users': 2}))
+
+    def test_add_and_remove_tag(self):
+        recipe = self.add('Soup', self.bob, self.soup)
+        recipe.add_tag(self.hot)
+        recipe.add_tag(Tag('starter'))
+        db.session.commit()
+        self.assertEqual(self.counts()[:2], (1, 1))
+        self.assertEqual(Tag.query.filter_by(name='starter').first().recipe_count, 1)
+        recipe.remove_tag(self.soup)
+        db.session.commit()
+        self.assertEqual(self.counts()[:2], (0, 1))
+        self.assertEqual(totals()['tags'], 3)
+
+    def test_change_author(self):
+        recipe = self.add('Soup', self.bob)
+        db.session.expire_all()
+        recipe.user_id = self.alice.id
+        db.session.commit()
+        self.assertEqual(self.counts()[2:4], (0, 1))
+
+    def test_import(self):
+        import_recipes([{'name': 'Soup', 'author': 'bob', 'tags': ['soup', 'cold']},
+                        {'name': 'Stew', 'author': 'alice', 'tags': ['soup']}])
+        self.assertEqual(self.counts(), (2, 0, 1, 1, {'recipes': 2, 'tags': 3, 'users': 2}))
+        self.assertEqual(recount(dry_run=True), (0, 0, 0))
+
+    def test_recount(self):
+        self.add('Soup', self.bob, self.soup)
+        db.session.execute(Tag.__table__.update().values(recipe_count=5))
+        db.session.execute(User.__table__.update().values(recipe_count=0))
+        db.session.commit()
+        self.assertEqual(recount(dry_run=True), (2, 1, 0))
+        self.assertEqual(self.counts()[0], 5)
+        self.assertEqual(recount(), (2, 1, 0))
+        self.assertEqual(self.counts(), (1, 0, 1, 0, {'recipes': 1, 'tags': 2, 'users': 2}))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
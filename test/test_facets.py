@@ -0,0 +1,123 @@
+import unittest
+from itertools import product
+from werkzeug.datastructures import MultiDict
+from app import db, app
+from app.models import User, Recipe, Tag, skill_levels
+from app.facets import parse_facets, facet_page, Facets
+
+
+class FacetCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        user = User('bob', 'bobsmail@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+        self.tags = {name: Tag(name) for name in ('soup', 'hot', 'quick')}
+        for i in range(60):
+            recipe = Recipe('Recipe {}'.format(i), user.id, minutes=(i * 7) % 90, skill_level=skill_levels[i % 4],
+                            calories=(i * 113) % 1200)
+            for n, tag in enumerate(self.tags.values()):
+                if i % (n + 2) == 0:
+                    recipe.tags.append(tag)
+            db.session.add(recipe)
+        db.session.commit()
+        self.sample_size = app.config['FACET_SAMPLE_SIZE']
+
+    def tearDown(self) -> None:
+        app.config['FACET_SAMPLE_SIZE'] = self.sample_size
+        db.session.remove()
+        db.drop_all()
+
+    @staticmethod
+    def matches(recipe: Recipe, names: set, facets: Facets) -> bool:
+        in_range = [low is None or value >= low for value, (low, _) in
+                    ((recipe.minutes, facets.minutes), (recipe.calories, facets.calories))] + \
+                   [high is None or value <= high for value, (_, high) in
+                    ((recipe.minutes, facets.minutes), (recipe.calories, facets.calories))]
+        tagged = not facets.tags or (set(facets.tags) <= names if facets.match_all else set(facets.tags) & names)
+        return all(in_range) and bool(tagged) and (not facets.skill_levels or recipe.skill_level in facets.skill_levels)
+
+    def all_pages(self, facets: Facets):
+        pages, counts, after = [], None, None
+        while True:
+            page, counts = facet_page(facets, 7, after)
+            pages.extend(r.id for r in page.items)
+            if page.next_cursor is None:
+                return pages, counts
+            after = page.next_cursor
+
+    def test_matches_brute_force(self):
+        recipes = [(r, {t.name for t in r.tags}) for r in
+                   sorted(Recipe.query.all(), key=lambda r: (r.timestamp, r.id), reverse=True)]
+        combinations = list(product(([], ['soup'], ['soup', 'hot'], ['hot', 'quick', 'missing']), (True, False),
+                               ([], ['beginner', 'pro']), ((None, None), (10, 40)), ((None, None), (None, 500))))
+        for sample_size in (10000, 5):    # Exact counts, and counts estimated from a small sample
+            app.config['FACET_SAMPLE_SIZE'] = sample_size
+            for tags, match_all, levels, minutes, calories in combinations:
+                facets = Facets(tags, match_all, levels, minutes, calories)
+                expected = [r.id for r, names in recipes if self.matches(r, names, facets)]
+                ids, counts = self.all_pages(facets)
+                self.assertEqual(ids, expected, facets)
+                if counts.exact:
+                    self.assertEqual(counts.total, len(expected), facets)
+                    self.assertEqual(sum(c for _, c in counts.skill_levels), len(expected), facets)
+                    self.assertEqual(sum(c for _, c in counts.minutes), len(expected), facets)
+
+    def test_exact_counts(self):
+        _, counts = facet_page(Facets(['soup'], True, [], (None, None), (None, None)), 10)
+        self.assertTrue(counts.exact)
+        self.assertEqual(counts.total, 30)
+        self.assertEqual(counts.skill_levels, [('beginner', 15), ('intermediate', 0), ('advanced', 15), ('pro', 0)])
+        self.assertEqual(counts.tags[0], ('soup', 30))
+        self.assertEqual(counts.tags[1:], [('quick', 15), ('hot', 10)])
+
+    def test_estimated_counts(self):
+        app.config['FACET_SAMPLE_SIZE'] = 20
+        _, counts = facet_page(Facets([], True, [], (None, None), (None, None)), 10)
+        self.assertFalse(counts.exact)
+        self.assertEqual(counts.total, 60)
+
+    def test_parse_facets(self):
+        args = MultiDict([('tag', 'soup'), ('tag', ' soup '), ('tag', ''), ('match', 'any'), ('skill', 'pro'),
+                          ('skill', 'chef'), ('min_minutes', '10'), ('max_calories', 'lots')])
+        self.assertEqual(parse_facets(args), Facets(['soup'], False, ['pro'], (10, None), (None, None)))
+        args = MultiDict([('min_minutes', '9' * 23), ('max_minutes', '-' + '9' * 23), ('max_calories', '2147483647')])
+        self.assertEqual(parse_facets(args).minutes, (None, None))
+        self.assertEqual(parse_facets(args).calories, (None, 2147483647))
+        with app.test_client() as client:
+            self.assertEqual(client.get('/search/filter?min_minutes=' + '9' * 23).status_code, 200)
+
+    def test_view_keeps_filters(self):
+        app.config['MAX_SEARCH_RESULTS'], per_page = 5, app.config['MAX_SEARCH_RESULTS']
+        self.addCleanup(app.config.__setitem__, 'MAX_SEARCH_RESULTS', per_page)
+        with app.test_client() as client:
+            response = client.get('/search/filter?tag=soup&skill=beginner&skill=advanced&max_minutes=60')
+            self.assertEqual(response.status_code, 200)
+            page = response.get_data(as_text=True)
+            self.assertIn('name="skill" value="beginner" checked', page)
+            self.assertIn('tag=soup', page[page.index('class="pagination"'):])
+            self.assertIn('skill=advanced', page[page.index('class="pagination"'):])
+
+    def test_forms_store_level_names(self):
+        app.config['WTF_CSRF_ENABLED'], app.config['PASSWORD_HASH_ITERATIONS'] = False, 1000
+        self.addCleanup(app.config.update, WTF_CSRF_ENABLED=True, PASSWORD_HASH_ITERATIONS=150000)
+        db.session.add(User('alice', 'alice@example.com', 'secret'))
+        db.session.commit()
+        data = {'skill_level': '3', 'minutes': '5', 'calories': '5', 'description': '', 'body': ''}
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'alice', 'password': 'secret'})
+            self.assertEqual(client.post('/create_recipe', data=dict(data, name='Stew')).status_code, 302)
+            uuid = Recipe.query.filter_by(name='Stew').one().uuid
+            self.assertIn(b'<option selected value="3">pro', client.get('/recipe/{}/edit'.format(uuid)).data)
+            data = dict(data, name='Stew', skill_level='2')
+            self.assertEqual(client.post('/recipe/{}/edit'.format(uuid), data=data).status_code, 302)
+        db.session.remove()
+        stew = Recipe.query.filter_by(name='Stew').one()
+        self.assertEqual(stew.skill_level, 'advanced')
+        self.assertIn(stew.id, self.all_pages(Facets([], True, [], (None, None), (None, None)))[0])
+        self.assertIn(stew.id, self.all_pages(Facets([], True, ['advanced'], (None, None), (None, None)))[0])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
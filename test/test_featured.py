@@ -0,0 +1,47 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+from app.featured import featured, FeaturedPool
+from test import query_budget
+
+
+class FeaturedPoolCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+        db.session.add_all([Recipe('recipe{}'.format(i), self.testUser.id) for i in range(20)])
+        db.session.add_all([Tag('tag{}'.format(i)) for i in range(10)])
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        featured.refreshed_at = None
+        db.session.remove()
+        db.drop_all()
+
+    def test_snapshots(self):
+        pool = FeaturedPool()
+        recipes, tags = pool.pick(9, 6)
+        self.assertEqual(len(recipes), 9)
+        self.assertEqual(len(tags), 6)
+        self.assertTrue(all(r.author.username == 'bob' for r in recipes))
+
+    def test_cached_pick_skips_database(self):
+        pool = FeaturedPool()
+        pool.refresh()
+        with query_budget(self, 0):
+            for _ in range(5):
+                pool.pick(9, 6)
+
+    def test_index_page(self):
+        featured.refresh()
+        with app.test_client() as client, query_budget(self, 0):
+            response = client.get('/index')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'recipe-preview', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
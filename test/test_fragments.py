@@ -0,0 +1,107 @@
+import shutil
+import tempfile
+import unittest
+from app import db, app
+from app.models import User, Recipe, RecipeImage, Tag
+from app.fragments import current_cache
+from test import QueryCounter
+
+
+class FragmentCase(unittest.TestCase):
+    cache = 'memory'
+
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        app.config['FRAGMENT_CACHE'] = self.cache
+        db.create_all()
+        user = User('bob', 'bobsmail@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+        recipe = Recipe('Soup', user.id, description='Hot soup')
+        recipe.tags.append(Tag('soup'))
+        db.session.add(recipe)
+        db.session.commit()
+        self.user_id, self.recipe_id, self.uuid = user.id, recipe.id, recipe.uuid
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        app.config['FRAGMENT_CACHE'] = 'memory'
+
+    def get(self, url: str) -> str:
+        with app.test_client() as client:
+            response = client.get(url)
+        db.session.remove()
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def version(self) -> int:
+        return Recipe.query.get(self.recipe_id).version
+
+    def test_cached_page_skips_queries(self):
+        first = self.get('/recipe/' + self.uuid)
+        with QueryCounter() as counter:
+            second = self.get('/recipe/' + self.uuid)
+        def main(page): return page[page.index('<main>'):]     # The search form has a CSRF token per session
+        self.assertEqual(main(first), main(second))
+        self.assertEqual(len(counter), 1, '\n'.join(counter.statements))   # Only the recipe itself
+        self.assertIn('soup', second)
+        self.assertIn('Hot soup', second)
+
+    def test_edit_bumps_version(self):
+        self.get('/recipe/' + self.uuid)
+        recipe = Recipe.query.get(self.recipe_id)
+        recipe.description = 'Cold soup'
+        db.session.commit()
+        self.assertEqual(self.version(), 2)
+        self.assertIn('Cold soup', self.get('/recipe/' + self.uuid))
+
+    def test_tag_bumps_version(self):
+        self.get('/recipe/' + self.uuid)
+        Recipe.query.get(self.recipe_id).add_tag(Tag('starter'))
+        db.session.commit()
+        self.assertEqual(self.version(), 2)
+        self.assertIn('starter', self.get('/recipe/' + self.uuid))
+
+    def test_image_bumps_version(self):
+        db.session.add(RecipeImage('image.png', self.recipe_id))
+        db.session.commit()
+        self.assertEqual(self.version(), 2)
+
+    def test_author_rename_bumps_version(self):
+        self.get('/search/results/tag/soup')
+        User.query.get(self.user_id).username = 'robert'
+        db.session.commit()
+        self.assertEqual(self.version(), 2)
+        self.assertIn('robert', self.get('/search/results/tag/soup'))
+
+    def test_unchanged_keeps_version(self):
+        recipe = Recipe.query.get(self.recipe_id)
+        recipe.name = recipe.name
+        db.session.commit()
+        self.assertEqual(self.version(), 1)
+
+    def test_delete_forgets_fragments(self):
+        self.get('/tag/soup')
+        self.assertIsNotNone(current_cache().get('recipe-{}'.format(self.recipe_id)))
+        db.session.delete(Recipe.query.get(self.recipe_id))
+        db.session.commit()
+        self.assertIsNone(current_cache().get('recipe-{}'.format(self.recipe_id)))
+
+    def test_card_with_and_without_author(self):
+        self.assertNotIn('by: bob', self.get('/tag/soup'))
+        self.assertIn('by: bob', self.get('/search/results/tag/soup'))
+        self.assertNotIn('by: bob', self.get('/tag/soup'))
+
+
+class FilesystemFragmentCase(FragmentCase):
+    cache = 'filesystem'
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
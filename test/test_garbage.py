@@ -0,0 +1,111 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app import db, app
+from app.models import User, Recipe, RecipeImage, Blob
+from app import garbage
+from app.garbage import collect_garbage
+from app.storage import save_upload, current_storage
+
+
+class GarbageCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        user = User('bob', 'bobsmail@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+
+        storage = current_storage()
+        self.used, self.unused, self.fresh, self.left_over = [
+            save_upload(io.BytesIO(content), 'image.png') for content in (b'used', b'unused', b'fresh', b'left over')]
+        recipe = Recipe('Soup', user.id, thumbnail=self.used)
+        db.session.add(recipe)
+        db.session.flush()
+        db.session.add_all([RecipeImage(self.used, recipe.id), RecipeImage(self.unused, recipe.id),
+                            RecipeImage(self.left_over, None)])
+        db.session.commit()
+        db.session.delete(RecipeImage.query.filter_by(file_name=self.unused).one())   # Releases its reference
+        db.session.commit()
+        for name in (self.used, self.unused):
+            with open(os.path.join(app.config['VAR_FOLDER'], 'rendered'), 'wb') as f:
+                f.write(b'thumbnail')
+            storage.put('thumbnails/150/' + name, f.name)
+        os.remove(os.path.join(app.config['VAR_FOLDER'], 'rendered'))
+
+        old = time.time() - 3600
+        for key in storage.keys():
+            if self.fresh not in key:
+                os.utime(storage.local_path(key), (old, old))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        db.session.remove()
+        db.drop_all()
+
+    def test_dry_run(self):
+        before = sorted(current_storage().keys())
+        report = collect_garbage(60, dry_run=True, batch_size=2)
+        self.assertEqual((report.scanned, report.removed, report.images_removed), (6, 3, 1))
+        self.assertEqual(report.reclaimed_bytes, len(b'unused') + len(b'thumbnail') + len(b'left over'))
+        self.assertEqual(sorted(current_storage().keys()), before)
+        self.assertEqual(RecipeImage.query.count(), 2)
+
+    def test_collect(self):
+        report = collect_garbage(60, batch_size=2)
+        self.assertEqual((report.removed, report.images_removed), (3, 1))
+        self.assertEqual(sorted(current_storage().keys()), sorted(
+            ['images/' + self.used, 'images/' + self.fresh, 'thumbnails/150/' + self.used]))
+        self.assertEqual(sorted(b.name for b in Blob.query), sorted([self.used, self.fresh]))
+        self.assertEqual(collect_garbage(60).removed, 0)
+
+    def test_reupload_is_kept(self):
+        save_upload(io.BytesIO(b'unused'), 'again.png')     # Refreshes the modification time
+        self.assertTrue(current_storage().exists('images/' + self.unused))
+        collect_garbage(60)
+        self.assertTrue(current_storage().exists('images/' + self.unused))
+
+    def test_reupload_during_collection(self):
+        used_names = garbage._used_names
+
+        def reupload(names):    # Stored between the listing and the delete, its blob isn't committed yet
+            current_storage().save(io.BytesIO(b'unused'), 'png')
+            return used_names(names)
+        with mock.patch.object(garbage, '_used_names', side_effect=reupload):
+            collect_garbage(60)
+        self.assertTrue(current_storage().exists('images/' + self.unused))
+        self.assertFalse(current_storage().exists('images/' + self.left_over))
+
+    def test_only_images_and_thumbnails(self):
+        storage = current_storage()
+        orphan = save_upload(io.BytesIO(b'orphan'), 'image.png')
+        Blob.query.filter_by(name=orphan).delete()     # Like an upload of a transaction that failed
+        db.session.commit()
+        fragment = os.path.join(app.config['VAR_FOLDER'], 'fragments', 'entry')
+        os.makedirs(os.path.dirname(fragment))
+        with open(fragment, 'wb') as f:
+            f.write(b'fragment')
+        old = time.time() - 3600
+        for path in (fragment, storage.local_path('images/' + orphan)):
+            os.utime(path, (old, old))
+        collect_garbage(60)
+        self.assertTrue(os.path.exists(fragment))
+        self.assertFalse(storage.exists('images/' + orphan))
+
+    def test_drifted_refcount(self):
+        Blob.query.filter_by(name=self.used).update({'refcount': 0})
+        db.session.commit()
+        collect_garbage(60)
+        self.assertTrue(current_storage().exists('images/' + self.used))
+        self.assertTrue(current_storage().exists('thumbnails/150/' + self.used))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
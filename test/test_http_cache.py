@@ -0,0 +1,105 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+
+pages = ['/recipe/{uuid}', '/tag/soup', '/user/bob', '/search/results/tag/soup', '/search/results/recipe/soup']
+
+
+class AnonymousCacheCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.create_all()
+        user = User('bob', 'bobsmail@gmail.com', 'secret')
+        db.session.add(user)
+        db.session.commit()
+        recipe = Recipe('Soup', user.id, description='Hot soup')
+        recipe.tags.append(Tag('soup'))
+        db.session.add(recipe)
+        db.session.commit()
+        self.user_id, self.recipe_id = user.id, recipe.id
+        self.pages = [page.format(uuid=recipe.uuid) for page in pages]
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        app.config['WTF_CSRF_ENABLED'] = True
+        db.session.remove()
+        db.drop_all()
+
+    def test_no_session_cookie(self):
+        with app.test_client() as client:
+            for page in self.pages:
+                response = client.get(page)
+                self.assertEqual(response.status_code, 200, page)
+                self.assertNotIn('Set-Cookie', response.headers, page)
+                self.assertTrue(response.cache_control.public, page)
+                self.assertIn('cookie', response.vary, page)
+                self.assertIn('cookie', client.get(page, headers={'If-None-Match': response.headers['ETag']}).vary)
+
+    def test_revalidation(self):
+        with app.test_client() as client:
+            for page in self.pages:
+                etag = client.get(page).headers['ETag']
+                response = client.get(page, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304, page)
+                self.assertEqual(response.get_data(), b'')
+
+    def test_change_invalidates(self):
+        with app.test_client() as client:
+            etags = [client.get(page).headers['ETag'] for page in self.pages]
+            Recipe.query.get(self.recipe_id).description = 'Cold soup'
+            db.session.commit()
+            for page, etag in zip(self.pages, etags):
+                response = client.get(page, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200, page)
+
+    def test_last_modified(self):
+        with app.test_client() as client:
+            last_modified = client.get(self.pages[0]).headers['Last-Modified']
+            response = client.get(self.pages[0], headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+
+    def test_logged_in_is_private(self):
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            for page in self.pages:
+                response = client.get(page)
+                self.assertNotIn('ETag', response.headers, page)
+                self.assertFalse(response.cache_control.public, page)
+                self.assertIn('cookie', response.vary, page)
+            # Logged in page views don't write the session either
+            self.assertNotIn('Set-Cookie', client.get(self.pages[0]).headers)
+
+    def test_logout_returns_to_page(self):
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            response = client.get('/logout?next=%2Ftag%2Fsoup')
+            self.assertTrue(response.headers['Location'].endswith('/tag/soup'))
+            client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            response = client.get('/logout', headers={'Referer': 'http://localhost/user/bob'})
+            self.assertTrue(response.headers['Location'].endswith('/user/bob'))
+
+    def test_return_url_stays_on_site(self):
+        with app.test_client() as client:
+            for next_page in ('http://evil.example/', '//evil.example/', '/\\evil.example/', 'javascript:alert(1)'):
+                client.post('/login', data={'username': 'bob', 'password': 'secret'})
+                response = client.get('/logout', query_string={'next': next_page},
+                                      headers={'Referer': 'https://evil.example/tag/soup'})
+                self.assertEqual(response.headers['Location'], 'http://localhost/index', next_page)
+
+    def test_login_returns_to_page(self):
+        with app.test_client() as client:
+            self.assertIn('/login?next=%2Ftag%2Fsoup', client.get('/tag/soup').get_data(as_text=True))
+            response = client.post('/login?next=%2Ftag%2Fsoup', data={'username': 'bob', 'password': 'secret'})
+            self.assertTrue(response.headers['Location'].endswith('/tag/soup'))
+
+    def test_flashed_messages_are_private(self):
+        with app.test_client() as client:
+            client.get('/user/nobody')  # Flashes that the user does not exist
+            response = client.get('/tag/soup')
+            self.assertIn('nobody', response.get_data(as_text=True))
+            self.assertNotIn('ETag', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
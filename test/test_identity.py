@@ -0,0 +1,82 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe
+from app.identity import users, CachedUser, user_loader
+from test import query_budget
+
+
+class IdentityCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.create_all()
+        bob, alice = User('bob', 'bobsmail@gmail.com', 'secret'), User('alice', 'alice@gmail.com', 'secret')
+        db.session.add_all([bob, alice])
+        db.session.commit()
+        recipe = Recipe('Soup', alice.id, description='Hot soup')
+        db.session.add(recipe)
+        db.session.commit()
+        self.bob_id, self.uuid = bob.id, recipe.uuid
+        db.session.remove()
+        users.clear()
+
+    def tearDown(self) -> None:
+        app.config['WTF_CSRF_ENABLED'] = True
+        app.config['USER_CACHE_SECONDS'] = 30
+        users.clear()
+        db.session.remove()
+        db.drop_all()
+
+    def login(self, client):
+        client.post('/login', data={'username': 'bob', 'password': 'secret'})
+
+    def test_no_user_queries(self):
+        with app.test_client() as client:
+            self.login(client)
+            client.get('/recipe/' + self.uuid)    # Fills the fragment cache
+            with query_budget(self, 1):     # Only the recipe, neither the logged in user nor the author
+                response = client.get('/recipe/' + self.uuid)
+            self.assertIn('bob', response.get_data(as_text=True))
+            self.assertNotIn('Delete', response.get_data(as_text=True))
+
+    def test_loads_without_cache(self):
+        app.config['USER_CACHE_SECONDS'] = 0
+        with app.test_client() as client:
+            self.login(client)
+            client.get('/recipe/' + self.uuid)
+            with query_budget(self, 2) as counter:
+                client.get('/recipe/' + self.uuid)
+            self.assertEqual(len(counter), 2)
+
+    def test_edit_drops_entry(self):
+        with app.test_client() as client:
+            self.login(client)
+            client.get('/index')
+            self.assertEqual(users.get(self.bob_id).username, 'bob')
+            client.post('/user/bob/edit', data={'username': 'robert', 'email': 'bobsmail@gmail.com',
+                                                'about_me': ''})
+            self.assertIsNone(users.get(self.bob_id))
+            self.assertIn('/user/robert', client.get('/index').get_data(as_text=True))
+
+    def test_rollback_keeps_entry(self):
+        user_loader(str(self.bob_id))
+        User.query.get(self.bob_id).username = 'robert'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(users.get(self.bob_id).username, 'bob')
+
+    def test_equal_to_user(self):
+        cached = user_loader(str(self.bob_id))
+        self.assertIsInstance(cached, CachedUser)
+        self.assertEqual(cached, User.query.get(self.bob_id))
+        self.assertEqual(cached.recipes.count(), 0)
+        self.assertIsNone(user_loader('12345'))
+
+    def test_edit_needs_login(self):
+        with app.test_client() as client:
+            for page in ('/user/bob/edit', '/recipe/{}/edit'.format(self.uuid)):
+                self.assertIn('/login', client.get(page).headers['Location'], page)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,56 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+from test import query_budget, QueryCounter
+
+# Maximum number of SQL statements per anonymous page view, independent of the number of recipes shown
+budgets = {
+    '/tag/soup': 2,
+    '/search/results/tag/soup': 2,
+    '/search/results/recipe/soup': 2,
+    '/user/user1': 2,
+}
+
+
+class ListingQueryCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        users = [User('user{}'.format(i), 'user{}@gmail.com'.format(i)) for i in range(10)]
+        db.session.add_all(users)
+        db.session.commit()
+        soup = Tag('soup')
+        for i in range(40):
+            r = Recipe('soup {}'.format(i), users[i % 2 if i < 20 else i % 10].id)
+            r.tags.append(soup)
+            db.session.add(r)
+        db.session.commit()
+        db.session.remove()     # Nothing cached in the identity map
+
+    def tearDown(self) -> None:
+        app.config['MAX_SEARCH_RESULTS'] = 50
+        app.config['RECIPES_PER_PAGE'] = 30
+        db.session.remove()
+        db.drop_all()
+
+    def test_budgets(self):
+        with app.test_client() as client:
+            for url, budget in budgets.items():
+                with query_budget(self, budget):
+                    self.assertEqual(client.get(url).status_code, 200)
+
+    def test_constant_in_page_size(self):
+        with app.test_client() as client:
+            for url in budgets:
+                counts = []
+                for per_page in (2, 40):
+                    app.config['MAX_SEARCH_RESULTS'] = app.config['RECIPES_PER_PAGE'] = per_page
+                    with QueryCounter() as counter:
+                        client.get(url)
+                    db.session.remove()
+                    counts.append(len(counter))
+                self.assertEqual(counts[0], counts[1], url)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,76 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import config
+from app import app, db
+from app.media import IMMUTABLE_CACHE_CONTROL
+from app.storage import save_upload, is_hash_name
+
+
+class MediaCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        self.content = b'\x89PNG' + bytes(range(256)) * 40
+        self.name = save_upload(io.BytesIO(self.content), 'Photo.PNG')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        app.config['IMAGE_ACCEL_REDIRECT_PREFIX'] = ''
+        db.session.remove()
+        db.drop_all()
+
+    def test_hash_name(self):
+        self.assertTrue(is_hash_name(self.name))
+        self.assertTrue(self.name.endswith('.png'))
+
+    def test_conditional_requests(self):
+        url = '/image/images/' + self.name
+        with app.test_client() as client:
+            response = client.get(url)
+            self.assertEqual(response.data, self.content)
+            self.assertEqual(response.headers['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+            etag = response.headers['ETag']
+            self.assertEqual(etag, '"{}"'.format(self.name.split('.')[0]))
+
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            response = client.get(url, headers={'Range': 'bytes=4-7'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, bytes(range(4)))
+
+    def test_legacy_names(self):
+        with open(os.path.join(app.config['VAR_FOLDER'], 'images', 'old.png'), 'wb') as f:
+            f.write(self.content)
+        with app.test_client() as client:
+            response = client.get('/image/images/old.png')
+            self.assertEqual(client.get('/image/images/placeholder.png').status_code, 200)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
+    def test_accel_redirect(self):
+        app.config['IMAGE_ACCEL_REDIRECT_PREFIX'] = '/_var/'
+        with app.test_client() as client:
+            response = client.get('/image/images/' + self.name)
+            self.assertEqual(response.headers['X-Accel-Redirect'], '/_var/images/' + self.name)
+            self.assertEqual(response.mimetype, 'image/png')
+            self.assertEqual(response.data, b'')
+            self.assertEqual(client.get('/image/images/missing.png').status_code, 404)
+
+    def test_flag(self):
+        for value, expected in (('1', True), ('True', True), (' yes ', True), ('0', False), ('false', False),
+                                ('off', False), ('', False)):
+            with mock.patch.dict(os.environ, {'USE_X_SENDFILE': value}):
+                self.assertIs(config._flag('USE_X_SENDFILE'), expected, value)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,72 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe
+from app import metrics
+
+
+class MetricsCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['METRICS'] = True
+        db.create_all()
+        user = User('bob', 'bobsmail@gmail.com', 'secret')
+        db.session.add(user)
+        db.session.commit()
+        recipe = Recipe('Soup', user.id, description='Hot soup')
+        db.session.add(recipe)
+        db.session.commit()
+        self.uuid = recipe.uuid
+        db.session.remove()
+        metrics.endpoints.clear()
+
+    def tearDown(self) -> None:
+        app.config['METRICS'] = False
+        app.config['SLOW_QUERY_SECONDS'] = 0.5
+        db.session.remove()
+        db.drop_all()
+
+    def test_server_timing(self):
+        with app.test_client() as client:
+            timing = client.get('/recipe/' + self.uuid).headers['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="[1-9]\d* queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_endpoint_totals(self):
+        with app.test_client() as client:
+            client.get('/recipe/' + self.uuid)
+            client.get('/recipe/' + self.uuid)
+            client.get('/user/bob')
+        recipe = metrics.endpoints['recipe']
+        self.assertEqual(recipe.requests, 2)
+        self.assertGreater(recipe.queries, 0)
+        self.assertGreater(recipe.template_seconds, 0)
+        self.assertLessEqual(recipe.db_seconds + recipe.template_seconds, recipe.seconds)
+        self.assertEqual(sum(recipe.buckets), 2)
+        self.assertEqual(metrics.endpoints['user'].requests, 1)
+
+    def test_exposition(self):
+        with app.test_client() as client:
+            client.get('/user/bob')
+            response = client.get('/metrics')
+        self.assertEqual(response.mimetype, 'text/plain')
+        text = response.get_data(as_text=True)
+        self.assertIn('recipe_list_requests_total{endpoint="user"} 1\n', text)
+        self.assertIn('recipe_list_request_seconds_bucket{endpoint="user",le="+Inf"} 1\n', text)
+        self.assertIn('recipe_list_request_seconds_count{endpoint="user"} 1\n', text)
+        self.assertIn('# TYPE recipe_list_request_seconds histogram', text)
+
+    def test_disabled(self):
+        app.config['METRICS'] = False
+        with app.test_client() as client:
+            self.assertNotIn('Server-Timing', client.get('/user/bob').headers)
+            self.assertEqual(client.get('/metrics').status_code, 404)
+        self.assertEqual(len(metrics.endpoints), 0)
+
+    def test_slow_query_log(self):
+        app.config['SLOW_QUERY_SECONDS'] = 1e-9
+        with app.test_client() as client, self.assertLogs(app.logger, 'WARNING') as logs:
+            client.get('/user/bob')
+        self.assertTrue(any('Slow query in view user' in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
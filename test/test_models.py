@@ -1,6 +1,8 @@
 import unittest
+from sqlalchemy import exc
 from app import db, app
-from app.models import User, Tag, Recipe
+from app.models import User, Tag, Recipe, add_recipe
+from test import query_budget
 
 
 class UserModelCase(unittest.TestCase):
@@ -48,6 +50,26 @@ class RecipeModelCase(unittest.TestCase):
         self.assertNotEqual(r1.uuid, r2.uuid)
         self.assertEqual(Recipe.query.filter(Recipe.uuid == r1.uuid).count(), 1)
 
+    def test_construction_is_pure(self):
+        with query_budget(self, 0):
+            Recipe('testRecipe', self.testUser.id)
+
+    def test_uuid_collision_retry(self):
+        db.session.commit()
+        r = Recipe('testRecipe', self.testUser.id)
+        r.uuid = self.testRecipe.uuid
+        add_recipe(r)
+        db.session.commit()
+        self.assertNotEqual(r.uuid, self.testRecipe.uuid)
+        self.assertIsNotNone(r.id)
+
+    def test_duplicate_name_is_raised(self):
+        db.session.commit()
+        add_recipe(Recipe('testRecipe', self.testUser.id))
+        db.session.commit()
+        with self.assertRaises(exc.IntegrityError):
+            add_recipe(Recipe('testRecipe', self.testUser.id))
+
     def test_tagging(self):
         t1 = Tag('testTag1')
         db.session.add(t1)
@@ -59,6 +81,39 @@ class RecipeModelCase(unittest.TestCase):
         self.testRecipe.remove_tag(t1)
         self.assertFalse(self.testRecipe.has_tag(t1))
 
+    def tag_names(self):
+        db.session.expire_all()
+        return sorted(t.name for t in self.testRecipe.tags)
+
+    def test_tag_sets(self):
+        db.session.add(Tag('soup'))
+        db.session.commit()
+        self.testRecipe.id     # Load the recipe expired by the commit
+        with query_budget(self, 2):
+            self.testRecipe.add_tags(['soup', 'hot', 'hot', 'starter'])
+        db.session.commit()
+        self.assertEqual(self.tag_names(), ['hot', 'soup', 'starter'])
+        self.assertEqual(Tag.query.count(), 3)
+
+        self.testRecipe.remove_tags(['hot', 'unknown'])
+        db.session.commit()
+        self.assertEqual(self.tag_names(), ['soup', 'starter'])
+
+        self.testRecipe.id
+        with query_budget(self, 2):
+            self.testRecipe.set_tags(['soup', 'cold'])
+        db.session.commit()
+        self.assertEqual(self.tag_names(), ['cold', 'soup'])
+
+    def test_tag_set_flush_is_batched(self):
+        names = ['tag{}'.format(i) for i in range(30)]
+        db.session.add_all([Tag(name) for name in names])
+        db.session.commit()
+        self.testRecipe.add_tags(names)
+        with query_budget(self, 12):    # Not one statement per tag. Includes the counter and search index updates
+            db.session.commit()
+        self.assertEqual(len(self.tag_names()), 30)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime, timedelta
+from app import db, app
+from app.models import User, Recipe, Tag
+from app.pagination import recipe_page, encode_cursor
+from app.search import search_page, backends
+
+
+class PaginationCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+        self.tag = Tag('soups')
+        start = datetime(2020, 1, 1)
+        self.recipes = []
+        for i in range(11):
+            r = Recipe('soup {}'.format(i), self.testUser.id)
+            r.timestamp = start + timedelta(minutes=i // 2)     # Pairs of equal timestamps
+            r.tags.append(self.tag)
+            self.recipes.append(r)
+        db.session.add_all(self.recipes)
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        app.config['SEARCH_BACKEND'] = 'auto'
+        backends['memory'].clear()
+        db.session.remove()
+        db.drop_all()
+
+    def _walk(self, get_page, per_page):
+        """Walk all pages forward and back again, returning the items seen in both directions"""
+        forward, pages = [], []
+        page = get_page(per_page, None, None)
+        self.assertIsNone(page.prev_cursor)
+        while True:
+            pages.append(page)
+            forward.extend(page.items)
+            if page.next_cursor is None:
+                break
+            page = get_page(per_page, page.next_cursor, None)
+        backward = list(page.items)
+        while page.prev_cursor is not None:
+            page = get_page(per_page, None, page.prev_cursor)
+            backward = page.items + backward
+        self.assertEqual(page.items, pages[0].items)
+        return forward, backward
+
+    def test_recipe_pages(self):
+        expected = sorted(self.recipes, key=lambda r: (r.timestamp, r.id), reverse=True)
+        for per_page in (1, 3, 4, 11, 20):
+            forward, backward = self._walk(
+                lambda n, after, before: recipe_page(self.testUser.recipes, n, after, before), per_page)
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+
+    def test_tag_pages(self):
+        forward, _ = self._walk(lambda n, after, before: recipe_page(self.tag.recipes, n, after, before), 4)
+        self.assertEqual(len(forward), 11)
+
+    def test_search_pages(self):
+        for backend in ('fts5', 'memory', 'like'):
+            app.config['SEARCH_BACKEND'] = backend
+            forward, backward = self._walk(lambda n, after, before: search_page('soup', n, after, before), 3)
+            self.assertEqual(sorted(r.id for r in forward), sorted(r.id for r in self.recipes))
+            self.assertEqual(forward, backward)
+
+    def test_malformed_cursor(self):
+        page = recipe_page(self.testUser.recipes, 5, after='not a cursor')
+        self.assertEqual(len(page.items), 5)
+        self.assertIsNone(page.prev_cursor)
+        for key in (['2020-01-01T00:00:00', 10 ** 30], ['2020-01-01T00:00:00', -10 ** 30]):
+            page = recipe_page(self.testUser.recipes, 5, after=encode_cursor(key))
+            self.assertEqual(len(page.items), 5)
+            self.assertIsNone(page.prev_cursor)
+        with app.test_client() as client:
+            response = client.get('/search/results/recipe/soup?after=' + encode_cursor([1.0, 10 ** 30]))
+            self.assertEqual(response.status_code, 200)
+
+    def test_views(self):
+        app.config['RECIPES_PER_PAGE'] = 6
+        with app.test_client() as client:
+            first = client.get('/user/bob')
+            self.assertIn(b'soup 10', first.data)
+            self.assertIn(b'?after=', first.data)
+            self.assertNotIn(b'?before=', first.data)
+            self.assertEqual(client.get('/tag/soups').status_code, 200)
+            self.assertEqual(client.get('/search/results/recipe/soup').status_code, 200)
+            # Arguments named like the path's must not clash with it in the page links
+            app.config['MAX_SEARCH_RESULTS'], per_page = 6, app.config['MAX_SEARCH_RESULTS']
+            self.addCleanup(app.config.__setitem__, 'MAX_SEARCH_RESULTS', per_page)
+            for url in ('/user/bob?username=x', '/tag/soups?tag_name=x', '/search/results/recipe/soup?term=x&kind=x'):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                self.assertIn(b'?after=', response.data, url)
+                self.assertNotIn(b'=x', response.data, url)
+        app.config['RECIPES_PER_PAGE'] = 30
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,77 @@
+import time
+import unittest
+from app import db, app, passwords
+from app.models import User
+
+
+class PasswordCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        db.create_all()
+        user = User('bob', 'bobsmail@gmail.com', 'secret')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id, self.password_hash = user.id, user.password_hash
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        app.config['WTF_CSRF_ENABLED'] = True
+        app.config['PASSWORD_HASH_ALGORITHM'] = 'sha256'
+        app.config['PASSWORD_HASH_ITERATIONS'] = 150000
+        db.session.remove()
+        db.drop_all()
+
+    def stored_hash(self) -> str:
+        db.session.remove()
+        return User.query.get(self.user_id).password_hash
+
+    def test_policy(self):
+        self.assertTrue(self.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(passwords.needs_rehash(self.password_hash))
+        app.config['PASSWORD_HASH_ALGORITHM'] = 'sha512'
+        self.assertTrue(passwords.needs_rehash(self.password_hash))
+        self.assertLessEqual(len(passwords.hash_password('secret')), User.password_hash.type.length)
+
+    def test_default_iterations(self):
+        app.config['PASSWORD_HASH_ITERATIONS'] = 150000
+        self.assertFalse(passwords.needs_rehash('pbkdf2:sha256$salt$hash'))
+        self.assertTrue(passwords.needs_rehash('sha1$salt$hash'))
+
+    def test_other_policy_verifies(self):
+        app.config['PASSWORD_HASH_ITERATIONS'] = 2000
+        user = User.query.get(self.user_id)
+        self.assertTrue(user.check_password('secret'))
+        self.assertFalse(user.check_password('wrong'))
+
+    def test_rehash(self):
+        app.config['PASSWORD_HASH_ITERATIONS'] = 2000
+        passwords.rehash_later(self.user_id, self.password_hash, 'secret').result()
+        new_hash = self.stored_hash()
+        self.assertTrue(new_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(User.query.get(self.user_id).check_password('secret'))
+
+    def test_rehash_skips_changed_password(self):
+        user = User.query.get(self.user_id)
+        user.set_password('changed')
+        db.session.commit()
+        changed = user.password_hash
+        app.config['PASSWORD_HASH_ITERATIONS'] = 2000
+        passwords.rehash_later(self.user_id, self.password_hash, 'secret').result()
+        self.assertEqual(self.stored_hash(), changed)
+
+    def test_login_rehashes(self):
+        app.config['PASSWORD_HASH_ALGORITHM'] = 'sha512'
+        with app.test_client() as client:
+            response = client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            self.assertEqual(response.status_code, 302)
+        for _ in range(100):    # The rehash runs in the background
+            if self.stored_hash().startswith('pbkdf2:sha512:1000$'):
+                break
+            time.sleep(0.05)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha512:1000$'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,56 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+from app.sampling import random_rows, random_row, samplers
+
+
+class SamplingCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        app.config['RANDOM_SAMPLER'] = 'auto'
+        db.session.remove()
+        db.drop_all()
+
+    def _add_recipes(self, count: int):
+        db.session.add_all([Recipe('recipe{}'.format(i), self.testUser.id) for i in range(count)])
+        db.session.commit()
+
+    def test_empty_table(self):
+        self.assertEqual(random_rows(Recipe, 9), [])
+        self.assertIsNone(random_row(Recipe))
+
+    def test_small_table(self):
+        self._add_recipes(4)
+        self.assertEqual(len(random_rows(Recipe, 9)), 4)
+
+    def test_distinct_rows(self):
+        self._add_recipes(50)
+        for name in ('id_range', 'order_by_random'):
+            app.config['RANDOM_SAMPLER'] = name
+            rows = random_rows(Recipe, 9)
+            self.assertEqual(len(rows), 9)
+            self.assertEqual(len({r.id for r in rows}), 9)
+
+    def test_sparse_ids(self):
+        self._add_recipes(200)
+        # Leave only a few rows far apart, so drawing random ids mostly hits gaps
+        Recipe.query.filter(Recipe.id % 50 != 0).delete(synchronize_session=False)
+        db.session.commit()
+        rows = samplers['id_range'](Recipe, 3)
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(r.id % 50 == 0 for r in rows))
+
+    def test_other_models(self):
+        db.session.add_all([Tag('tag{}'.format(i)) for i in range(10)])
+        db.session.commit()
+        self.assertEqual(len(random_rows(Tag, 6)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,106 @@
+import unittest
+from app import db, app
+from app.models import User, Recipe, Tag
+from app.search import search_recipes, reindex, query_terms, backends
+
+
+class SearchCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+        self.soup = Recipe('Tomato soup', self.testUser.id, description='Warm and red', body='Boil the tomatoes')
+        self.salad = Recipe('Greek salad', self.testUser.id, description='With tomato and feta', body='Chop')
+        self.bread = Recipe('Bread', self.testUser.id, body='Knead the dough')
+        db.session.add_all([self.soup, self.salad, self.bread])
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        app.config['SEARCH_BACKEND'] = 'auto'
+        db.session.remove()
+        db.drop_all()
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms('Tomato "soup" OR*'), ['tomato', 'soup', 'or'])
+        self.assertEqual(search_recipes('"*', 10), [])
+
+    def test_ranking(self):
+        self.assertEqual(search_recipes('tomato', 10), [self.soup, self.salad])
+        self.assertEqual(search_recipes('dough', 10), [self.bread])
+        self.assertEqual(search_recipes('tom sou', 10), [self.soup])
+
+    def test_sync(self):
+        self.bread.name = 'Sourdough'
+        db.session.commit()
+        self.assertEqual(search_recipes('sourdough', 10), [self.bread])
+
+        self.bread.add_tag(Tag('baking'))
+        db.session.commit()
+        self.assertEqual(search_recipes('baking', 10), [self.bread])
+
+        db.session.delete(self.soup)
+        db.session.commit()
+        self.assertEqual(search_recipes('tomato', 10), [self.salad])
+
+    def test_reindex(self):
+        db.session.execute(Recipe.__table__.insert(), [{'name': 'Pancakes', 'user_id': self.testUser.id}])
+        self.assertEqual(search_recipes('pancakes', 10), [])
+        reindex()
+        db.session.commit()
+        self.assertEqual(len(search_recipes('pancakes', 10)), 1)
+
+    def test_like_backend(self):
+        app.config['SEARCH_BACKEND'] = 'like'
+        self.assertEqual(search_recipes('Tomato', 10), [self.soup])
+
+
+class MemorySearchCase(SearchCase):
+    """Runs the search tests against the in-process index"""
+    def setUp(self) -> None:
+        super().setUp()
+        app.config['SEARCH_BACKEND'] = 'memory'
+        reindex()   # Build the index, so later changes go through the ORM events
+
+    def tearDown(self) -> None:
+        backends['memory'].clear()
+        super().tearDown()
+
+    def test_ranking(self):
+        # The memory index orders by recency instead of relevance
+        self.assertEqual(search_recipes('tomato', 10), [self.salad, self.soup])
+        self.assertEqual(search_recipes('dough', 10), [self.bread])
+        self.assertEqual(search_recipes('tom sou', 10), [self.soup])
+        self.assertEqual(search_recipes('tomato', 1), [self.salad])
+
+    def test_like_backend(self):
+        self.skipTest('Only runs with the default backend')
+
+    def test_changes_of_other_workers(self):
+        # Core statements skip the ORM events, like writes of another worker
+        db.session.execute(Recipe.__table__.update().where(Recipe.id == self.bread.id).values(name='Sourdough'))
+        db.session.commit()
+        self.assertEqual(search_recipes('sourdough', 10), [])
+        backends['memory'].checked_at -= app.config['SEARCH_INDEX_CHECK_SECONDS']
+        self.assertEqual(search_recipes('sourdough', 10), [self.bread])
+
+    def test_rollback(self):
+        self.bread.name = 'Sourdough'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(search_recipes('sourdough', 10), [])
+
+    def test_tag_removal(self):
+        tag = Tag('baking')
+        self.bread.add_tag(tag)
+        db.session.commit()
+        self.assertEqual(search_recipes('baking', 10), [self.bread])
+        self.bread.remove_tag(tag)
+        db.session.commit()
+        self.assertEqual(search_recipes('baking', 10), [])
+        self.assertEqual(search_recipes('dough', 10), [self.bread])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
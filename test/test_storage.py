@@ -0,0 +1,235 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from PIL import Image
+from sqlalchemy import event, exc
+from app import db, app
+from app.models import User, Recipe, RecipeImage, Blob
+from app.storage import save_upload, current_storage, storages, upload_pool, register_uploads
+from app.garbage import collect_garbage
+from app.thumbnails import render_stored, thumbnail_key
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+class StorageCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        self.testUser = User('bob', 'bobsmail@gmail.com')
+        db.session.add(self.testUser)
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        db.session.remove()
+        db.drop_all()
+
+    def _refcount(self, name):
+        return db.session.query(Blob.refcount).filter_by(name=name).scalar()
+
+    def test_deduplication(self):
+        content = os.urandom(300 * 1024)   # Several chunks
+        name = save_upload(io.BytesIO(content), 'a.jpg')
+        self.assertEqual(save_upload(io.BytesIO(content), 'b.JPG'), name)
+        db.session.commit()
+        self.assertEqual(list(current_storage().keys('images/')), ['images/' + name])
+        self.assertEqual(Blob.query.get(name).size, len(content))
+        with current_storage().fetch('images/' + name) as path, open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_reference_counts(self):
+        first = save_upload(io.BytesIO(b'first'), 'a.png')
+        second = save_upload(io.BytesIO(b'second'), 'b.png')
+        recipe = Recipe('Soup', self.testUser.id, thumbnail=first)
+        db.session.add(recipe)
+        db.session.flush()
+        db.session.add_all([RecipeImage(first, recipe.id), RecipeImage(second, recipe.id),
+                            RecipeImage('placeholder.png', recipe.id)])
+        db.session.commit()
+        self.assertEqual((self._refcount(first), self._refcount(second)), (2, 1))
+
+        recipe.thumbnail = second
+        db.session.commit()
+        self.assertEqual((self._refcount(first), self._refcount(second)), (1, 2))
+
+        db.session.delete(recipe)   # Deletes its images as well
+        db.session.commit()
+        self.assertEqual((self._refcount(first), self._refcount(second)), (0, 0))
+        self.assertEqual(RecipeImage.query.count(), 0)
+
+    def test_rollback(self):
+        name = save_upload(io.BytesIO(b'content'), 'a.png')
+        db.session.add(Recipe('Soup', self.testUser.id, thumbnail=name))
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNone(self._refcount(name))
+
+    def test_concurrent_store(self):
+        contents = [os.urandom(100 * 1024) for _ in range(8)]
+        uploads = upload_pool.store([(io.BytesIO(content), 'image{}.png'.format(i))
+                                     for i, content in enumerate(contents + contents[:1])])
+        self.assertEqual([upload.created for upload in uploads], [True] * 8 + [False])
+        self.assertEqual(uploads[0].name, uploads[-1].name)
+        for upload, content in zip(uploads, contents):
+            self.assertEqual(upload.size, len(content))
+            with current_storage().fetch('images/' + upload.name) as path, open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+        register_uploads(uploads)
+        db.session.commit()
+        self.assertEqual(Blob.query.count(), 8)
+
+    def test_concurrent_blob_insert(self):
+        name = upload_pool.store([(io.BytesIO(b'content'), 'a.png')])[0].name
+        raced = []
+
+        def insert_after_lookup(conn, cursor, statement, parameters, context, executemany):
+            # Another transaction inserts the row between the lookup and the insert
+            if statement.startswith('SELECT blob.name') and not raced:
+                raced.append(name)
+                cursor.connection.execute('INSERT INTO blob (name, size, refcount) VALUES (?, 7, 0)', (name,))
+        event.listen(db.engine, 'after_cursor_execute', insert_after_lookup)
+        self.addCleanup(event.remove, db.engine, 'after_cursor_execute', insert_after_lookup)
+        for register in (True, False):    # By register_uploads, or by the references of a flush
+            Blob.query.filter_by(name=name).delete()
+            Recipe.query.delete()
+            db.session.commit()
+            raced.clear()
+            if register:
+                register_uploads([upload_pool.store([(io.BytesIO(b'content'), 'a.png')])[0]])
+            db.session.add(Recipe('Soup', self.testUser.id, thumbnail=name))
+            db.session.commit()
+            self.assertEqual(self._refcount(name), 1)
+
+
+class CreateRecipeCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        app.config['THUMBNAIL_EXECUTOR'] = 'inline'
+        db.create_all()
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        user = User('bob', 'bobsmail@gmail.com', 'secret')
+        db.session.add(user)
+        db.session.add(Recipe('Soup', 1))
+        db.session.commit()
+        db.session.remove()
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'bob', 'password': 'secret'})
+
+    def tearDown(self) -> None:
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        app.config['WTF_CSRF_ENABLED'] = True
+        app.config['PASSWORD_HASH_ITERATIONS'] = 150000
+        app.config['THUMBNAIL_EXECUTOR'] = 'process'
+        db.session.remove()
+        db.drop_all()
+
+    @staticmethod
+    def _png(color: str) -> io.BytesIO:
+        stream = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(stream, 'PNG')
+        stream.seek(0)
+        return stream
+
+    def create(self, name: str, colors: list):
+        return self.client.post('/create_recipe', content_type='multipart/form-data', data={
+            'name': name, 'skill_level': '0', 'minutes': '5', 'calories': '5',
+            'recipe_images': [(self._png(color), '{}.png'.format(color)) for color in colors]})
+
+    def stored(self) -> list:
+        return sorted(current_storage().keys('images/'))
+
+    def test_one_transaction(self):
+        commits = []
+        count_commit = commits.append
+        event.listen(db.engine, 'commit', count_commit)
+        try:
+            response = self.create('Stew', ['red', 'green', 'blue'])
+        finally:
+            event.remove(db.engine, 'commit', count_commit)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(commits), 1)
+        recipe = Recipe.query.filter_by(name='Stew').one()
+        names = [image.file_name for image in recipe.images.order_by(RecipeImage.id)]
+        self.assertEqual(len(set(names)), 3)
+        self.assertEqual(recipe.thumbnail, names[0])
+        self.assertEqual(self.stored(), sorted('images/' + name for name in names))
+        self.assertEqual([blob.refcount for blob in Blob.query.order_by(Blob.name)], sorted(
+            [2 if name == names[0] else 1 for name in names]))
+
+    def test_files_collected_after_failure(self):
+        self.create('Stew', ['red'])
+        before = self.stored()
+        error = exc.OperationalError('INSERT', {}, Exception('disk I/O error'))
+        with mock.patch('app.routes.register_uploads', side_effect=error):
+            self.assertEqual(self.create('Curry', ['red', 'green']).status_code, 500)
+        self.assertIsNone(Recipe.query.filter_by(name='Curry').first())
+        self.assertEqual(len(self.stored()), 2)     # Left for the grace period, a concurrent request may use green
+        collect_garbage(0)
+        self.assertEqual(self.stored(), before)     # Only the new image is gone, red is still used
+
+    def test_duplicate_name_race(self):
+        with mock.patch('app.forms.has_recipe_named', return_value=False):
+            page = self.create('Soup', ['red']).get_data(as_text=True)
+        self.assertIn('You can only have one recipe with that name', page)
+        self.assertEqual(Recipe.query.count(), 1)
+        collect_garbage(0)
+        self.assertEqual(self.stored(), [])
+
+
+@unittest.skipIf(mock_aws is None, 'moto is not installed')
+class S3StorageCase(StorageCase):
+    """Runs against moto's in-process S3 stand-in"""
+    def setUp(self) -> None:
+        for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+            os.environ[variable] = 'testing'
+        os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+        self.mock = mock_aws()
+        self.mock.start()
+        storages['s3']._clients.clear()
+        app.config.update(BLOB_STORAGE='s3', S3_BUCKET='recipes', S3_PREFIX='test/')
+        storages['s3'].client.create_bucket(Bucket='recipes')
+        super().setUp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        app.config.update(BLOB_STORAGE='local', S3_BUCKET='', S3_PREFIX='')
+        storages['s3']._clients.clear()
+        self.mock.stop()
+
+    def test_serving(self):
+        name = save_upload(io.BytesIO(bytes(range(256))), 'a.png')
+        with app.test_client() as client:
+            response = client.get('/image/images/' + name)
+            self.assertEqual(response.data, bytes(range(256)))
+            self.assertEqual(response.mimetype, 'image/png')
+            response = client.get('/image/images/' + name, headers={'Range': 'bytes=10-19'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, bytes(range(10, 20)))
+            self.assertEqual(client.get('/image/images/missing.png').status_code, 404)
+
+    def test_thumbnails(self):
+        stream = io.BytesIO()
+        Image.new('RGB', (600, 400), 'blue').save(stream, 'JPEG')
+        stream.seek(0)
+        name = save_upload(stream, 'photo.jpg')
+        render_stored('images/' + name, name, [150])
+        self.assertTrue(current_storage().exists(thumbnail_key(name, 150)))
+        self.assertFalse(os.listdir(app.config['VAR_FOLDER']))    # Nothing stored locally
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from PIL import Image
+from app import db, app
+from app.models import User, Recipe
+from app.thumbnails import render, thumbnail_queue, thumbnail_key
+from app.storage import current_storage
+
+
+class ThumbnailCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.var_folder = app.config['VAR_FOLDER']
+        app.config['VAR_FOLDER'] = tempfile.mkdtemp()
+        app.config['THUMBNAIL_EXECUTOR'] = 'inline'
+        os.mkdir(os.path.join(app.config['VAR_FOLDER'], 'images'))
+        self.source = os.path.join(app.config['VAR_FOLDER'], 'images', 'photo.jpg')
+        Image.new('RGB', (1200, 800), 'red').save(self.source)
+
+    def tearDown(self) -> None:
+        thumbnail_queue.shutdown()
+        shutil.rmtree(app.config['VAR_FOLDER'])
+        app.config['VAR_FOLDER'] = self.var_folder
+        app.config['THUMBNAIL_EXECUTOR'] = 'process'
+        db.session.remove()
+        db.drop_all()
+
+    def test_render(self):
+        directory = os.path.join(app.config['VAR_FOLDER'], 'thumbnails')
+        written = render(self.source, directory, 'photo.jpg', [150, 300])
+        with Image.open(written[0]) as small, Image.open(written[1]) as large:
+            self.assertEqual(small.size, (150, 100))
+            self.assertEqual(large.size, (300, 200))
+        self.assertEqual(sorted(os.listdir(os.path.join(directory, '150'))), ['photo.jpg'])    # No temporary files
+
+    def test_placeholder_until_ready(self):
+        app.config['THUMBNAIL_EXECUTOR'] = 'thread'
+        with app.test_client() as client:
+            response = client.get('/thumbnail/150/photo.jpg')
+            self.assertIn('no-cache', response.headers['Cache-Control'])
+            thumbnail_queue.shutdown()  # Wait for the worker
+            self.assertTrue(current_storage().exists(thumbnail_key('photo.jpg', 300)))
+            response = client.get('/thumbnail/150/photo.jpg')
+            self.assertEqual(response.mimetype, 'image/jpeg')
+            self.assertLess(len(response.data), os.path.getsize(self.source))
+            self.assertEqual(client.get('/thumbnail/151/photo.jpg').status_code, 404)
+
+    def test_invalid_image(self):
+        with open(os.path.join(app.config['VAR_FOLDER'], 'images', 'broken.png'), 'w') as f:
+            f.write('not an image')
+        thumbnail_queue.submit('broken.png')
+        self.assertFalse(current_storage().exists(thumbnail_key('broken.png', 150)))
+
+    def test_listing_srcset(self):
+        user = User('bob', 'bobsmail@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Recipe('Soup', user.id, thumbnail='photo.jpg'))
+        db.session.commit()
+        with app.test_client() as client:
+            data = client.get('/user/bob').data
+        self.assertIn(b'src="/thumbnail/150/photo.jpg"', data)
+        self.assertIn(b'/thumbnail/300/photo.jpg 2x', data)
+
+    def test_placeholder_name(self):
+        user = User('bob', 'bobsmail@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Recipe('Soup', user.id, thumbnail='placeholder.png'))   # As create_recipe stores it
+        db.session.commit()
+        with app.test_client() as client, mock.patch.object(thumbnail_queue, 'submit') as submit:
+            data = client.get('/user/bob').data
+            self.assertIn(b'src="/static/images/placeholder.png"', data)
+            self.assertNotIn(b'/thumbnail/', data)
+            response = client.get('/thumbnail/150/placeholder.png')     # Links from cached pages
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('no-cache', response.headers.get('Cache-Control', ''))
+        submit.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,96 @@
+import unittest
+from unittest import mock
+from sqlalchemy import exc
+from app import db, app
+from app.models import User, Recipe, Blob, violated_constraint
+from test import QueryCounter
+
+
+class UniquenessCase(unittest.TestCase):
+    def setUp(self) -> None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        db.create_all()
+        bob, alice = User('bob', 'bob@example.com', 'secret'), User('alice', 'alice@example.com', 'secret')
+        db.session.add_all([bob, alice])
+        db.session.commit()
+        db.session.add_all([Recipe('Soup', bob.id), Recipe('Stew', bob.id)])
+        db.session.commit()
+        self.uuid = Recipe.query.filter_by(name='Soup').one().uuid
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        app.config['WTF_CSRF_ENABLED'] = True
+        app.config['PASSWORD_HASH_ITERATIONS'] = 150000
+        db.session.remove()
+        db.drop_all()
+
+    def register(self, client, username: str, email: str):
+        return client.post('/register', data={'username': username, 'email': email, 'password': 'x',
+                                              'password2': 'x'})
+
+    def test_registration_one_query(self):
+        with app.test_client() as client:
+            with QueryCounter() as counter:
+                page = self.register(client, 'bob', 'alice@example.com').get_data(as_text=True)
+            self.assertEqual(len(counter), 1)
+            self.assertIn('Please use a different username.', page)
+            self.assertIn('Please use a different email address.', page)
+            self.assertEqual(self.register(client, 'carol', 'carol@example.com').status_code, 302)
+        self.assertEqual(User.query.count(), 3)
+
+    def test_registration_race(self):
+        with app.test_client() as client, mock.patch('app.forms.taken_user_fields', return_value=set()):
+            response = self.register(client, 'carol', 'bob@example.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Please use a different email address.', response.get_data(as_text=True))
+
+    def test_edit_user(self):
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            with QueryCounter() as counter:
+                page = client.post('/user/bob/edit', data={'username': 'bob', 'email': 'alice@example.com'})
+            self.assertIn('Please use a different email address.', page.get_data(as_text=True))
+            self.assertEqual(sum('user.email =' in statement for statement in counter.statements), 1)
+            response = client.post('/user/bob/edit', data={'username': 'bob', 'email': 'bob@example.com',
+                                                           'about_me': 'Cook'})
+            self.assertEqual(response.status_code, 302)
+            with mock.patch('app.forms.taken_user_fields', return_value=set()):
+                page = client.post('/user/bob/edit', data={'username': 'alice', 'email': 'bob@example.com'})
+            self.assertIn('Please use a different username.', page.get_data(as_text=True))
+
+    def test_recipe_names(self):
+        with app.test_client() as client:
+            client.post('/login', data={'username': 'bob', 'password': 'secret'})
+            page = client.post('/create_recipe', data={'name': 'Soup', 'skill_level': '0'}).get_data(as_text=True)
+            self.assertIn('You can only have one recipe with that name', page)
+            edit = '/recipe/{}/edit'.format(self.uuid)
+            data = {'name': 'Soup', 'skill_level': '0', 'minutes': '5', 'calories': '5'}
+            self.assertEqual(client.post(edit, data=data).status_code, 302)     # Keeps its own name
+            page = client.post(edit, data=dict(data, name='Stew'), follow_redirects=True).get_data(as_text=True)
+            self.assertIn('You can only have one recipe with that name', page)
+            with mock.patch('app.routes.has_recipe_named', return_value=False):
+                page = client.post(edit, data=dict(data, name='Stew'), follow_redirects=True)
+            self.assertIn('You can only have one recipe with that name', page.get_data(as_text=True))
+        self.assertEqual(Recipe.query.filter_by(uuid=self.uuid).one().name, 'Soup')
+
+    def test_violated_constraint(self):
+        db.session.add(Blob('soup.png'))
+        db.session.commit()
+        db.session.add(Blob('soup.png'))
+        with self.assertRaises(exc.IntegrityError) as raised:
+            db.session.commit()
+        db.session.rollback()
+        self.assertEqual(violated_constraint(raised.exception), 'blob.name')
+
+        # Postgres names the constraint. Its message echoes the values, which mustn't be matched
+        orig = mock.Mock(diag=mock.Mock(constraint_name='ix_user_email'))
+        orig.__str__ = lambda self: 'DETAIL:  Key (email)=(username@example.com) already exists.'
+        error = exc.IntegrityError('INSERT', {}, orig)
+        with mock.patch.object(db.engine.dialect, 'name', 'postgresql'):
+            self.assertEqual(violated_constraint(error), 'user.email')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)